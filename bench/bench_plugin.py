@@ -0,0 +1,210 @@
+"""投骰与 KV 热路径的基准测试
+
+通过 fake_astrbot 离线驱动插件的指令与 LLM 工具，按不同存储规模
+（用户数）和表达式测量吞吐量与 p50/p99 延迟，结果保存为 JSON 便于比较。
+
+用法:
+    python bench/bench_plugin.py
+    python bench/bench_plugin.py --sizes 10 1000 --iterations 500 --backend sqlite
+    python bench/bench_plugin.py --compare bench/results/bench-旧.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import fake_astrbot
+
+# 插件目录（bench 的上一级），按目录名作为包导入
+_PLUGIN_DIR = Path(__file__).resolve().parent.parent
+# 默认的结果目录
+_RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# 默认的存储规模（用户数）
+DEFAULT_SIZES = (10, 1000, 100_000)
+# 投骰场景使用的表达式
+EXPRESSIONS = ("1d20", "100d6+5", "(2d6+1d8)*2", "1d20+str")
+# 每个用户预置的列表项个数，用于前缀查询
+_ITEMS_PER_USER = 10
+
+
+def import_plugin():
+    """注入 astrbot 替身并导入插件包，返回 (main 模块, kv_store 模块)"""
+    fake_astrbot.install()
+    sys.path.insert(0, str(_PLUGIN_DIR.parent))
+    package = _PLUGIN_DIR.name
+    return (
+        importlib.import_module(f"{package}.main"),
+        importlib.import_module(f"{package}.kv_store"),
+    )
+
+
+def user_id(i: int) -> str:
+    return f"bench{i}"
+
+
+def make_snapshot(size: int) -> dict:
+    """生成 size 个用户的预置数据"""
+    data = {}
+    for i in range(size):
+        storage = {"str": 3, "生命": 30, "经验": 20, "力量": 15}
+        for j in range(_ITEMS_PER_USER):
+            storage[f"item{j:02d}"] = f"道具{j}"
+        data[f"user_{user_id(i)}"] = storage
+    return data
+
+
+def scenarios(plugin, Event):
+    """返回 [(场景名, 调用函数)]，调用函数接收用户序号并返回协程"""
+
+    async def drain(handler, event):
+        async for _ in handler(event):
+            pass
+
+    result = []
+    for expr in EXPRESSIONS:
+        result.append((f"/r {expr}", lambda u, e=expr: drain(plugin.roll_dice, Event(f"/r {e}", user_id(u)))))
+        result.append((f"roll_dice {expr}", lambda u, e=expr: plugin.llm_roll_dice(Event("", user_id(u)), e)))
+    result += [
+        ("/kv get", lambda u: drain(plugin.kv_command, Event("/kv get 生命", user_id(u)))),
+        ("/kv set", lambda u: drain(plugin.kv_command, Event("/kv set 生命30 经验20", user_id(u)))),
+        ("/kv list", lambda u: drain(plugin.kv_command, Event("/kv list item", user_id(u)))),
+        ("kv_read", lambda u: plugin.kv_read(Event("", user_id(u)), "生命")),
+        ("kv_upsert", lambda u: plugin.kv_upsert(Event("", user_id(u)), key="hp", value=u)),
+        ("kv_list", lambda u: plugin.kv_list(Event("", user_id(u)), prefix="item")),
+        ("kv_upsert_batch", lambda u: plugin.kv_upsert_batch(Event("", user_id(u)), {"user": {"hp": u, "mp": u}})),
+        ("ability_check", lambda u: plugin.llm_ability_check(Event("", user_id(u)), "力量")),
+    ]
+    return result
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+async def measure(call, size: int, iterations: int, warmup: int, rng: random.Random) -> dict:
+    """对随机用户调用 iterations 次，返回吞吐量与延迟分位数（微秒）"""
+    for _ in range(warmup):
+        await call(rng.randrange(size))
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        u = rng.randrange(size)
+        t0 = time.perf_counter_ns()
+        await call(u)
+        latencies.append((time.perf_counter_ns() - t0) / 1000)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / elapsed, 1),
+        "p50_us": round(percentile(latencies, 50), 1),
+        "p99_us": round(percentile(latencies, 99), 1),
+        "max_us": round(latencies[-1], 1),
+    }
+
+
+async def bench_size(main, kv_store, size: int, args) -> list:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="dice-bench-") as tmp:
+        main._KV_FILE = Path(tmp) / "kv.json"
+        main._HISTORY_FILE = Path(tmp) / "history.jsonl"
+        kv_store.write_snapshot(main._KV_FILE, make_snapshot(size))
+
+        # 基准测试反复调用同一批用户，关闭限流
+        config = {
+            "kv_backend": args.backend,
+            "kv_max_resident": args.max_resident,
+            "rate_limit_per_minute": 0,
+            "rate_limit_group_per_minute": 0,
+        }
+        plugin = main.MyPlugin(fake_astrbot.Context(), config)
+        t0 = time.perf_counter()
+        await plugin.initialize()
+        rows = [{"size": size, "scenario": "initialize", "ms": round((time.perf_counter() - t0) * 1000, 2)}]
+
+        for name, call in scenarios(plugin, fake_astrbot.FakeEvent):
+            if args.only and not any(s in name for s in args.only):
+                continue
+            row = {"size": size, "scenario": name}
+            row.update(await measure(call, size, args.iterations, args.warmup, rng))
+            rows.append(row)
+            print(f"{size:>7} {name:<28} {row['ops_per_sec']:>10.1f} ops/s  "
+                  f"p50 {row['p50_us']:>9.1f}us  p99 {row['p99_us']:>9.1f}us")
+
+        print(f"{size:>7} {plugin._kv.cache_summary()}")
+        t0 = time.perf_counter()
+        await plugin.terminate()
+        rows.append({"size": size, "scenario": "terminate", "ms": round((time.perf_counter() - t0) * 1000, 2)})
+    return rows
+
+
+def compare(results: list, baseline_path: Path):
+    """与之前的结果逐项比较 p50 与吞吐量"""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    old = {(r["size"], r["scenario"]): r for r in baseline["results"] if "ops_per_sec" in r}
+    print(f"\n与 {baseline_path} 比较（比值 = 本次 / 基线）:")
+    for row in results:
+        before = old.get((row["size"], row["scenario"]))
+        if before is None or "ops_per_sec" not in row:
+            continue
+        print(f"{row['size']:>7} {row['scenario']:<28} "
+              f"ops/s x{row['ops_per_sec'] / before['ops_per_sec']:.2f}  "
+              f"p50 x{row['p50_us'] / max(before['p50_us'], 1e-9):.2f}  "
+              f"p99 x{row['p99_us'] / max(before['p99_us'], 1e-9):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simple_dice 插件基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="存储规模（用户数）")
+    parser.add_argument("--iterations", type=int, default=2000, help="每个场景的调用次数")
+    parser.add_argument("--warmup", type=int, default=100, help="每个场景的预热次数")
+    parser.add_argument("--backend", default="json", choices=("json", "journal", "sqlite", "sharded"), help="KV 后端")
+    parser.add_argument("--max-resident", type=int, default=0, help="KV 常驻项数上限，0 表示不限")
+    parser.add_argument("--only", nargs="*", help="只运行名称包含这些字符串的场景")
+    parser.add_argument("--seed", type=int, default=0, help="选择用户的随机种子")
+    parser.add_argument("--output", type=Path, help="结果 JSON 路径，默认写入 bench/results/")
+    parser.add_argument("--compare", type=Path, help="与之前的结果 JSON 比较")
+    args = parser.parse_args()
+
+    plugin_main, kv_store = import_plugin()
+    results = []
+    for size in args.sizes:
+        results += asyncio.run(bench_size(plugin_main, kv_store, size, args))
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    report = {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": numpy_version,
+            "backend": args.backend,
+            "max_resident": args.max_resident,
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = args.output or _RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存到 {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""KV 快照格式的基准测试
+
+按不同存储规模（用户数）比较各快照格式的保存耗时（编码 + 原子写入 + fsync）、
+载入耗时（读取 + 解码）与文件大小。缺少可选依赖的格式自动跳过。
+
+用法:
+    python bench/bench_snapshot.py
+    python bench/bench_snapshot.py --sizes 1000 100000 --repeat 5
+    python bench/bench_snapshot.py --formats json msgpack+zstd cbor
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 插件目录（bench 的上一级），kv_snapshot 不依赖 astrbot，可直接导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kv_snapshot  # noqa: E402
+
+# 默认的存储规模（用户数）
+DEFAULT_SIZES = (1000, 10_000, 100_000)
+# 默认的结果目录
+_RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# 角色属性键
+_ABILITIES = ("str", "dex", "con", "int", "wis", "cha")
+
+
+def make_store(size: int, seed: int = 0) -> dict:
+    """生成 size 个用户的数据，取值随机，接近实际使用时的压缩率"""
+    rng = random.Random(seed)
+    data = {}
+    for i in range(size):
+        storage = {key: rng.randint(3, 18) for key in _ABILITIES}
+        storage["生命"] = rng.randint(1, 120)
+        storage["经验"] = rng.randint(0, 100_000)
+        storage["职业"] = rng.choice(("战士", "法师", "游侠", "牧师", "盗贼"))
+        storage["背包"] = [f"道具{rng.randint(1, 500)}" for _ in range(rng.randint(0, 8))]
+        for j in range(rng.randint(0, 10)):
+            storage[f"note{j:02d}"] = f"第{rng.randint(1, 99)}回 {rng.random():.6f}"
+        data[f"user_bench{i}"] = storage
+    return data
+
+
+def all_formats() -> list:
+    """所有编码与压缩的组合，名称形如 "msgpack+zstd"，文本 JSON 记为 "json" """
+    names = []
+    for codec in kv_snapshot.CODECS:
+        for compression in kv_snapshot.COMPRESSIONS:
+            names.append(codec if compression == "none" else f"{codec}+{compression}")
+    return names
+
+
+def parse_format(name: str) -> kv_snapshot.SnapshotFormat:
+    codec, _, compression = name.partition("+")
+    return kv_snapshot.SnapshotFormat(codec, compression or "none")
+
+
+def save(path: Path, fmt: kv_snapshot.SnapshotFormat, data: dict) -> int:
+    """与 kv_store.write_snapshot 相同的写入方式，返回文件大小"""
+    raw = fmt.encode(data)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(raw)
+
+
+def load(path: Path) -> dict:
+    return kv_snapshot.decode(path.read_bytes())
+
+
+def timed(func, repeat: int) -> float:
+    """重复执行 repeat 次，返回耗时中位数（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def bench_size(size: int, formats: list, repeat: int) -> list:
+    data = make_store(size)
+    rows = []
+    baseline = None
+    with tempfile.TemporaryDirectory(prefix="dice-snapshot-") as tmp:
+        for name in formats:
+            fmt = parse_format(name)
+            path = Path(tmp) / f"kv-{name}.snap"
+            file_size = save(path, fmt, data)
+            if load(path) != data:
+                raise SystemExit(f"{name}: 载入结果与原数据不一致")
+            row = {
+                "size": size,
+                "format": name,
+                "bytes": file_size,
+                "save_ms": round(timed(lambda: save(path, fmt, data), repeat), 2),
+                "load_ms": round(timed(lambda: load(path), repeat), 2),
+            }
+            if baseline is None:
+                baseline = row
+            row["size_ratio"] = round(file_size / baseline["bytes"], 3)
+            rows.append(row)
+            print(f"{size:>7} {name:<14} {file_size:>12,} B  x{row['size_ratio']:<6.3f} "
+                  f"save {row['save_ms']:>9.2f}ms  load {row['load_ms']:>9.2f}ms")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simple_dice KV 快照格式基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="存储规模（用户数）")
+    parser.add_argument("--formats", nargs="+", help="要比较的格式，如 json msgpack+zstd，默认全部可用格式")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量的重复次数（取中位数）")
+    parser.add_argument("--output", type=Path, help="结果 JSON 路径，默认写入 bench/results/")
+    args = parser.parse_args()
+
+    formats = []
+    for name in args.formats or all_formats():
+        try:
+            parse_format(name)
+        except kv_snapshot.SnapshotError as e:
+            print(f"跳过 {name}: {e}")
+            continue
+        formats.append(name)
+    # 文本 JSON 作为比较基准，总是第一个测量
+    if "json" in formats:
+        formats.remove("json")
+    formats.insert(0, "json")
+
+    results = []
+    for size in args.sizes:
+        results += bench_size(size, formats, args.repeat)
+
+    report = {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    output = args.output or _RESULTS_DIR / f"snapshot-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""基准测试用的 AstrBot 替身
+
+把最小化的 astrbot.api 模块注入 sys.modules，使插件可以在没有 AstrBot
+实例的环境中离线导入和调用。只实现插件实际用到的接口：
+装饰器原样返回被装饰的函数，事件对象只记录消息文本和会话信息。
+"""
+import logging
+import sys
+import types
+
+
+class PermissionType:
+    ADMIN = "admin"
+    MEMBER = "member"
+
+
+class _Filter:
+    """filter.command / filter.llm_tool 等装饰器工厂，不做任何注册"""
+
+    PermissionType = PermissionType
+
+    def __getattr__(self, name):
+        def factory(*args, **kwargs):
+            def decorator(func):
+                return func
+            return decorator
+        return factory
+
+
+class MessageEventResult:
+    def __init__(self, chain=None):
+        self.chain = chain or []
+
+
+class FakeEvent:
+    """替代 AstrMessageEvent，plain_result 直接返回文本
+
+    与真实事件一样只通过 get_sender_id()/get_group_id() 提供会话信息，没有 user_id/group_id 属性。
+    """
+
+    __slots__ = ("message_str", "_sender_id", "_group_id", "_admin", "result")
+
+    def __init__(self, message_str: str = "", user_id: str = "u1", group_id: str = "", admin: bool = True):
+        self.message_str = message_str
+        self._sender_id = user_id
+        self._group_id = group_id
+        self._admin = admin
+        self.result = None
+
+    def plain_result(self, text: str) -> str:
+        return text
+
+    def set_result(self, result):
+        self.result = result
+
+    def get_sender_id(self) -> str:
+        return self._sender_id
+
+    def get_group_id(self) -> str:
+        return self._group_id
+
+    def get_sender_name(self) -> str:
+        return self._sender_id
+
+    def is_admin(self) -> bool:
+        return self._admin
+
+
+class Plain:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class Context:
+    """替代插件上下文，插件目前没有用到其中的任何接口"""
+
+
+class Star:
+    def __init__(self, context, *args, **kwargs):
+        self.context = context
+
+
+def register(*args, **kwargs):
+    return lambda cls: cls
+
+
+class AstrBotConfig(dict):
+    pass
+
+
+def install():
+    """把替身模块注入 sys.modules，需在导入插件之前调用"""
+    astrbot = types.ModuleType("astrbot")
+    api = types.ModuleType("astrbot.api")
+    event = types.ModuleType("astrbot.api.event")
+    star = types.ModuleType("astrbot.api.star")
+    components = types.ModuleType("astrbot.api.message_components")
+
+    logger = logging.getLogger("astrbot")
+    logger.setLevel(logging.WARNING)
+    api.logger = logger
+    api.AstrBotConfig = AstrBotConfig
+    event.filter = _Filter()
+    event.AstrMessageEvent = FakeEvent
+    event.MessageEventResult = MessageEventResult
+    star.Context = Context
+    star.Star = Star
+    star.register = register
+    components.Plain = Plain
+
+    astrbot.api = api
+    api.event = event
+    api.star = star
+    api.message_components = components
+    sys.modules.update({
+        "astrbot": astrbot,
+        "astrbot.api": api,
+        "astrbot.api.event": event,
+        "astrbot.api.star": star,
+        "astrbot.api.message_components": components,
+    })
@@ -0,0 +1,284 @@
+"""角色卡数据模型
+
+角色属性仍以普通键值保存在用户的 KV 数据中（与 /kv set、表达式中的键名引用
+共用同一份数据，兼容已有的 kv.json），本模块按固定的字段表把它们解析为带类型的
+记录，并预先计算属性修正值 (属性值-10)//2。群的 KV 数据以同样方式解析为游戏会话。
+
+解析只在数据变化后进行一次：RecordCache 按 storage_id 缓存解析结果，并用
+KVStore.version() 判断是否过期，检定时查找属性、技能与修正值都是 O(1)。
+
+本模块不依赖 astrbot。所有操作都在事件循环线程中进行，不加锁。
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import METRICS
+
+# 六项属性: (规范名, 中文名, 英文全称)；属性值按 D&D 规则计算修正值
+ABILITIES = (
+    ("str", "力量", "strength"),
+    ("dex", "敏捷", "dexterity"),
+    ("con", "体质", "constitution"),
+    ("int", "智力", "intelligence"),
+    ("wis", "感知", "wisdom"),
+    ("cha", "魅力", "charisma"),
+)
+# 属性名（小写）-> 属性序号，中文名、规范名与英文全称都可使用
+_ABILITY_INDEX = {name.lower(): i for i, names in enumerate(ABILITIES) for name in names}
+# KV 中的属性值键 -> (属性序号, 优先级)，同一属性有多个键时依次取中文名、规范名、英文全称
+_SCORE_KEYS = {
+    name.lower(): (i, rank)
+    for i, (short, zh, full) in enumerate(ABILITIES)
+    for rank, name in enumerate((zh, short, full))
+}
+# KV 中直接指定修正值的键（如 str_mod、力量调整），优先于按属性值计算
+_MOD_KEYS = {
+    key.lower(): i
+    for i, (short, zh, full) in enumerate(ABILITIES)
+    for key in (f"{short}_mod", f"{full}_mod", f"{zh}调整")
+}
+# 技能键前缀，如 skill_隐匿: 4，值为该技能检定的总加值
+_SKILL_PREFIX = "skill_"
+# 未设置的属性值
+_DEFAULT_SCORE = 10
+
+# 角色卡的标量字段: 字段名 -> (类型, 默认值, KV 中的键名)，同一字段有多个键时取第一个
+CHARACTER_FIELDS = {
+    "name": (str, "", ("name", "名字", "角色名")),
+    "race": (str, "", ("race", "种族")),
+    "class_": (str, "", ("class", "职业")),
+    "level": (int, 1, ("level", "lv", "等级")),
+    "exp": (int, 0, ("exp", "xp", "经验")),
+    "hp": (int, None, ("hp", "生命")),
+    "max_hp": (int, None, ("max_hp", "maxhp", "最大生命")),
+    "temp_hp": (int, 0, ("temp_hp", "临时生命")),
+    "ac": (int, 10, ("ac", "护甲")),
+    "prof": (int, None, ("prof", "熟练", "熟练加值")),
+    "inventory": (list, (), ("inventory", "物品", "背包")),
+    "conditions": (list, (), ("conditions", "状态")),
+}
+# 游戏会话的标量字段，格式同上
+SESSION_FIELDS = {
+    "scene": (str, "", ("scene", "场景")),
+    "dc": (int, None, ("dc", "难度")),
+    "turn_order": (list, (), ("turn_order", "先攻顺序")),
+}
+# 最多缓存的记录数
+_MAX_RECORDS = 10_000
+
+
+def _as_int(value: Any) -> Optional[int]:
+    """把 KV 中的值转为整数，数字字符串也接受，无法转换时返回 None"""
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            value = float(value) if "." in value else int(value)
+        except ValueError:
+            return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float) and not value.is_integer():
+        return None
+    return int(value)
+
+
+def _convert(kind: type, value: Any):
+    if kind is int:
+        return _as_int(value)
+    if kind is list:
+        return tuple(value) if isinstance(value, list) else None
+    return value if isinstance(value, str) else str(value)
+
+
+def _key_table(fields: Dict[str, tuple]) -> Dict[str, tuple]:
+    """KV 键名（小写）-> (字段名, 优先级)"""
+    return {key.lower(): (name, rank) for name, (_, _, keys) in fields.items() for rank, key in enumerate(keys)}
+
+
+_CHARACTER_KEYS = _key_table(CHARACTER_FIELDS)
+_SESSION_KEYS = _key_table(SESSION_FIELDS)
+
+
+def _parse_fields(record, fields: Dict[str, tuple], keys: Dict[str, tuple], storage: Dict[str, Any],
+                  extra: Optional[Callable[[str, str, Any], bool]] = None):
+    """按字段表把 storage 中的键值写入 record 的同名属性，返回无法转换的键
+
+    只遍历一次 storage；extra(小写键名, 原键名, 值) 处理字段表之外的键，无法转换时返回 False。
+    """
+    for name, (_, default, _) in fields.items():
+        setattr(record, name, default)
+    ranks = {}
+    invalid = []
+    for key, value in storage.items():
+        lowered = key.lower()
+        entry = keys.get(lowered)
+        if entry is None:
+            if extra is not None and not extra(lowered, key, value):
+                invalid.append(key)
+            continue
+        name, rank = entry
+        if ranks.get(name, rank + 1) <= rank:
+            continue
+        converted = _convert(fields[name][0], value)
+        if converted is None:
+            invalid.append(key)
+            continue
+        setattr(record, name, converted)
+        ranks[name] = rank
+    return invalid
+
+
+class Character:
+    """用户的角色卡，由该用户的 KV 数据解析而来（只读）"""
+
+    __slots__ = (
+        "storage_id", "name", "race", "class_", "level", "exp", "hp", "max_hp", "temp_hp", "ac", "prof",
+        "inventory", "conditions", "scores", "mods", "skills", "invalid",
+    )
+
+    def __init__(self, storage_id: str):
+        self.storage_id = storage_id
+        # 六项属性值与修正值，按 ABILITIES 的顺序；未设置的属性值为 None，修正值按 10 计算
+        self.scores: List[Optional[int]] = [None] * len(ABILITIES)
+        self.mods: List[int] = [0] * len(ABILITIES)
+        # 技能名 -> 检定总加值
+        self.skills: Dict[str, int] = {}
+        # 值无法转换的键
+        self.invalid: List[str] = []
+
+    @classmethod
+    def from_storage(cls, storage_id: str, storage: Dict[str, Any]) -> "Character":
+        char = cls(storage_id)
+        score_ranks = {}
+        mods = {}
+
+        def extra(lowered: str, key: str, value: Any) -> bool:
+            entry = _SCORE_KEYS.get(lowered)
+            if entry is not None:
+                index, rank = entry
+                score = _as_int(value)
+                if score is None:
+                    return False
+                if score_ranks.get(index, rank + 1) > rank:
+                    char.scores[index] = score
+                    score_ranks[index] = rank
+                return True
+            index = _MOD_KEYS.get(lowered)
+            if index is not None:
+                mods[index] = _as_int(value)
+                return mods[index] is not None
+            if lowered.startswith(_SKILL_PREFIX) and len(key) > len(_SKILL_PREFIX):
+                bonus = _as_int(value)
+                if bonus is None:
+                    return False
+                char.skills[key[len(_SKILL_PREFIX):].lower()] = bonus
+            return True
+
+        char.invalid = _parse_fields(char, CHARACTER_FIELDS, _CHARACTER_KEYS, storage, extra)
+        for i, score in enumerate(char.scores):
+            override = mods.get(i)
+            char.mods[i] = override if override is not None else ((score if score is not None else _DEFAULT_SCORE) - 10) // 2
+        if char.prof is None:
+            char.prof = 2 + (max(char.level, 1) - 1) // 4
+        if char.max_hp is None:
+            char.max_hp = char.hp
+        return char
+
+    @staticmethod
+    def ability_index(name: str) -> Optional[int]:
+        """属性名（中文、缩写或英文全称，不区分大小写）对应的序号，不是属性时返回 None"""
+        return _ABILITY_INDEX.get(name.strip().lower())
+
+    def check_bonus(self, name: str) -> Optional[tuple]:
+        """属性或技能检定的 (显示名, 加值)，都不是时返回 None；同名时技能优先"""
+        lowered = name.strip().lower()
+        bonus = self.skills.get(lowered)
+        if bonus is not None:
+            return name.strip(), bonus
+        index = _ABILITY_INDEX.get(lowered)
+        if index is None:
+            return None
+        return ABILITIES[index][1], self.mods[index]
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in CHARACTER_FIELDS}
+        data["class"] = data.pop("class_")
+        data["inventory"] = list(self.inventory)
+        data["conditions"] = list(self.conditions)
+        data["abilities"] = {
+            zh: {"score": score, "mod": mod}
+            for (_, zh, _), score, mod in zip(ABILITIES, self.scores, self.mods)
+        }
+        data["skills"] = self.skills
+        if self.invalid:
+            data["invalid_keys"] = self.invalid
+        return data
+
+
+class GameSession:
+    """群的游戏会话（场景、默认难度、先攻顺序），由群的 KV 数据解析而来（只读）"""
+
+    __slots__ = ("storage_id", "scene", "dc", "turn_order", "invalid")
+
+    def __init__(self, storage_id: str):
+        self.storage_id = storage_id
+        self.invalid: List[str] = []
+
+    @classmethod
+    def from_storage(cls, storage_id: str, storage: Dict[str, Any]) -> "GameSession":
+        session = cls(storage_id)
+        session.invalid = _parse_fields(session, SESSION_FIELDS, _SESSION_KEYS, storage)
+        return session
+
+
+class DiceRoll:
+    """一次检定或伤害投掷"""
+
+    __slots__ = ("label", "dice", "rolls", "natural", "modifier", "total", "reason", "hidden")
+
+    def __init__(self, label: str, dice: str, rolls: list, natural: int, modifier: int, reason: str = "",
+                 hidden: bool = False):
+        self.label = label
+        self.dice = dice
+        self.rolls = rolls
+        # 骰子部分的结果（优势/劣势时为保留的那一颗）
+        self.natural = natural
+        self.modifier = modifier
+        self.total = natural + modifier
+        self.reason = reason
+        self.hidden = hidden
+
+    @property
+    def expression(self) -> str:
+        """记入投掷历史的表达式，如 2d20kh1+3"""
+        return f"{self.dice}{self.modifier:+d}" if self.modifier else self.dice
+
+    def __str__(self) -> str:
+        rolls = f"[{', '.join(map(str, self.rolls))}]" if self.rolls else ""
+        bonus = f" {'+' if self.modifier >= 0 else '-'} {abs(self.modifier)}" if self.modifier else ""
+        return f"{self.dice}{rolls}{bonus} = {self.total}"
+
+
+class RecordCache:
+    """storage_id -> 解析后的记录，按 KV 数据版本失效，最久未使用的记录会被淘汰"""
+
+    def __init__(self, factory: Callable[[str, Dict[str, Any]], Any], metric: str, max_records: int = _MAX_RECORDS):
+        self.factory = factory
+        self.metric = metric
+        self.max_records = max_records
+        self._records: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, storage_id: str, version: Optional[int], storage: Dict[str, Any]):
+        """返回 storage 对应的记录，version 与缓存时不同（或为 None）时重新解析"""
+        cached = self._records.get(storage_id)
+        if cached is not None and version is not None and cached[0] == version:
+            self._records.move_to_end(storage_id)
+            METRICS.incr(f"{self.metric}.hit")
+            return cached[1]
+        METRICS.incr(f"{self.metric}.miss")
+        record = self.factory(storage_id, storage)
+        self._records[storage_id] = (version, record)
+        self._records.move_to_end(storage_id)
+        if len(self._records) > self.max_records:
+            self._records.popitem(last=False)
+        return record
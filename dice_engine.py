@@ -0,0 +1,811 @@
+"""骰子表达式引擎
+
+把骰子表达式解析为一棵小型语法树并缓存，之后每次投掷只需要遍历语法树、
+进行随机抽取，不再对文本做正则替换或 eval。
+
+支持的语法:
+- 骰子: NdM / dM (例如 3d10、d6、2D20)
+- 骰池修饰（按此顺序书写）:
+    ! 爆炸骰（例如 d6!）；kh/kl N 保留最高/最低 N 个，dh/dl N 去掉最高/最低 N 个
+    （例如 4d6kh3、2d20kl1，省略 N 时为 1）；>= <= > < T 统计达成目标的骰子数（例如 10d10>=8）
+- 数字: 整数或小数
+- KV 引用: 键名（例如 1d20+str+prof-2、1d20+力量），默认读取用户的数据，
+  @group.键名 读取群的数据（例如 1d20+@group.ac）；d 后紧跟数字时总是骰子
+- 运算: + - * / // % ** 以及括号
+- 批量: N#表达式 重复投掷，多个表达式以 ; 分隔（见 split_batch）
+"""
+import heapq
+import math
+import operator
+import random
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时退回纯 Python 实现
+    np = None
+
+# 编译结果缓存大小
+_EXPR_CACHE_SIZE = 512
+# 骰子总数不超过此值时才保留并显示每个骰子的点数
+SHOW_ROLLS_LIMIT = 5
+# 个数不超过此值的投掷直接逐个抽取
+_SMALL_COUNT = 64
+# 大批量投掷每块抽取的骰子数，决定内存上限
+_STREAM_CHUNK = 1 << 16
+# 面数不超过此值时，大批量投掷直接从多项分布抽取各点数出现次数
+_MULTINOMIAL_MAX_FACES = 1024
+# random.choices 在此面数以内没有可察觉的偏差
+_CHOICES_MAX_FACES = 1 << 48
+
+# 一次批量投掷最多的投掷次数（N#表达式 计为 N 次）
+MAX_BATCH_ROLLS = 50
+
+# 骰池（带修饰的骰子）需要同时保留所有点数，骰子数上限
+_MAX_POOL_DICE = 1_000_000
+# 爆炸骰的最大连锁次数，防止 d1! 无限循环
+_EXPLODE_MAX_DEPTH = 20
+# 单个表达式最多的记号数与括号嵌套层数，防止解析时递归过深
+_MAX_TOKENS = 256
+_MAX_NESTING = 32
+# 编译期求值（常数折叠、常数部分）允许的结果位数上限，超出的留给预算检查拒绝
+_SAFE_EVAL_BITS = 1 << 14
+
+# 骰池使用 numpy 抽取的面数上限，保证爆炸累加后不溢出 int64
+_NP_POOL_MAX_FACES = 1 << 32
+
+# KV 引用的值的绝对值上限（位数），超出的值不参与计算
+REF_VALUE_BITS = 53
+
+_NP_RNG = np.random.default_rng() if np is not None else None
+
+_TOKEN_RE = re.compile(
+    r"(?P<dice>(?P<count>\d*)[dD](?P<faces>\d+)"
+    r"(?P<explode>!)?(?:(?P<keep>[kK][hHlL]?|[dD][hHlL])(?P<keep_n>\d*))?(?:(?P<cmp>>=|<=|>|<)(?P<target>\d+))?)"
+    r"|(?P<num>\d+(?:\.\d+)?)"
+    r"|(?P<ref>(?:@(?P<scope>user|group)\.)?(?P<key>[^\W\d]\w*))"
+    r"|(?P<op>\*\*|//|[-+*/%()])"
+)
+
+_COMPARE_OPS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+_REPEAT_RE = re.compile(r"(\d+)\s*#(.*)", re.S)
+# 可以接在操作数之后、或出现在操作数之前的符号（运算符、括号与比较符）
+_OPERAND_END_BLOCKERS = "+-*/%(<>=≥≤"
+_OPERAND_START_BLOCKERS = "+-*/%)<>=≥≤"
+# 与前面的个数之间有空白的骰子记号，如 "2 d6"
+_SPLIT_DICE_RE = re.compile(r"[dD]\d")
+
+
+def _pow(base, exponent):
+    """乘方，结果不是实数（如负数的小数次幂）时抛出 ArithmeticError"""
+    result = base ** exponent
+    if isinstance(result, complex):
+        raise ArithmeticError(f"{base} 的 {exponent} 次幂不是实数")
+    return result
+
+
+_BINARY_OPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "//": operator.floordiv,
+    "%": operator.mod,
+    "**": _pow,
+}
+
+
+class DiceSyntaxError(ValueError):
+    """骰子表达式语法错误"""
+
+
+class ExpressionCostError(DiceSyntaxError):
+    """表达式的静态开销超出预算"""
+
+
+def roll_dice(count: int, faces: int) -> list[int]:
+    """投掷指定数量和面数的骰子"""
+    return [random.randint(1, faces) for _ in range(count)]
+
+
+class DiceSummary:
+    """一组同面数骰子的汇总结果"""
+
+    __slots__ = ("count", "faces", "total", "min", "max", "histogram", "values")
+
+    def __init__(self, count: int, faces: int, total: int, min_value: Optional[int], max_value: Optional[int],
+                 histogram: Optional[dict[int, int]] = None, values: Optional[list[int]] = None):
+        self.count = count
+        self.faces = faces
+        self.total = total
+        self.min = min_value
+        self.max = max_value
+        self.histogram = histogram
+        self.values = values
+
+
+def summarize_dice(count: int, faces: int, keep_values: bool = False, histogram: bool = False) -> DiceSummary:
+    """投掷 count 个 faces 面骰并汇总，内存占用与 count 无关
+
+    只有 keep_values 为 True 时才保留每个骰子的点数；大批量投掷时按块抽取，
+    有 numpy 时使用向量化抽取，面数较小时直接从多项分布抽取各点数的出现次数。
+    """
+    if keep_values or count <= _SMALL_COUNT:
+        values = roll_dice(count, faces)
+        return DiceSummary(
+            count, faces, sum(values),
+            min(values, default=None), max(values, default=None),
+            dict(Counter(values)) if histogram else None,
+            values if keep_values else None,
+        )
+
+    if _NP_RNG is not None and faces <= _MULTINOMIAL_MAX_FACES:
+        counts = _NP_RNG.multinomial(count, [1.0 / faces] * faces).tolist()
+        hist = {face: n for face, n in enumerate(counts, 1) if n}
+        total = sum(face * n for face, n in hist.items())
+        return DiceSummary(count, faces, total, min(hist), max(hist), hist if histogram else None)
+
+    total = 0
+    low = high = None
+    hist = Counter() if histogram else None
+    remaining = count
+    while remaining:
+        n = min(remaining, _STREAM_CHUNK)
+        remaining -= n
+        chunk_min, chunk_max, chunk_total = _roll_chunk(n, faces, hist)
+        total += chunk_total
+        low = chunk_min if low is None else min(low, chunk_min)
+        high = chunk_max if high is None else max(high, chunk_max)
+    return DiceSummary(count, faces, total, low, high, dict(hist) if hist is not None else None)
+
+
+def _roll_chunk(n: int, faces: int, hist: Optional[Counter]) -> tuple[int, int, int]:
+    """抽取一块骰子，返回 (最小值, 最大值, 总和)，需要时累加到直方图"""
+    if _NP_RNG is not None and faces < (1 << 62):
+        arr = _NP_RNG.integers(1, faces + 1, size=n, dtype=np.int64)
+        if hist is not None:
+            uniq, cnt = np.unique(arr, return_counts=True)
+            hist.update(dict(zip(uniq.tolist(), cnt.tolist())))
+        if faces * n < (1 << 63):
+            chunk_total = int(arr.sum())
+        else:
+            chunk_total = sum(arr.tolist())
+        return int(arr.min()), int(arr.max()), chunk_total
+
+    if faces <= _CHOICES_MAX_FACES:
+        values = random.choices(range(1, faces + 1), k=n)
+    else:
+        values = roll_dice(n, faces)
+    if hist is not None:
+        hist.update(values)
+    return min(values), max(values), sum(values)
+
+
+class RollContext:
+    """一次投掷的上下文
+
+    keep_values 为 True 时记录每个骰子的点数（用于显示），否则只累计总和。
+    rng 为会话的随机数流（见 dice_rng.DiceRng），为 None 时使用全局随机数；
+    refs 为 KV 引用的取值 {(作用域, 键名): 数值}，缺少的引用按 0 计算。
+    """
+
+    __slots__ = ("rolls", "dice_count", "keep_values", "rng", "refs")
+
+    def __init__(self, keep_values: bool = True, rng=None, refs: Optional[dict] = None):
+        self.rolls: list[int] = []
+        self.dice_count = 0
+        self.keep_values = keep_values
+        self.rng = rng
+        self.refs = refs or {}
+
+    def ref(self, scope: str, key: str):
+        return self.refs.get((scope, key), 0)
+
+    def roll(self, count: int, faces: int):
+        self.dice_count += count
+        if self.keep_values:
+            values = roll_dice(count, faces) if self.rng is None else self.rng.roll(count, faces)
+            self.rolls.extend(values)
+            return sum(values)
+        if self.rng is not None:
+            return self.rng.total(count, faces)
+        return summarize_dice(count, faces).total
+
+    def roll_pool(self, pool: "DicePool"):
+        self.dice_count += pool.count
+        result, values = pool.roll(self.keep_values, self.rng)
+        if values is not None:
+            self.rolls.extend(values)
+        return result
+
+
+class _ZeroContext:
+    """把所有骰子视为 0，用于计算表达式的常数部分"""
+
+    __slots__ = ()
+
+    def roll(self, count: int, faces: int):
+        return 0
+
+    def roll_pool(self, pool: "DicePool"):
+        return 0
+
+    def ref(self, scope: str, key: str):
+        return 0
+
+
+_ZERO_CONTEXT = _ZeroContext()
+
+
+class Num:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, ctx):
+        return self.value
+
+
+class Dice:
+    __slots__ = ("count", "faces")
+
+    def __init__(self, count: int, faces: int):
+        self.count = count
+        self.faces = faces
+
+    def evaluate(self, ctx):
+        return ctx.roll(self.count, self.faces)
+
+
+class Ref:
+    """KV 引用，求值时从投掷上下文取得已解析的值"""
+
+    __slots__ = ("scope", "key")
+
+    def __init__(self, scope: str, key: str):
+        self.scope = scope
+        self.key = key
+
+    def evaluate(self, ctx):
+        return ctx.ref(self.scope, self.key)
+
+
+def format_ref(scope: str, key: str) -> str:
+    """KV 引用在表达式中的写法"""
+    return key if scope == "user" else f"@{scope}.{key}"
+
+
+def substitute_refs(text: str, values: dict) -> str:
+    """把规范化表达式中的 KV 引用替换为取值（缺少的按 0），如 "1d8+str" -> "1d8+3"，用于显示"""
+    parts = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if match is None:
+            return text
+        if match.group("ref"):
+            value = values.get((match.group("scope") or "user", match.group("key")), 0)
+            parts.append(f"({value})" if value < 0 else str(value))
+        else:
+            parts.append(match.group())
+        pos = match.end()
+    return "".join(parts)
+
+
+class DicePool:
+    """带修饰的骰池: NdM[!][kh|kl N][>=|<=|>|< T]
+
+    爆炸骰掷出最大面时追加一次并累加到该骰上，最多连锁 _EXPLODE_MAX_DEPTH 次；
+    keep 为 "h"/"l" 时只保留最高/最低的 keep_n 个骰子（dh/dl 在解析时换算为 kl/kh）；
+    compare 不为 None 时结果为保留的骰子中达成目标的个数，否则为保留骰子之和。
+    """
+
+    __slots__ = ("count", "faces", "explode", "keep", "keep_n", "compare", "target", "compare_func")
+
+    def __init__(self, count: int, faces: int, explode: bool = False, keep: Optional[str] = None,
+                 keep_n: int = 0, compare: Optional[str] = None, target: int = 0):
+        self.count = count
+        self.faces = faces
+        self.explode = explode
+        # 保留全部骰子时不需要选择
+        self.keep = keep if keep is not None and keep_n < count else None
+        self.keep_n = keep_n
+        self.compare = compare
+        self.target = target
+        self.compare_func = _COMPARE_OPS[compare] if compare is not None else None
+
+    def evaluate(self, ctx):
+        return ctx.roll_pool(self)
+
+    def roll(self, keep_values: bool, rng=None) -> tuple[int, Optional[list[int]]]:
+        """投掷一次，返回 (结果, 每个骰子的点数)；keep_values 为 False 时点数为 None
+
+        大骰池在有 numpy 时向量化处理，否则逐个抽取。rng 为会话的随机数流，
+        为 None 时使用全局随机数。
+        """
+        if not keep_values and _NP_RNG is not None and self.count > _SMALL_COUNT and self.faces <= _NP_POOL_MAX_FACES:
+            gen = rng if rng is not None else _NP_RNG
+            values = gen.integers(1, self.faces + 1, size=(1, self.count), dtype=np.int64)
+            return int(self.reduce_rows(values, gen)[0]), None
+
+        if rng is None:
+            values = roll_dice(self.count, self.faces)
+            randint = lambda: random.randint(1, self.faces)
+        else:
+            values = rng.roll(self.count, self.faces)
+            randint = lambda: rng.randint(self.faces)
+        if self.explode:
+            for i, value in enumerate(values):
+                last = value
+                for _ in range(_EXPLODE_MAX_DEPTH):
+                    if last != self.faces:
+                        break
+                    last = randint()
+                    value += last
+                values[i] = value
+        kept = values
+        if self.keep == "h":
+            kept = heapq.nlargest(self.keep_n, values)
+        elif self.keep == "l":
+            kept = heapq.nsmallest(self.keep_n, values)
+        if self.compare_func is not None:
+            result = sum(1 for value in kept if self.compare_func(value, self.target))
+        else:
+            result = sum(kept)
+        return result, values if keep_values else None
+
+    def reduce_rows(self, values, rng):
+        """numpy：对 (试验次数, 骰子数) 的点数矩阵逐行求结果，values 会被原地修改"""
+        if self.explode:
+            rows, cols = np.nonzero(values == self.faces)
+            for _ in range(_EXPLODE_MAX_DEPTH):
+                if not len(rows):
+                    break
+                extra = rng.integers(1, self.faces + 1, size=len(rows), dtype=np.int64)
+                values[rows, cols] += extra
+                hit = extra == self.faces
+                rows, cols = rows[hit], cols[hit]
+        if self.keep is not None:
+            # 部分选择：只把第 k 小的元素放到位，不做完整排序
+            if self.keep_n == 0:
+                values = values[:, :0]
+            elif self.keep == "h":
+                values = np.partition(values, self.count - self.keep_n, axis=1)[:, self.count - self.keep_n:]
+            else:
+                values = np.partition(values, self.keep_n - 1, axis=1)[:, :self.keep_n]
+        if self.compare_func is not None:
+            return self.compare_func(values, self.target).sum(axis=1)
+        return values.sum(axis=1)
+
+
+class Neg:
+    __slots__ = ("operand",)
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def evaluate(self, ctx):
+        return -self.operand.evaluate(ctx)
+
+
+class BinOp:
+    __slots__ = ("op", "left", "right", "func")
+
+    def __init__(self, op: str, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.func = _BINARY_OPS[op]
+
+    def evaluate(self, ctx):
+        return self.func(self.left.evaluate(ctx), self.right.evaluate(ctx))
+
+
+class _Parser:
+    """递归下降解析器
+
+    优先级与 Python 一致:
+        expr  := term (('+' | '-') term)*
+        term  := unary (('*' | '/' | '//' | '%') unary)*
+        unary := ('+' | '-') unary | power
+        power := atom ('**' unary)?
+        atom  := NUMBER | DICE | REF | '(' expr ')'
+    """
+
+    def __init__(self, text: str):
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+        self.dice_parts: list[tuple[int, int]] = []
+        self.has_pools = False
+        # 引用的 (作用域, 键名)，按首次出现的顺序，不重复
+        self.refs: dict[tuple[str, str], None] = {}
+        self.depth = 0
+
+    @staticmethod
+    def _tokenize(text: str) -> list[tuple[str, object]]:
+        tokens = []
+        pos = 0
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if not match:
+                raise DiceSyntaxError(f"无法识别的字符: {text[pos]!r}")
+            if match.group("dice"):
+                count = int(match.group("count")) if match.group("count") else 1
+                faces = int(match.group("faces"))
+                if faces < 1:
+                    raise DiceSyntaxError(f"骰子面数必须大于 0: {match.group('dice')}")
+                if match.group("explode") or match.group("keep") or match.group("cmp"):
+                    tokens.append(("pool", _make_pool(match, count, faces)))
+                else:
+                    tokens.append(("dice", (count, faces)))
+            elif match.group("num"):
+                num = match.group("num")
+                tokens.append(("num", float(num) if "." in num else int(num)))
+            elif match.group("ref"):
+                tokens.append(("ref", (match.group("scope") or "user", match.group("key"))))
+            else:
+                tokens.append(("op", match.group("op")))
+            if len(tokens) > _MAX_TOKENS:
+                raise DiceSyntaxError(f"表达式过长，最多 {_MAX_TOKENS} 个记号")
+            pos = match.end()
+        return tokens
+
+    def _peek(self) -> Optional[tuple[str, object]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take_op(self, *ops: str) -> Optional[str]:
+        token = self._peek()
+        if token and token[0] == "op" and token[1] in ops:
+            self.pos += 1
+            return token[1]
+        return None
+
+    def parse(self):
+        if not self.tokens:
+            raise DiceSyntaxError("表达式为空")
+        node = self._expr()
+        if self.pos != len(self.tokens):
+            raise DiceSyntaxError(f"多余的内容: {self.tokens[self.pos][1]}")
+        return node
+
+    def _expr(self):
+        node = self._term()
+        while True:
+            op = self._take_op("+", "-")
+            if not op:
+                return node
+            node = _fold(BinOp(op, node, self._term()))
+
+    def _term(self):
+        node = self._unary()
+        while True:
+            op = self._take_op("*", "/", "//", "%")
+            if not op:
+                return node
+            node = _fold(BinOp(op, node, self._unary()))
+
+    def _unary(self):
+        op = self._take_op("+", "-")
+        if op == "+":
+            return self._unary()
+        if op == "-":
+            return _fold(Neg(self._unary()))
+        return self._power()
+
+    def _power(self):
+        node = self._atom()
+        if self._take_op("**"):
+            node = _fold(BinOp("**", node, self._unary()))
+        return node
+
+    def _atom(self):
+        token = self._peek()
+        if token is None:
+            raise DiceSyntaxError("表达式不完整")
+        kind, value = token
+        self.pos += 1
+        if kind == "num":
+            return Num(value)
+        if kind == "dice":
+            self.dice_parts.append(value)
+            return Dice(*value)
+        if kind == "pool":
+            self.dice_parts.append((value.count, value.faces))
+            self.has_pools = True
+            return value
+        if kind == "ref":
+            self.refs[value] = None
+            return Ref(*value)
+        if value == "(":
+            self.depth += 1
+            if self.depth > _MAX_NESTING:
+                raise DiceSyntaxError(f"括号嵌套过深，最多 {_MAX_NESTING} 层")
+            node = self._expr()
+            if not self._take_op(")"):
+                raise DiceSyntaxError("括号不匹配")
+            self.depth -= 1
+            return node
+        raise DiceSyntaxError(f"意外的符号: {value}")
+
+
+def _make_pool(match: re.Match, count: int, faces: int) -> DicePool:
+    if count > _MAX_POOL_DICE:
+        raise DiceSyntaxError(f"带修饰的骰池最多 {_MAX_POOL_DICE} 个骰子: {match.group('dice')}")
+    keep = match.group("keep")
+    keep = keep.lower() if keep else keep
+    keep_n = 0
+    if keep:
+        n = int(match.group("keep_n")) if match.group("keep_n") else 1
+        if keep in ("k", "kh"):
+            keep, keep_n = "h", n
+        elif keep == "kl":
+            keep, keep_n = "l", n
+        elif keep == "dl":
+            # 去掉最低的 n 个即保留最高的 count - n 个
+            keep, keep_n = "h", max(count - n, 0)
+        else:
+            keep, keep_n = "l", max(count - n, 0)
+    target = int(match.group("target")) if match.group("cmp") else 0
+    return DicePool(count, faces, bool(match.group("explode")), keep, keep_n, match.group("cmp"), target)
+
+
+def _fold(node):
+    """常数折叠：两侧都是数字的运算在编译期直接算出
+
+    结果可能过大（如 9**9**9）的运算不折叠，留给预算检查。
+    """
+    if isinstance(node, Neg) and isinstance(node.operand, Num):
+        return Num(-node.operand.value)
+    if isinstance(node, BinOp) and isinstance(node.left, Num) and isinstance(node.right, Num):
+        bits = _result_bits(node.op, _value_bits(node.left.value), _value_bits(node.right.value))
+        if bits > _SAFE_EVAL_BITS:
+            return node
+        try:
+            return Num(node.func(node.left.value, node.right.value))
+        except ArithmeticError:
+            # 除零、溢出、非实数结果留到求值时报错
+            return node
+    return node
+
+
+class ExpressionCost:
+    """表达式的静态开销估计（均为上界）"""
+
+    __slots__ = ("dice", "ops", "max_exponent", "bits")
+
+    def __init__(self):
+        # 一次求值抽取的骰子数
+        self.dice = 0
+        # 运算符个数
+        self.ops = 0
+        # 乘方指数绝对值的上界
+        self.max_exponent = 0.0
+        # 中间结果与最终结果绝对值的位数上界（log2）
+        self.bits = 0.0
+
+
+class CostBudget:
+    """表达式开销预算，超出任一项即拒绝"""
+
+    __slots__ = ("max_dice", "max_ops", "max_exponent", "max_bits")
+
+    def __init__(self, max_dice: int = 10_000_000, max_ops: int = 100,
+                 max_exponent: float = 1024, max_bits: float = 4096):
+        self.max_dice = max_dice
+        self.max_ops = max_ops
+        self.max_exponent = max_exponent
+        self.max_bits = max_bits
+
+
+def _value_bits(value) -> float:
+    value = abs(value)
+    return math.log2(value) if value > 1 else 0.0
+
+
+def _pow2(bits: float) -> float:
+    return 2.0 ** bits if bits < 1000 else math.inf
+
+
+def _result_bits(op: str, left: float, right: float) -> float:
+    """由操作数位数上界估计结果位数上界"""
+    if op in ("+", "-"):
+        return max(left, right) + 1
+    if op == "*":
+        return left + right
+    if op == "%":
+        return right
+    if op == "**":
+        # 底数绝对值不超过 1 时，负指数仍可能得到大数
+        return max(left, 1.0) * _pow2(right)
+    return left
+
+
+def estimate_cost(root) -> ExpressionCost:
+    """静态估计语法树的开销，不进行任何求值"""
+    cost = ExpressionCost()
+    _walk_cost(root, cost)
+    return cost
+
+
+def _walk_cost(node, cost: ExpressionCost) -> float:
+    """累加开销并返回该节点结果的位数上界"""
+    if isinstance(node, Num):
+        bits = _value_bits(node.value)
+    elif isinstance(node, Dice):
+        cost.dice += node.count
+        bits = _value_bits(node.count * node.faces)
+    elif isinstance(node, DicePool):
+        if node.explode:
+            # 面数大于 1 时平均每个骰子追加不到 1 次；d1! 每次都连锁到上限
+            cost.dice += node.count * (_EXPLODE_MAX_DEPTH + 1 if node.faces == 1 else 2)
+        else:
+            cost.dice += node.count
+        if node.compare is not None:
+            bits = _value_bits(node.count)
+        else:
+            bits = _value_bits(node.count * node.faces * (_EXPLODE_MAX_DEPTH + 1 if node.explode else 1))
+    elif isinstance(node, Ref):
+        bits = REF_VALUE_BITS
+    elif isinstance(node, Neg):
+        cost.ops += 1
+        bits = _walk_cost(node.operand, cost)
+    elif isinstance(node, BinOp):
+        cost.ops += 1
+        left = _walk_cost(node.left, cost)
+        right = _walk_cost(node.right, cost)
+        if node.op == "**":
+            cost.max_exponent = max(cost.max_exponent, _pow2(right))
+        bits = _result_bits(node.op, left, right)
+    else:
+        raise TypeError(f"不支持的节点: {type(node).__name__}")
+    cost.bits = max(cost.bits, bits)
+    return bits
+
+
+def check_cost(compiled: "CompiledExpr", budget: CostBudget, repeat: int = 1):
+    """检查表达式（重复 repeat 次）是否超出预算，超出时抛出 ExpressionCostError"""
+    cost = compiled.cost
+    if cost.dice * repeat > budget.max_dice:
+        raise ExpressionCostError(f"骰子总数 {cost.dice * repeat} 超过上限 {budget.max_dice}")
+    if cost.ops > budget.max_ops:
+        raise ExpressionCostError(f"运算过多（{cost.ops} 个），上限 {budget.max_ops}")
+    if cost.max_exponent > budget.max_exponent:
+        raise ExpressionCostError(f"指数可能达到 {cost.max_exponent:.4g}，超过上限 {budget.max_exponent:g}")
+    if cost.bits > budget.max_bits:
+        raise ExpressionCostError(f"结果可能达到 2^{cost.bits:.4g}，超过上限 2^{budget.max_bits:g}")
+
+
+class CompiledExpr:
+    """编译后的骰子表达式"""
+
+    __slots__ = ("text", "root", "dice_parts", "dice_count", "base", "has_parens", "has_pools", "refs", "cost")
+
+    def __init__(self, text: str, root, dice_parts: list[tuple[int, int]], has_parens: bool,
+                 has_pools: bool = False, refs: tuple = ()):
+        self.text = text
+        self.root = root
+        self.dice_parts = dice_parts
+        self.dice_count = sum(count for count, _ in dice_parts)
+        self.has_parens = has_parens
+        # 含有带修饰的骰池（kh/kl、爆炸、成功计数）
+        self.has_pools = has_pools
+        # 引用的 KV 键 ((作用域, 键名), ...)，求值前需要解析
+        self.refs = refs
+        self.cost = estimate_cost(root)
+        # 常数部分：把所有骰子与引用视为 0 时的结果（结果可能过大时不计算）
+        self.base = 0
+        if self.cost.bits <= _SAFE_EVAL_BITS:
+            try:
+                self.base = root.evaluate(_ZERO_CONTEXT)
+            except ArithmeticError:
+                pass
+
+    def new_context(self, rng=None, refs: Optional[dict] = None) -> RollContext:
+        """创建投掷上下文，仅在结果会显示每个骰子时保留点数"""
+        return RollContext(keep_values=self.dice_count <= SHOW_ROLLS_LIMIT, rng=rng, refs=refs)
+
+    def evaluate(self, ctx: Optional[RollContext] = None):
+        """投掷一次，返回结果；传入 ctx 可取得每个骰子的点数"""
+        return self.root.evaluate(ctx if ctx is not None else RollContext(keep_values=False))
+
+
+def split_label(text: str) -> tuple[str, str]:
+    """把表达式后附带的说明文字分出来，返回 (表达式, 说明)
+
+    按空白分段：前一段以操作数结尾、后一段又以操作数开头时（如 "1d20 攻击"、
+    "1d20+str 偷袭"），从后一段起都是说明文字，不参与计算；"2 d6" 这样拆开的骰子记号除外。
+    """
+    words = text.split()
+    for i in range(1, len(words)):
+        if words[i - 1].isdigit() and _SPLIT_DICE_RE.match(words[i]):
+            continue
+        if words[i - 1][-1] not in _OPERAND_END_BLOCKERS and words[i][0] not in _OPERAND_START_BLOCKERS:
+            return " ".join(words[:i]), " ".join(words[i:])
+    return " ".join(words), ""
+
+
+def normalize_expression(expr: str) -> str:
+    """规范化表达式文本，作为缓存键
+
+    只去掉空白，不改变大小写：骰子记号本身不区分大小写，KV 键名区分。
+    """
+    return "".join(expr.split())
+
+
+@lru_cache(maxsize=_EXPR_CACHE_SIZE)
+def _compile_normalized(text: str) -> CompiledExpr:
+    parser = _Parser(text)
+    root = parser.parse()
+    return CompiledExpr(
+        text, root, parser.dice_parts, "(" in text or ")" in text, parser.has_pools, tuple(parser.refs)
+    )
+
+
+def compile_expression(expr: str) -> CompiledExpr:
+    """编译骰子表达式（带 LRU 缓存），语法错误时抛出 DiceSyntaxError"""
+    return _compile_normalized(normalize_expression(expr))
+
+
+def split_batch(text: str) -> list[tuple[int, str]]:
+    """拆分批量投掷文本，返回 [(重复次数, 表达式)...]
+
+    例如: "6#4d6; 1d20+str 攻击" -> [(6, "4d6"), (1, "1d20+str")]
+    表达式后的说明文字（见 split_label）会被去掉，空片段会被忽略；重复次数为 0 或总投掷次数超过 MAX_BATCH_ROLLS 时抛出 DiceSyntaxError。
+    """
+    specs = []
+    total = 0
+    for part in text.replace("；", ";").split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        repeat = 1
+        match = _REPEAT_RE.fullmatch(part)
+        if match:
+            repeat = int(match.group(1))
+            part = match.group(2).strip()
+            if repeat < 1:
+                raise DiceSyntaxError("重复次数必须大于 0")
+            if not part:
+                raise DiceSyntaxError("# 后缺少表达式")
+        part = split_label(part)[0]
+        total += repeat
+        if total > MAX_BATCH_ROLLS:
+            raise DiceSyntaxError(f"一次最多投掷 {MAX_BATCH_ROLLS} 次")
+        specs.append((repeat, part))
+    if not specs:
+        raise DiceSyntaxError("表达式为空")
+    return specs
+
+
+def parse_dice_expression(expr: str) -> tuple[int, list[tuple[int, int]], str]:
+    """解析骰子表达式，返回 (加成值, [(个数, 面数)...], 原始表达式)
+
+    例如: "3d10+5" -> (5, [(3, 10)], "3d10+5")
+    例如: "2d6-1d4+3" -> (3, [(2, 6), (1, 4)], "2d6-1d4+3")
+    """
+    text = normalize_expression(expr)
+    try:
+        compiled = _compile_normalized(text)
+    except DiceSyntaxError:
+        return (0, [], text)
+    if compiled.has_parens or compiled.has_pools or compiled.refs:
+        return (0, [], text)
+    return (compiled.base, list(compiled.dice_parts), text)
+
+
+def evaluate_expression(expr: str) -> Optional[int]:
+    """计算表达式（支持括号和基本运算），失败时返回 None"""
+    try:
+        return compile_expression(expr).evaluate()
+    except (DiceSyntaxError, ArithmeticError):
+        return None
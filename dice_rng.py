@@ -0,0 +1,226 @@
+"""按会话划分、可设定种子的随机数流
+
+每个 storage_id 一个独立的随机数流。有 numpy 时使用 PCG64 位生成器，
+一次批量生成一池 64 位随机字，之后每个骰子只需取下一个字并做无偏映射；
+没有 numpy 时退回 random.Random。
+
+流的位置用"已消耗的 64 位字数"（counter）表示，映射算法是确定的，
+因此记录 (种子, counter) 即可离线精确重放任意一次投掷：PCG64 通过
+advance() 直接跳到该位置，random.Random 则丢弃相应数量的字。
+
+设置了全局种子时，每个流的种子由 (全局种子, storage_id, 流编号) 派生。流编号由本次
+启动的随机标识与创建序号组成，重启或淘汰后重新创建的流不会从头重复同一序列。
+
+所有操作都在事件循环线程中进行，不加锁。
+"""
+import hashlib
+import random
+import secrets
+from collections import OrderedDict
+from typing import Optional
+
+from .dice_engine import np
+
+# 每次批量生成的随机字数
+_POOL_WORDS = 4096
+# 64 位随机字的取值个数
+_WORD = 1 << 64
+# 最多保留的随机数流个数
+_MAX_STREAMS = 10_000
+# 丢弃随机字时每次丢弃的个数（random.Random 重放时使用）
+_SKIP_CHUNK = 1 << 16
+# 大批量投掷时每块抽取的骰子数
+_CHUNK = 1 << 16
+
+
+class DiceRng:
+    """单个会话的随机数流
+
+    randint / roll / total 取自缓冲池；integers 提供与 numpy.random.Generator
+    相同的调用方式，供骰池的向量化路径使用。
+    """
+
+    __slots__ = ("seed", "nonce", "counter", "engine", "_bitgen", "_py", "_pool", "_pos")
+
+    def __init__(self, seed: Optional[int] = None, counter: int = 0, nonce: str = ""):
+        self.seed = seed if seed is not None else secrets.randbits(64)
+        # 派生种子时使用的流编号，未设置全局种子时为空
+        self.nonce = nonce
+        self.counter = 0
+        self._pool: list[int] = []
+        self._pos = 0
+        if np is not None:
+            self.engine = "pcg64"
+            self._bitgen = np.random.PCG64(self.seed)
+            self._py = None
+        else:
+            self.engine = "mt19937"
+            self._bitgen = None
+            self._py = random.Random(self.seed)
+        if counter:
+            self._skip(counter)
+
+    def _skip(self, n: int):
+        """跳过 n 个随机字（仅在缓冲池为空时调用）"""
+        if self._bitgen is not None:
+            self._bitgen.advance(n)
+        else:
+            remaining = n
+            while remaining:
+                step = min(remaining, _SKIP_CHUNK)
+                self._py.getrandbits(64 * step)
+                remaining -= step
+        self.counter += n
+
+    def _refill(self):
+        if self._bitgen is not None:
+            self._pool = self._bitgen.random_raw(_POOL_WORDS).tolist()
+        else:
+            getrandbits = self._py.getrandbits
+            self._pool = [getrandbits(64) for _ in range(_POOL_WORDS)]
+        self._pos = 0
+
+    def _word(self) -> int:
+        if self._pos >= len(self._pool):
+            self._refill()
+        word = self._pool[self._pos]
+        self._pos += 1
+        self.counter += 1
+        return word
+
+    def randint(self, faces: int) -> int:
+        """抽取 1..faces 的整数，拒绝采样保证无偏"""
+        if faces <= _WORD:
+            limit = _WORD - _WORD % faces
+            while True:
+                word = self._word()
+                if word < limit:
+                    return word % faces + 1
+        # 超过 64 位的面数拼接多个随机字
+        words = -(-faces.bit_length() // 64)
+        span = 1 << (64 * words)
+        limit = span - span % faces
+        while True:
+            value = 0
+            for _ in range(words):
+                value = (value << 64) | self._word()
+            if value < limit:
+                return value % faces + 1
+
+    def roll(self, count: int, faces: int) -> list[int]:
+        """逐个投掷 count 个骰子"""
+        if faces > _WORD:
+            return [self.randint(faces) for _ in range(count)]
+        limit = _WORD - _WORD % faces
+        values = []
+        append = values.append
+        pool, pos = self._pool, self._pos
+        used = 0
+        while len(values) < count:
+            if pos >= len(pool):
+                self._refill()
+                pool, pos = self._pool, 0
+            word = pool[pos]
+            pos += 1
+            used += 1
+            if word < limit:
+                append(word % faces + 1)
+        self._pos = pos
+        self.counter += used
+        return values
+
+    def total(self, count: int, faces: int) -> int:
+        """投掷 count 个骰子并求和，按块抽取，内存占用与 count 无关；有 numpy 时每块向量化
+
+        分块不改变随机字的消耗顺序，结果与一次 roll(count, faces) 的总和相同。
+        """
+        if count <= _CHUNK:
+            return sum(self.roll(count, faces))
+        vectorized = self._bitgen is not None and faces < (1 << 62)
+        total = 0
+        remaining = count
+        while remaining:
+            n = min(remaining, _CHUNK)
+            remaining -= n
+            if vectorized:
+                chunk = self.integers(1, faces + 1, size=n)
+                total += int(chunk.sum()) if faces * n < (1 << 63) else sum(chunk.tolist())
+            else:
+                total += sum(self.roll(n, faces))
+        return total
+
+    def _raw(self, n: int):
+        """numpy：按顺序取 n 个随机字，先用完缓冲池再直接从位生成器抽取"""
+        buffered = self._pool[self._pos:self._pos + n]
+        self._pos += len(buffered)
+        self.counter += n
+        rest = n - len(buffered)
+        if not rest:
+            return np.array(buffered, dtype=np.uint64)
+        raw = self._bitgen.random_raw(rest)
+        if buffered:
+            raw = np.concatenate((np.array(buffered, dtype=np.uint64), raw))
+        return raw
+
+    def integers(self, low: int, high: int, size=None, dtype=None):
+        """numpy：与 Generator.integers 调用方式相同，返回 [low, high) 的整数数组"""
+        faces = high - low
+        shape = size if size is not None else ()
+        n = int(np.prod(shape))
+        if faces > (1 << 62):
+            values = np.array([low - 1 + self.randint(faces) for _ in range(n)], dtype=object)
+            return values.reshape(shape)
+        # 面数为 2 的幂时取模本身无偏，不需要拒绝
+        limit = np.uint64(_WORD - _WORD % faces) if faces & (faces - 1) else None
+        faces_u = np.uint64(faces)
+        parts = []
+        need = n
+        while need:
+            words = self._raw(need)
+            if limit is not None:
+                words = words[words < limit]
+            parts.append((words % faces_u).astype(np.int64))
+            need -= len(parts[-1])
+        values = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        values += low
+        return values.reshape(shape).astype(dtype or np.int64, copy=False)
+
+
+class RngStreams:
+    """storage_id -> DiceRng，最久未使用的流会被淘汰
+
+    设置了 seed 时，每个流的种子由 seed、storage_id 与流编号派生（见 derive_seed），
+    流编号为 "<本次启动的随机标识>-<创建序号>"，记录在 DiceRng.nonce 中；
+    同一用户的流在重启或被淘汰后重新创建时使用新的编号，不会重复之前的序列。
+    未设置 seed 时每个流使用随机种子。
+    """
+
+    def __init__(self, seed: Optional[str] = None, max_streams: int = _MAX_STREAMS):
+        self.seed = seed or None
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[str, DiceRng]" = OrderedDict()
+        # 本次启动的随机标识与已创建的流个数，组成流编号
+        self._boot = secrets.token_hex(4)
+        self._created = 0
+
+    def derive_seed(self, storage_id: str, nonce: str) -> Optional[int]:
+        """由全局种子、storage_id 与流编号派生流的种子，未设置全局种子时返回 None"""
+        if self.seed is None:
+            return None
+        digest = hashlib.sha256(f"{self.seed}:{storage_id}:{nonce}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def get(self, storage_id: str) -> DiceRng:
+        stream = self._streams.get(storage_id)
+        if stream is None:
+            nonce = ""
+            if self.seed is not None:
+                self._created += 1
+                nonce = f"{self._boot}-{self._created}"
+            stream = DiceRng(self.derive_seed(storage_id, nonce), nonce=nonce)
+            self._streams[storage_id] = stream
+            if len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+        else:
+            self._streams.move_to_end(storage_id)
+        return stream
@@ -0,0 +1,242 @@
+"""骰子表达式的蒙特卡洛模拟
+
+精确卷积处理不了的表达式（非线性运算等）通过大量随机试验估计分布。
+试验按批次向量化执行（需要 numpy，缺失时逐次求值），并分片到进程池中，
+每个分片都遵守同一个截止时间，超时后返回已完成的部分结果。
+
+本模块只依赖 dice_engine，可以在进程池的子进程中单独导入。
+"""
+import asyncio
+import math
+import multiprocessing
+import secrets
+import time
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional
+
+from .dice_engine import BinOp, Dice, DicePool, Neg, Num, compile_expression, np
+
+# 每批向量化试验的次数
+_BATCH_TRIALS = 10_000
+# 没有 numpy 时每检查一次截止时间前逐次求值的次数
+_SCALAR_BATCH = 1_000
+# 每批抽取的随机数个数上限（试验次数 × 骰子个数），决定子进程内存上限
+_BATCH_CELLS = 1 << 20
+# 直方图的区间数
+_HISTOGRAM_BINS = 10
+# int64 能表示的绝对值上界，整数运算的结果达到它即视为溢出
+_INT64_LIMIT = 2.0 ** 63
+
+
+class SimulationResult:
+    """模拟结果"""
+
+    __slots__ = ("expression", "requested", "trials", "invalid", "valid", "counts", "elapsed", "truncated", "errors")
+
+    def __init__(self, expression: str, requested: int, trials: int, counts: Counter, elapsed: float,
+                 invalid: int = 0, errors: Optional[list] = None):
+        self.expression = expression
+        self.requested = requested
+        # 得到有效结果的试验次数；除零、非有限值等无效试验单独计数，不计入统计
+        self.trials = trials
+        self.invalid = invalid
+        self.valid = sum(counts.values())
+        self.counts = counts
+        self.elapsed = elapsed
+        self.truncated = trials + invalid < requested
+        # 失败（抛出异常或未按时返回）的分片说明，这些分片的试验不计入结果
+        self.errors = errors or []
+
+    @property
+    def mean(self) -> float:
+        return sum(v * c for v, c in self.counts.items()) / self.valid
+
+    @property
+    def stdev(self) -> float:
+        mean = self.mean
+        return math.sqrt(sum(c * (v - mean) ** 2 for v, c in self.counts.items()) / self.valid)
+
+    def percentile(self, p: float):
+        threshold = self.valid * p / 100
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= threshold:
+                return value
+        return max(self.counts)
+
+    def histogram(self) -> list[tuple[float, float, int]]:
+        """把结果分成若干等宽区间，返回 [(下界, 上界, 次数)...]"""
+        low, high = min(self.counts), max(self.counts)
+        distinct = len(self.counts)
+        if distinct <= _HISTOGRAM_BINS:
+            return [(v, v, self.counts[v]) for v in sorted(self.counts)]
+        if all(isinstance(v, int) for v in self.counts):
+            # 整数结果使用整数宽度的区间，区间为闭区间 [下界, 上界]
+            width = math.ceil((high - low + 1) / _HISTOGRAM_BINS)
+            bins = [0] * math.ceil((high - low + 1) / width)
+            for value, count in self.counts.items():
+                bins[(value - low) // width] += count
+            return [(low + i * width, min(low + (i + 1) * width - 1, high), n) for i, n in enumerate(bins)]
+        width = (high - low) / _HISTOGRAM_BINS
+        bins = [0] * _HISTOGRAM_BINS
+        for value, count in self.counts.items():
+            bins[min(int((value - low) / width), _HISTOGRAM_BINS - 1)] += count
+        return [(low + i * width, low + (i + 1) * width, n) for i, n in enumerate(bins)]
+
+
+def _constant(value):
+    """常数的数组元素：超出 int64 的整数改用浮点数，过大的得到 inf 并在之后被排除"""
+    if isinstance(value, int) and not -_INT64_LIMIT <= value < _INT64_LIMIT:
+        try:
+            return float(value)
+        except OverflowError:
+            return math.inf if value > 0 else -math.inf
+    return value
+
+
+def _sample(node, rng, n: int, valid):
+    """对语法树做 n 次向量化求值
+
+    除数为 0 的试验与 int64 整数运算溢出的试验在 valid 中标记为 False。
+    """
+    if isinstance(node, Num):
+        return np.full(n, _constant(node.value))
+    if isinstance(node, Dice):
+        # 总和可能超出 int64 时用浮点数累加
+        total = np.zeros(n, dtype=np.int64 if node.count * node.faces < _INT64_LIMIT else np.float64)
+        remaining = node.count
+        step = max(1, _BATCH_CELLS // n)
+        while remaining:
+            k = min(remaining, step)
+            remaining -= k
+            total += rng.integers(1, node.faces + 1, size=(n, k), dtype=np.int64).sum(axis=1)
+        return total
+    if isinstance(node, DicePool):
+        # 每行需要完整的骰池才能做保留/爆炸，按行数分批控制内存
+        out = np.empty(n, dtype=np.int64)
+        rows = max(1, _BATCH_CELLS // max(node.count, 1))
+        for start in range(0, n, rows):
+            stop = min(n, start + rows)
+            values = rng.integers(1, node.faces + 1, size=(stop - start, node.count), dtype=np.int64)
+            out[start:stop] = node.reduce_rows(values, rng)
+        return out
+    if isinstance(node, Neg):
+        return -_sample(node.operand, rng, n, valid)
+    if isinstance(node, BinOp):
+        left = _sample(node.left, rng, n, valid)
+        right = _sample(node.right, rng, n, valid)
+        if node.op == "**":
+            return np.power(left.astype(np.float64), right)
+        if node.op in ("/", "//", "%"):
+            # 整数除以 0 在 errstate(ignore) 下得到 0，需要单独排除
+            valid &= right != 0
+        elif left.dtype.kind == "i" and right.dtype.kind == "i":
+            # int64 的加减乘溢出时静默回绕，用浮点结果判断是否越界
+            approx = node.func(left.astype(np.float64), right.astype(np.float64))
+            valid &= np.abs(approx) < _INT64_LIMIT
+        return node.func(left, right)
+    raise TypeError(f"不支持的节点: {type(node).__name__}")
+
+
+def run_trials(expression: str, trials: int, seed: int, deadline: float) -> tuple[dict, int, int]:
+    """在子进程中执行 trials 次试验，返回 ({结果: 次数}, 有效试验次数, 无效试验次数)
+
+    每批结束后检查截止时间（time.time()），超时则提前返回。
+    除零、非实数、非有限值等无效结果不计入直方图与有效次数。seed 仅在 numpy 模式下使用。
+    """
+    compiled = compile_expression(expression)
+    counts: Counter = Counter()
+    done = invalid = 0
+
+    if np is None:
+        while done + invalid < trials and time.time() < deadline:
+            for _ in range(min(_SCALAR_BATCH, trials - done - invalid)):
+                try:
+                    value = compiled.evaluate()
+                except ArithmeticError:
+                    invalid += 1
+                    continue
+                if isinstance(value, float) and not math.isfinite(value):
+                    invalid += 1
+                    continue
+                counts[value] += 1
+                done += 1
+        return dict(counts), done, invalid
+
+    rng = np.random.default_rng(seed)
+    with np.errstate(all="ignore"):
+        while done + invalid < trials and time.time() < deadline:
+            n = min(_BATCH_TRIALS, trials - done - invalid)
+            valid = np.ones(n, dtype=bool)
+            values = np.asarray(_sample(compiled.root, rng, n, valid))
+            if values.dtype.kind == "f":
+                valid &= np.isfinite(values)
+            values = values[valid]
+            # 乘方等运算得到的整数值浮点结果转回整数，便于直方图显示
+            if values.dtype.kind == "f" and np.all(np.abs(values) < 2 ** 53) and np.all(values == np.floor(values)):
+                values = values.astype(np.int64)
+            uniq, cnt = np.unique(values, return_counts=True)
+            counts.update(dict(zip(uniq.tolist(), cnt.tolist())))
+            done += len(values)
+            invalid += n - len(values)
+    return dict(counts), done, invalid
+
+
+def create_pool(workers: int) -> ProcessPoolExecutor:
+    """创建模拟用的进程池
+
+    使用 spawn 启动子进程：宿主进程里运行着事件循环和其他线程，fork 不安全。
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+async def simulate(
+    expression: str,
+    trials: int,
+    executor: Optional[Executor],
+    shards: int,
+    time_budget: float,
+) -> SimulationResult:
+    """把 trials 次试验分成 shards 片交给 executor 执行，不阻塞事件循环
+
+    所有分片共享同一截止时间，超出 time_budget 后只汇总已完成的部分。
+    executor 为 None 时使用默认线程池。失败的分片记入结果的 errors；
+    所有分片都失败时抛出第一个分片的异常。
+    """
+    compile_expression(expression)  # 先在本进程检查语法
+    loop = asyncio.get_running_loop()
+    start = time.time()
+    deadline = start + time_budget
+    shards = max(1, min(shards, math.ceil(trials / _BATCH_TRIALS)))
+    per_shard, extra = divmod(trials, shards)
+    futures = [
+        loop.run_in_executor(
+            executor, run_trials, expression, per_shard + (1 if i < extra else 0),
+            secrets.randbits(63), deadline,
+        )
+        for i in range(shards)
+    ]
+    # 子进程自行在截止时间停止，这里额外留一点余量等待结果返回
+    finished, pending = await asyncio.wait(futures, timeout=time_budget + 1.0)
+    for future in pending:
+        future.cancel()
+
+    counts: Counter = Counter()
+    done = invalid = 0
+    errors = [f"分片 {futures.index(future) + 1} 未在时限内返回" for future in pending]
+    first_error = None
+    for future in finished:
+        error = future.exception() if not future.cancelled() else asyncio.CancelledError()
+        if error is not None:
+            errors.append(f"分片 {futures.index(future) + 1} 失败: {error!r}")
+            first_error = first_error or error
+            continue
+        shard_counts, shard_done, shard_invalid = future.result()
+        counts.update(shard_counts)
+        done += shard_done
+        invalid += shard_invalid
+    if len(errors) == len(futures) and first_error is not None:
+        raise first_error
+    return SimulationResult(expression, trials, done, counts, time.time() - start, invalid, errors)
@@ -0,0 +1,211 @@
+"""骰子表达式的精确概率分布
+
+把线性骰子表达式（若干 ±k·NdM 与常数之和）分解为各骰子分量，
+分量分布按 (个数, 面数) 缓存，再通过卷积组合得到整个表达式的分布。
+安装 numpy 时使用 FFT 卷积，否则退回纯 Python 实现。
+"""
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+from typing import Optional
+
+from .dice_engine import BinOp, CompiledExpr, Dice, DicePool, Neg, Num, Ref, np
+
+# 分布支撑集（可能取值个数）的上限
+_MAX_SUPPORT = 1 << 21
+# 纯 Python 卷积的运算量上限
+_PURE_PY_MAX_WORK = 2_000_000
+# 小于此长度的数组直接卷积，不走 FFT
+_FFT_MIN_SIZE = 64
+# 分量分布缓存大小
+_DIST_CACHE_SIZE = 256
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class StatsError(ValueError):
+    """无法精确计算分布（非线性表达式或分布过大）"""
+
+
+class ExpressionStats:
+    """表达式分布的统计量"""
+
+    __slots__ = ("expression", "mean", "variance", "min", "max", "percentiles", "target", "prob_at_least")
+
+    def __init__(self, expression: str, mean: float, variance: float, min_value, max_value,
+                 percentiles: dict[int, float], target: Optional[float], prob_at_least: Optional[float]):
+        self.expression = expression
+        self.mean = mean
+        self.variance = variance
+        self.min = min_value
+        self.max = max_value
+        self.percentiles = percentiles
+        self.target = target
+        self.prob_at_least = prob_at_least
+
+
+def linear_terms(compiled: CompiledExpr) -> tuple[list[tuple[int, int, int]], float]:
+    """把表达式分解为 ([(系数, 个数, 面数)...], 常数)，非线性表达式抛出 StatsError"""
+    terms: list[tuple[int, int, int]] = []
+    constant = _collect_terms(compiled.root, 1, terms)
+    return terms, constant
+
+
+def _collect_terms(node, coef, terms: list[tuple[int, int, int]]):
+    if isinstance(node, Num):
+        return coef * node.value
+    if isinstance(node, Dice):
+        if coef != int(coef):
+            raise StatsError("骰子的系数必须为整数")
+        if coef and node.count:
+            terms.append((int(coef), node.count, node.faces))
+        return 0
+    if isinstance(node, DicePool):
+        raise StatsError("带修饰的骰池（保留/爆炸/成功计数）无法精确计算，请使用模拟")
+    if isinstance(node, Ref):
+        raise StatsError("不支持 KV 引用，请代入具体数值")
+    if isinstance(node, Neg):
+        return _collect_terms(node.operand, -coef, terms)
+    if isinstance(node, BinOp):
+        if node.op == "+":
+            return _collect_terms(node.left, coef, terms) + _collect_terms(node.right, coef, terms)
+        if node.op == "-":
+            return _collect_terms(node.left, coef, terms) + _collect_terms(node.right, -coef, terms)
+        if node.op == "*":
+            if isinstance(node.right, Num):
+                return _collect_terms(node.left, coef * node.right.value, terms)
+            if isinstance(node.left, Num):
+                return _collect_terms(node.right, coef * node.left.value, terms)
+    raise StatsError("只支持骰子与常数的加减及常数倍数")
+
+
+@lru_cache(maxsize=_DIST_CACHE_SIZE)
+def dice_distribution(count: int, faces: int):
+    """count 个 faces 面骰之和的分布，下标 i 对应总和 count + i
+
+    numpy 下用平方递推 + FFT，中间结果同样按 (个数, 面数) 缓存复用。
+    """
+    if np is not None:
+        if count == 1:
+            dist = np.full(faces, 1.0 / faces)
+        else:
+            half = dice_distribution(count // 2, faces)
+            dist = _convolve(half, half)
+            if count % 2:
+                dist = _convolve(dist, dice_distribution(1, faces))
+        dist.setflags(write=False)
+        return dist
+
+    if count * count * faces // 2 > _PURE_PY_MAX_WORK:
+        raise StatsError("分布过大，请安装 numpy 后重试")
+    dist = [1.0]
+    for _ in range(count):
+        dist = _add_uniform(dist, faces)
+    return tuple(dist)
+
+
+def _add_uniform(dist: list[float], faces: int) -> list[float]:
+    """纯 Python：在分布上再加一个 faces 面骰（滑动窗口求和）"""
+    prefix = [0.0, *accumulate(dist)]
+    size = len(dist)
+    inv = 1.0 / faces
+    return [
+        (prefix[min(j + 1, size)] - prefix[max(j + 1 - faces, 0)]) * inv
+        for j in range(size + faces - 1)
+    ]
+
+
+def _convolve(a, b):
+    if np is not None:
+        if min(len(a), len(b)) < _FFT_MIN_SIZE:
+            return np.convolve(a, b)
+        n = len(a) + len(b) - 1
+        size = 1 << (n - 1).bit_length()
+        out = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+        np.clip(out, 0.0, None, out=out)
+        return out / out.sum()
+
+    if len(a) * len(b) > _PURE_PY_MAX_WORK:
+        raise StatsError("分布过大，请安装 numpy 后重试")
+    out = [0.0] * (len(a) + len(b) - 1)
+    for i, pa in enumerate(a):
+        if pa:
+            for j, pb in enumerate(b):
+                out[i + j] += pa * pb
+    return out
+
+
+def _scale(dist, coef: int):
+    """系数为 coef 时的分布：反转负号并在相邻取值间插入 0"""
+    if coef < 0:
+        dist = dist[::-1]
+    step = abs(coef)
+    if step == 1:
+        return dist
+    size = (len(dist) - 1) * step + 1
+    if np is not None:
+        out = np.zeros(size)
+    else:
+        out = [0.0] * size
+    out[::step] = dist
+    return out
+
+
+def expression_distribution(compiled: CompiledExpr) -> tuple[int, object, float]:
+    """计算表达式的分布，返回 (最小骰子和, 概率数组, 常数)
+
+    下标 i 的概率对应取值 最小骰子和 + i + 常数。
+    """
+    terms, constant = linear_terms(compiled)
+    offset, dist = _terms_distribution(terms)
+    return offset, dist, constant
+
+
+def _terms_distribution(terms: list[tuple[int, int, int]]) -> tuple[int, object]:
+    if not terms:
+        raise StatsError("表达式中没有骰子")
+    support = 1 + sum(abs(coef) * count * (faces - 1) for coef, count, faces in terms)
+    if support > _MAX_SUPPORT:
+        raise StatsError("分布过大，无法精确计算")
+
+    offset = 0
+    dist = None
+    for coef, count, faces in terms:
+        # 系数为负时最小值来自骰子取最大值
+        offset += coef * count if coef > 0 else coef * count * faces
+        component = _scale(dice_distribution(count, faces), coef)
+        dist = component if dist is None else _convolve(dist, component)
+    return offset, dist
+
+
+def describe_expression(compiled: CompiledExpr, target: Optional[float] = None) -> ExpressionStats:
+    """计算均值、方差、分位数以及 P(结果 ≥ target)"""
+    terms, constant = linear_terms(compiled)
+    offset, dist = _terms_distribution(terms)
+
+    # 均值与方差直接用解析式，避免浮点累积误差
+    mean = constant + sum(coef * count * (faces + 1) / 2 for coef, count, faces in terms)
+    variance = sum(coef * coef * count * (faces * faces - 1) / 12 for coef, count, faces in terms)
+
+    cdf = list(accumulate(dist.tolist() if np is not None else dist))
+    percentiles = {
+        p: offset + min(bisect_left(cdf, p / 100 - 1e-12), len(cdf) - 1) + constant
+        for p in PERCENTILES
+    }
+
+    prob = None
+    if target is not None:
+        index = target - constant - offset
+        first = max(0, int(-(-index // 1)))
+        if first >= len(cdf):
+            prob = 0.0
+        elif first == 0:
+            prob = 1.0
+        else:
+            prob = max(0.0, min(1.0, 1.0 - cdf[first - 1]))
+
+    return ExpressionStats(
+        compiled.text, mean, variance,
+        offset + constant, offset + len(cdf) - 1 + constant,
+        percentiles, target, prob,
+    )
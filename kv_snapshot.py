@@ -0,0 +1,176 @@
+"""KV 快照的编码与解码
+
+快照有两种形式，读取时按开头的魔数自动识别：
+- 文本 JSON：带缩进，与旧版 kv.json 相同，便于直接查看和手工修改（默认）
+- 二进制快照：8 字节文件头 + 编码后的数据（可选压缩）
+
+文件头: b"SDKV" | 版本 (1 字节) | 编码 (1 字节) | 压缩 (1 字节) | 保留 (1 字节)
+
+编码: json（紧凑 JSON，无需额外依赖）、msgpack（需要 msgpack）、cbor（需要 cbor2）
+压缩: none、zlib（标准库）、zstd（需要 zstandard）
+
+本模块不依赖 astrbot，可以直接被 scripts/ 与 bench/ 下的脚本导入。
+"""
+import json
+import struct
+import zlib
+from typing import Any, Dict
+
+try:
+    import msgpack
+except ImportError:  # msgpack 为可选依赖
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # cbor2 为可选依赖
+    cbor2 = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖
+    zstandard = None
+
+# 二进制快照的魔数
+MAGIC = b"SDKV"
+# 当前的文件头版本
+VERSION = 1
+# 文件头: 魔数、版本、编码、压缩、保留
+_HEADER = struct.Struct("!4sBBBx")
+# 编码名与文件头中的编号
+CODECS = {"json": 0, "msgpack": 1, "cbor": 2}
+# 压缩名与文件头中的编号
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+# zlib 压缩级别
+_ZLIB_LEVEL = 6
+# zstd 压缩级别
+_ZSTD_LEVEL = 3
+# msgpack 中超出 64 位的整数以此扩展类型保存（十进制文本）
+_EXT_BIGINT = 1
+
+
+class SnapshotError(ValueError):
+    """快照无法解析（文件头无效或数据损坏）"""
+
+
+class SnapshotDependencyError(SnapshotError):
+    """快照使用的编码或压缩需要未安装的可选依赖"""
+
+
+def _require(codec: str, compression: str):
+    """检查编码与压缩是否受支持、所需依赖是否已安装"""
+    if codec not in CODECS:
+        raise SnapshotError(f"未知的快照编码 {codec!r}")
+    if compression not in COMPRESSIONS:
+        raise SnapshotError(f"未知的快照压缩方式 {compression!r}")
+    if codec == "msgpack" and msgpack is None:
+        raise SnapshotDependencyError("msgpack 快照需要安装 msgpack")
+    if codec == "cbor" and cbor2 is None:
+        raise SnapshotDependencyError("cbor 快照需要安装 cbor2")
+    if compression == "zstd" and zstandard is None:
+        raise SnapshotDependencyError("zstd 压缩需要安装 zstandard")
+
+
+def _msgpack_default(value):
+    if isinstance(value, int):
+        return msgpack.ExtType(_EXT_BIGINT, str(value).encode("ascii"))
+    raise TypeError(f"无法编码 {type(value).__name__} 类型的值")
+
+
+def _msgpack_ext(code: int, data: bytes):
+    if code == _EXT_BIGINT:
+        return int(data)
+    return msgpack.ExtType(code, data)
+
+
+class SnapshotFormat:
+    """快照的写入格式，json + none 时写文本 JSON，其余写二进制快照"""
+
+    __slots__ = ("codec", "compression")
+
+    def __init__(self, codec: str = "json", compression: str = "none"):
+        _require(codec, compression)
+        self.codec = codec
+        self.compression = compression
+
+    @property
+    def is_text(self) -> bool:
+        return self.codec == "json" and self.compression == "none"
+
+    def __str__(self) -> str:
+        if self.is_text:
+            return "json（文本）"
+        return self.codec if self.compression == "none" else f"{self.codec}+{self.compression}"
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        if self.is_text:
+            return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        if self.codec == "msgpack":
+            payload = msgpack.packb(data, use_bin_type=True, default=_msgpack_default)
+        elif self.codec == "cbor":
+            payload = cbor2.dumps(data)
+        else:
+            payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if self.compression == "zlib":
+            payload = zlib.compress(payload, _ZLIB_LEVEL)
+        elif self.compression == "zstd":
+            payload = zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(payload)
+        return _HEADER.pack(MAGIC, VERSION, CODECS[self.codec], COMPRESSIONS[self.compression]) + payload
+
+
+# 默认格式：文本 JSON
+TEXT_JSON = SnapshotFormat()
+
+
+def _decode_errors() -> tuple:
+    errors = [ValueError, TypeError, EOFError, zlib.error]
+    if msgpack is not None:
+        errors.append(msgpack.UnpackException)
+    if zstandard is not None:
+        errors.append(zstandard.ZstdError)
+    return tuple(errors)
+
+
+# 解码时视为数据损坏的异常
+_DECODE_ERRORS = _decode_errors()
+
+
+def detect(raw: bytes) -> SnapshotFormat:
+    """按文件头识别快照格式，没有文件头的视为文本 JSON"""
+    if not raw.startswith(MAGIC):
+        return TEXT_JSON
+    if len(raw) < _HEADER.size:
+        raise SnapshotError("快照文件头不完整")
+    _, version, codec_id, compression_id = _HEADER.unpack_from(raw)
+    if version != VERSION:
+        raise SnapshotError(f"不支持的快照版本 {version}")
+    codec = next((name for name, i in CODECS.items() if i == codec_id), None)
+    compression = next((name for name, i in COMPRESSIONS.items() if i == compression_id), None)
+    if codec is None or compression is None:
+        raise SnapshotError(f"未知的快照编码 {codec_id} 或压缩方式 {compression_id}")
+    return SnapshotFormat(codec, compression)
+
+
+def decode(raw: bytes) -> Dict[str, Any]:
+    """解码快照，数据损坏时抛出 SnapshotError，缺少依赖时抛出 SnapshotDependencyError"""
+    fmt = detect(raw)
+    try:
+        if fmt.is_text:
+            data = json.loads(raw)
+        else:
+            payload = raw[_HEADER.size:]
+            if fmt.compression == "zlib":
+                payload = zlib.decompress(payload)
+            elif fmt.compression == "zstd":
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            if fmt.codec == "msgpack":
+                data = msgpack.unpackb(payload, raw=False, ext_hook=_msgpack_ext)
+            elif fmt.codec == "cbor":
+                data = cbor2.loads(payload)
+            else:
+                data = json.loads(payload)
+    except _DECODE_ERRORS as e:
+        raise SnapshotError(f"{fmt} 快照解析失败: {e}") from e
+    if not isinstance(data, dict):
+        raise SnapshotError(f"快照顶层应为对象，实际为 {type(data).__name__}")
+    return data
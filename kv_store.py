@@ -0,0 +1,860 @@
+"""KV 存储
+
+KVStore 是插件使用的存储入口：读操作命中常驻内存的数据，写操作只记录为脏，
+由定时器合并后统一交给后端落盘（write-behind），脏写入次数达到阈值时立即落盘，
+插件卸载时保证最后一次落盘。
+
+持久化由可替换的后端完成：
+- JsonBackend: 单个 JSON 文件（默认，兼容旧版 kv.json）
+- JournalBackend: JSON 快照 + 追加写日志，日志超过阈值后在后台压缩为新快照
+- SqliteBackend: SQLite（WAL 模式），按 (storage_id, key) 存行，支持点查、前缀扫描和单行 upsert
+- ShardedJsonBackend: 每个 storage_id 一个 JSON 文件，按需读取，写入只重写受影响的文件
+
+常驻内存的 storage 可以设置预算（键值对数量），超出时按最久未使用淘汰
+没有未落盘变更的 storage，之后访问时再从后端载入。
+
+快照文件（kv.json 与分片文件）可以写成带缩进的文本 JSON 或带版本文件头的
+二进制快照（msgpack/cbor/紧凑 JSON，可选压缩，见 kv_snapshot），读取时按文件头
+自动识别，因此切换格式后旧文件仍可读取，下次写入时改用新格式。
+
+快照文件总是先写临时文件再原子改名，崩溃不会留下写了一半的 kv.json；
+无法解析的快照会被改名保留并记录错误，而不是当作空数据覆盖；
+缺少读取所需的可选依赖时直接报错，文件保持不变。
+"""
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from astrbot.api import logger
+
+from .kv_snapshot import TEXT_JSON, SnapshotDependencyError, SnapshotError, SnapshotFormat, decode
+from .metrics import METRICS
+
+# 变更集中表示"删除该键"的标记
+DELETED = object()
+
+# 变更集: {storage_id: {key: 新值或 DELETED}}
+Changes = Dict[str, Dict[str, Any]]
+
+
+class KVBackend:
+    """KV 持久化后端接口"""
+
+    def open(self):
+        """打开后端（读取文件、建立连接等）"""
+
+    def load(self, storage_id: str) -> Dict[str, Any]:
+        """读取一个 storage_id 下的全部键值，不存在时返回空字典"""
+        raise NotImplementedError
+
+    def get(self, storage_id: str, key: str, default: Any = None) -> Any:
+        """读取单个键"""
+        return self.load(storage_id).get(key, default)
+
+    def scan_prefix(self, storage_id: str, prefix: str) -> Dict[str, Any]:
+        """读取 storage_id 下以 prefix 开头的键值"""
+        return {k: v for k, v in self.load(storage_id).items() if k.startswith(prefix)}
+
+    def write(self, changes: Changes):
+        """持久化一批变更"""
+        raise NotImplementedError
+
+    def close(self):
+        """关闭后端"""
+
+
+def read_snapshot(path: Path) -> Dict[str, Dict[str, Any]]:
+    """读取快照文件（自动识别格式），文件损坏时改名保留并返回空数据"""
+    if not path.exists():
+        return {}
+    try:
+        return decode(path.read_bytes())
+    except SnapshotDependencyError as e:
+        logger.error(f"无法读取 KV 数据文件 {path}: {e}")
+        raise
+    except SnapshotError as e:
+        backup = path.with_name(f"{path.name}.corrupt-{int(time.time())}")
+        path.rename(backup)
+        logger.error(f"KV 数据文件 {path} 已损坏（{e}），原文件已保留为 {backup}，将从空数据开始")
+        return {}
+
+
+def write_snapshot(path: Path, data: Dict[str, Dict[str, Any]], fmt: SnapshotFormat = TEXT_JSON):
+    """原子地写入快照：先写临时文件并 fsync，再改名覆盖"""
+    path.parent.mkdir(exist_ok=True)
+    raw = fmt.encode(data)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class JsonBackend(KVBackend):
+    """单个快照文件后端，打开时整体读入，每次 write 整体重写"""
+
+    def __init__(self, path: Path, fmt: SnapshotFormat = TEXT_JSON):
+        self.path = Path(path)
+        self.fmt = fmt
+        self._data: Dict[str, Dict[str, Any]] = {}
+
+    def open(self):
+        self.path.parent.mkdir(exist_ok=True)
+        self._data = read_snapshot(self.path)
+
+    def load(self, storage_id: str) -> Dict[str, Any]:
+        return dict(self._data.get(storage_id, {}))
+
+    def get(self, storage_id: str, key: str, default: Any = None) -> Any:
+        return self._data.get(storage_id, {}).get(key, default)
+
+    def write(self, changes: Changes):
+        _apply_changes(self._data, changes)
+        write_snapshot(self.path, self._data, self.fmt)
+
+
+class JournalBackend(KVBackend):
+    """JSON 快照 + 追加写日志（JSON Lines）
+
+    每次 write 只把变更追加到日志，代价与变更大小成正比。日志超过
+    compact_bytes 后被封存为 <日志>.1 并换用新日志，后台线程读取旧快照、
+    重放封存日志、原子写出新快照后删除封存日志。日志记录都是整值写入/删除，
+    重放是幂等的，压缩中途崩溃只会在下次启动时多重放一次。
+    """
+
+    def __init__(self, snapshot_path: Path, journal_path: Path, compact_bytes: int = 1 << 20,
+                 fmt: SnapshotFormat = TEXT_JSON):
+        self.snapshot_path = Path(snapshot_path)
+        self.fmt = fmt
+        self.journal_path = Path(journal_path)
+        self.sealed_path = self.journal_path.with_name(self.journal_path.name + ".1")
+        self.compact_bytes = compact_bytes
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._compactor: Optional[threading.Thread] = None
+
+    def open(self):
+        self.snapshot_path.parent.mkdir(exist_ok=True)
+        self._data = read_snapshot(self.snapshot_path)
+        # 封存日志早于当前日志，先重放
+        for path in (self.sealed_path, self.journal_path):
+            _replay_journal(path, self._data)
+        # 崩溃时写了一半的末行没有换行符，补上换行，避免与之后追加的记录粘连
+        if self.journal_path.exists() and self.journal_path.stat().st_size:
+            with open(self.journal_path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        if self.sealed_path.exists():
+            self._start_compaction()
+
+    def load(self, storage_id: str) -> Dict[str, Any]:
+        return dict(self._data.get(storage_id, {}))
+
+    def get(self, storage_id: str, key: str, default: Any = None) -> Any:
+        return self._data.get(storage_id, {}).get(key, default)
+
+    def write(self, changes: Changes):
+        _apply_changes(self._data, changes)
+        lines = []
+        for storage_id, storage_changes in changes.items():
+            for key, value in storage_changes.items():
+                if value is DELETED:
+                    record = {"s": storage_id, "k": key, "d": 1}
+                else:
+                    record = {"s": storage_id, "k": key, "v": value}
+                lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        if size >= self.compact_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """封存当前日志并启动后台压缩；上一次压缩未完成时跳过"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if self.sealed_path.exists():
+            return
+        os.replace(self.journal_path, self.sealed_path)
+        self._start_compaction()
+
+    def _start_compaction(self):
+        self._compactor = threading.Thread(target=self._compact, name="kv-journal-compact", daemon=True)
+        self._compactor.start()
+
+    def _compact(self):
+        try:
+            data = read_snapshot(self.snapshot_path)
+            _replay_journal(self.sealed_path, data)
+            write_snapshot(self.snapshot_path, data, self.fmt)
+            self.sealed_path.unlink()
+        except OSError as e:
+            logger.error(f"KV 日志压缩失败: {e}")
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+
+
+def _replay_journal(path: Path, data: Dict[str, Dict[str, Any]]):
+    """把日志中的记录依次应用到 data，跳过崩溃时写了一半的行"""
+    if not path.exists():
+        return
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for lineno, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+                change = DELETED if record.get("d") else record["v"]
+                _apply_changes(data, {record["s"]: {record["k"]: change}})
+            except (json.JSONDecodeError, KeyError, TypeError):
+                logger.warning(f"跳过 KV 日志 {path} 第 {lineno} 行的无效记录")
+
+
+class ShardedJsonBackend(KVBackend):
+    """每个 storage_id 一个快照文件（分片），不常驻内存
+
+    load 只读取对应的分片，write 只重写受影响的分片，变空的分片直接删除。
+    分片目录为空且存在旧 kv.json 时，首次打开会把它拆分为分片，原文件改名保留。
+    """
+
+    def __init__(self, shard_dir: Path, migrate_from: Optional[Path] = None, fmt: SnapshotFormat = TEXT_JSON):
+        self.shard_dir = Path(shard_dir)
+        self.fmt = fmt
+        self.migrate_from = Path(migrate_from) if migrate_from else None
+
+    def _shard_path(self, storage_id: str) -> Path:
+        return self.shard_dir / f"{quote(storage_id, safe='')}.json"
+
+    def open(self):
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        if self.migrate_from is not None:
+            self._migrate(self.migrate_from)
+
+    def _migrate(self, json_path: Path):
+        if not json_path.exists() or any(self.shard_dir.glob("*.json")):
+            return
+        data = read_snapshot(json_path)
+        if not json_path.exists():
+            # 已损坏的文件被 read_snapshot 改名保留
+            return
+        for storage_id, storage in data.items():
+            write_snapshot(self._shard_path(storage_id), storage, self.fmt)
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        logger.info(f"已从 {json_path} 拆分 {len(data)} 个存储空间到 {self.shard_dir}")
+
+    def load(self, storage_id: str) -> Dict[str, Any]:
+        return read_snapshot(self._shard_path(storage_id))
+
+    def write(self, changes: Changes):
+        for storage_id, storage_changes in changes.items():
+            data = {storage_id: self.load(storage_id)}
+            _apply_changes(data, {storage_id: storage_changes})
+            path = self._shard_path(storage_id)
+            if storage_id in data:
+                write_snapshot(path, data[storage_id], self.fmt)
+            elif path.exists():
+                path.unlink()
+
+
+class SqliteBackend(KVBackend):
+    """SQLite 后端（WAL 模式），每个键一行，主键 (storage_id, key)
+
+    首次打开且数据库为空时，从 migrate_from 指定的 kv.json 一次性导入。
+    """
+
+    def __init__(self, path: Path, migrate_from: Optional[Path] = None):
+        self.path = Path(path)
+        self.migrate_from = Path(migrate_from) if migrate_from else None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        self.path.parent.mkdir(exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " storage_id TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (storage_id, key)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+        if self.migrate_from is not None:
+            self._migrate(self.migrate_from)
+
+    def _migrate(self, json_path: Path):
+        """数据库为空且存在旧 kv.json 时一次性导入，导入后把旧文件改名保留"""
+        if not json_path.exists() or self._conn.execute("SELECT 1 FROM kv LIMIT 1").fetchone():
+            return
+        try:
+            data = decode(json_path.read_bytes())
+        except SnapshotError as e:
+            logger.error(f"迁移 KV 数据失败，{json_path} 解析错误: {e}")
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO kv (storage_id, key, value) VALUES (?, ?, ?)",
+                (
+                    (storage_id, key, json.dumps(value, ensure_ascii=False))
+                    for storage_id, storage in data.items()
+                    for key, value in storage.items()
+                ),
+            )
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        logger.info(f"已从 {json_path} 迁移 {len(data)} 个存储空间到 SQLite")
+
+    def load(self, storage_id: str) -> Dict[str, Any]:
+        rows = self._conn.execute("SELECT key, value FROM kv WHERE storage_id = ?", (storage_id,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, storage_id: str, key: str, default: Any = None) -> Any:
+        row = self._conn.execute(
+            "SELECT value FROM kv WHERE storage_id = ? AND key = ?", (storage_id, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def scan_prefix(self, storage_id: str, prefix: str) -> Dict[str, Any]:
+        if not prefix:
+            return self.load(storage_id)
+        # 主键上的范围查询: prefix <= key < prefix 的后继
+        rows = self._conn.execute(
+            "SELECT key, value FROM kv WHERE storage_id = ? AND key >= ? AND key < ?",
+            (storage_id, prefix, _prefix_upper(prefix)),
+        )
+        return {key: json.loads(value) for key, value in rows}
+
+    def write(self, changes: Changes):
+        upserts = []
+        deletes = []
+        for storage_id, storage_changes in changes.items():
+            for key, value in storage_changes.items():
+                if value is DELETED:
+                    deletes.append((storage_id, key))
+                else:
+                    upserts.append((storage_id, key, json.dumps(value, ensure_ascii=False)))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO kv (storage_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (storage_id, key) DO UPDATE SET value = excluded.value",
+                upserts,
+            )
+            self._conn.executemany("DELETE FROM kv WHERE storage_id = ? AND key = ?", deletes)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def _apply_changes(data: Dict[str, Dict[str, Any]], changes: Changes):
+    """把变更集应用到完整数据上，删除后变空的 storage_id 一并移除"""
+    for storage_id, storage_changes in changes.items():
+        storage = data.setdefault(storage_id, {})
+        for key, value in storage_changes.items():
+            if value is DELETED:
+                storage.pop(key, None)
+            else:
+                storage[key] = value
+        if not storage:
+            del data[storage_id]
+
+
+def iter_json_items(text: str) -> Iterator[Tuple[str, Any]]:
+    """逐个解析 JSON 对象中的键值对，依次产出 (键, 值)
+
+    text 可以是多个首尾相接的 JSON 对象（如分段导出的多条消息），对象之间允许空白。
+    每次只解码一个值，调用方可以在两次产出之间让出事件循环；格式错误时抛出 ValueError。
+    """
+    decoder = json.JSONDecoder()
+    end = len(text)
+
+    def skip(pos: int) -> int:
+        while pos < end and text[pos] in " \t\r\n":
+            pos += 1
+        return pos
+
+    pos = skip(0)
+    if pos == end:
+        raise ValueError("没有数据")
+    while pos < end:
+        if text[pos] != "{":
+            raise ValueError(f"第 {pos + 1} 个字符处应为 JSON 对象")
+        pos = skip(pos + 1)
+        if pos < end and text[pos] == "}":
+            pos = skip(pos + 1)
+            continue
+        while True:
+            if pos >= end or text[pos] != '"':
+                raise ValueError(f"第 {pos + 1} 个字符处应为键名")
+            key, pos = decoder.raw_decode(text, pos)
+            pos = skip(pos)
+            if pos >= end or text[pos] != ":":
+                raise ValueError(f"第 {pos + 1} 个字符处应为冒号")
+            value, pos = decoder.raw_decode(text, skip(pos + 1))
+            yield key, value
+            pos = skip(pos)
+            if pos < end and text[pos] == ",":
+                pos = skip(pos + 1)
+            elif pos < end and text[pos] == "}":
+                pos = skip(pos + 1)
+                break
+            else:
+                raise ValueError(f"第 {pos + 1} 个字符处应为逗号或右花括号")
+
+
+def _prefix_upper(prefix: str) -> str:
+    """以 prefix 开头的键都小于返回值（按码点比较），用于范围查询"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _as_number(value: Any) -> Optional[float]:
+    """把存储的值转为数字，数字字符串也接受，无法转换时返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value) if "." in value else int(value)
+        except ValueError:
+            return None
+    return None
+
+
+def snapshot_format(codec: str = "json", compression: str = "none") -> SnapshotFormat:
+    """按配置创建快照格式，不支持或缺少依赖时退回文本 JSON"""
+    try:
+        return SnapshotFormat(codec, compression)
+    except SnapshotError as e:
+        logger.warning(f"{e}，KV 快照使用文本 JSON")
+        return TEXT_JSON
+
+
+def create_backend(kind: str, data_dir: Path, journal_compact_bytes: int = 1 << 20,
+                   fmt: SnapshotFormat = TEXT_JSON) -> KVBackend:
+    """按配置创建后端，kind 为 "json"、"journal"、"sqlite" 或 "sharded"
+
+    fmt 为快照文件的写入格式，sqlite 后端不使用快照文件，忽略此参数。
+    """
+    data_dir = Path(data_dir)
+    if kind == "sharded":
+        return ShardedJsonBackend(data_dir / "kv_shards", migrate_from=data_dir / "kv.json", fmt=fmt)
+    if kind == "sqlite":
+        return SqliteBackend(data_dir / "kv.sqlite3", migrate_from=data_dir / "kv.json")
+    if kind == "journal":
+        return JournalBackend(data_dir / "kv.json", data_dir / "kv.journal", journal_compact_bytes, fmt)
+    if kind != "json":
+        logger.warning(f"未知的 KV 存储后端 {kind!r}，使用 json")
+    return JsonBackend(data_dir / "kv.json", fmt)
+
+
+class KVPage:
+    """一页前缀查询结果"""
+
+    __slots__ = ("items", "total", "next_cursor")
+
+    def __init__(self, items: Dict[str, Any], total: int, next_cursor: Optional[str]):
+        self.items = items
+        # 匹配前缀的键总数
+        self.total = total
+        # 下一页的游标（本页最后一个键），没有下一页时为 None
+        self.next_cursor = next_cursor
+
+
+class KVStore:
+    """常驻内存、延迟合并写入的 KV 存储，按 storage_id 划分命名空间
+
+    storage_id 首次访问时从后端读入并常驻内存；未常驻的 storage_id
+    的单键读取和前缀查询直接交给后端（SQLite 下为点查/范围查询）。
+
+    所有后端调用都在专用的单线程执行器中进行，不阻塞事件循环，
+    同时保证后端不会被并发访问。每个 storage_id 有独立的 asyncio.Lock，
+    载入和修改在锁内完成，不同用户/群之间互不等待。
+
+    max_resident > 0 时限制常驻的项数（每个 storage 计 1 项加上其中的键数），
+    超出时按最久未使用淘汰；有未落盘变更或正在修改的 storage 不会被淘汰，
+    而是先触发落盘，落盘完成后再淘汰。命中、未命中与淘汰次数记入运行指标。
+    """
+
+    def __init__(self, backend: KVBackend, flush_delay: float = 2.0, flush_threshold: int = 200,
+                 max_resident: int = 0):
+        self.backend = backend
+        self.flush_delay = flush_delay
+        self.flush_threshold = flush_threshold
+        self.max_resident = max_resident
+        # 常驻的 storage，按最近使用排序（最久未使用的在前）
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 常驻的项数
+        self._resident_entries = 0
+        # 常驻 storage 的有序键索引，首次前缀查询时建立，写入时增量维护
+        self._index: Dict[str, List[str]] = {}
+        # 常驻 storage 的版本号，载入与每次修改时取新值，全局递增、不会重复
+        self._versions: Dict[str, int] = {}
+        self._version_seq = itertools.count(1)
+        self._loaded = False
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kv-io")
+        # 每个 storage_id 一把锁，不再使用时自动回收
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._open_lock = asyncio.Lock()
+        # 尚未落盘的变更
+        self._dirty: Changes = {}
+        # 正在落盘的变更
+        self._in_flight: List[Changes] = []
+        # 同一时间只进行一次落盘，失败的批次合并回 _dirty 后才会取出下一批
+        self._flush_lock = asyncio.Lock()
+        # 自上次落盘以来的写入次数
+        self._pending = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _run_io(self, func, *args):
+        """在 I/O 线程中执行后端调用"""
+        return await asyncio.get_running_loop().run_in_executor(self._io, func, *args)
+
+    async def load(self):
+        """打开后端，只需调用一次"""
+        async with self._open_lock:
+            if self._loaded:
+                return
+            with METRICS.timer("kv_open"):
+                await self._run_io(self.backend.open)
+            self._data = OrderedDict()
+            self._resident_entries = 0
+            self._loaded = True
+
+    async def _ensure_loaded(self):
+        if not self._loaded:
+            await self.load()
+
+    def lock(self, storage_id: str) -> asyncio.Lock:
+        """返回 storage_id 对应的锁，用于需要原子执行的读-改-写操作"""
+        lock = self._locks.get(storage_id)
+        if lock is None:
+            lock = self._locks[storage_id] = asyncio.Lock()
+        return lock
+
+    def _touch(self, storage_id: str) -> Optional[Dict[str, Any]]:
+        """返回常驻的 storage 并标记为最近使用，未常驻时返回 None"""
+        storage = self._data.get(storage_id)
+        if storage is not None:
+            self._data.move_to_end(storage_id)
+            METRICS.incr("kv_cache.hit")
+        return storage
+
+    async def _resident(self, storage_id: str) -> Dict[str, Any]:
+        """返回常驻内存的 storage，未常驻时从后端载入（调用方需持有该 storage_id 的锁）"""
+        storage = self._touch(storage_id)
+        if storage is None:
+            METRICS.incr("kv_cache.miss")
+            with METRICS.timer("kv_load"):
+                storage = await self._run_io(self.backend.load, storage_id)
+            # 等待 I/O 期间不会有其他协程为同一 storage_id 载入（它们在等锁）
+            self._data[storage_id] = storage
+            self._versions[storage_id] = next(self._version_seq)
+            self._resident_entries += 1 + len(storage)
+            self._evict(keep=storage_id)
+        return storage
+
+    def _evict(self, keep: Optional[str] = None):
+        """超出常驻预算时按最久未使用淘汰 storage
+
+        有未落盘变更或正在落盘、正被锁定的 storage 跳过；因未落盘而无法
+        淘汰时触发一次落盘，落盘完成后会再次尝试。
+        """
+        if self.max_resident <= 0 or self._resident_entries <= self.max_resident:
+            return
+        need_flush = False
+        for storage_id in list(self._data):
+            if self._resident_entries <= self.max_resident:
+                break
+            if storage_id == keep:
+                continue
+            if storage_id in self._dirty or any(storage_id in changes for changes in self._in_flight):
+                need_flush = True
+                continue
+            lock = self._locks.get(storage_id)
+            if lock is not None and lock.locked():
+                continue
+            storage = self._data.pop(storage_id)
+            self._index.pop(storage_id, None)
+            self._versions.pop(storage_id, None)
+            self._resident_entries -= 1 + len(storage)
+            METRICS.incr("kv_cache.evict")
+        if need_flush and self._resident_entries > self.max_resident and not self._in_flight:
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    def cache_summary(self) -> str:
+        """常驻数据的规模、命中率与淘汰次数"""
+        hits = METRICS.counters.get("kv_cache.hit", 0)
+        misses = METRICS.counters.get("kv_cache.miss", 0)
+        budget = self.max_resident if self.max_resident > 0 else "不限"
+        rate = f"{hits / (hits + misses):.1%}" if hits + misses else "-"
+        return (
+            f"KV 常驻: {len(self._data)} 个存储空间 / {self._resident_entries} 项（上限 {budget}），"
+            f"命中率 {rate}，淘汰 {METRICS.counters.get('kv_cache.evict', 0)} 次"
+        )
+
+    async def get_storage(self, storage_id: str) -> Dict[str, Any]:
+        """返回 storage_id 下的全部键值（只读，不要直接修改）"""
+        await self._ensure_loaded()
+        storage = self._touch(storage_id)
+        if storage is not None:
+            return storage
+        async with self.lock(storage_id):
+            return await self._resident(storage_id)
+
+    def version(self, storage_id: str) -> Optional[int]:
+        """常驻 storage 的版本号，内容变化（或被淘汰后重新载入）时改变；未常驻时返回 None
+
+        可用于缓存由 storage 内容派生的数据。
+        """
+        return self._versions.get(storage_id)
+
+    async def get(self, storage_id: str, key: str, default: Any = None) -> Any:
+        await self._ensure_loaded()
+        storage = self._touch(storage_id)
+        if storage is None:
+            METRICS.incr("kv_cache.miss")
+            return await self._run_io(self.backend.get, storage_id, key, default)
+        return storage.get(key, default)
+
+    async def scan_prefix(self, storage_id: str, prefix: str) -> Dict[str, Any]:
+        """返回 storage_id 下以 prefix 开头的键值"""
+        await self._ensure_loaded()
+        storage = self._touch(storage_id)
+        if storage is None:
+            METRICS.incr("kv_cache.miss")
+            return await self._run_io(self.backend.scan_prefix, storage_id, prefix)
+        keys = self._sorted_keys(storage_id)
+        start, stop = self._prefix_range(keys, prefix)
+        return {k: storage[k] for k in keys[start:stop]}
+
+    async def list_page(
+        self,
+        storage_id: str,
+        prefix: str = "",
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        offset: int = 0,
+    ) -> KVPage:
+        """按键名顺序分页返回以 prefix 开头的键值
+
+        cursor 为上一页返回的 next_cursor，从其后一个键开始；offset 为跳过的条数。
+        查找为 O(log n + limit)，storage 会被载入常驻内存以便后续翻页。
+        """
+        await self._ensure_loaded()
+        storage = self._touch(storage_id)
+        if storage is None:
+            async with self.lock(storage_id):
+                storage = await self._resident(storage_id)
+        keys = self._sorted_keys(storage_id)
+        start, stop = self._prefix_range(keys, prefix)
+        first = start
+        if cursor is not None:
+            first = max(first, bisect_right(keys, cursor))
+        first = min(first + max(offset, 0), stop)
+        end = min(first + limit, stop)
+        return KVPage(
+            {k: storage[k] for k in keys[first:end]},
+            stop - start,
+            keys[end - 1] if end < stop and end > first else None,
+        )
+
+    def _sorted_keys(self, storage_id: str) -> List[str]:
+        """返回常驻 storage 的有序键列表，不存在时建立"""
+        keys = self._index.get(storage_id)
+        if keys is None:
+            keys = self._index[storage_id] = sorted(self._data[storage_id])
+        return keys
+
+    @staticmethod
+    def _prefix_range(keys: List[str], prefix: str) -> tuple:
+        if not prefix:
+            return 0, len(keys)
+        return bisect_left(keys, prefix), bisect_left(keys, _prefix_upper(prefix))
+
+    async def set(self, storage_id: str, key: str, value: Any):
+        await self.update(storage_id, {key: value})
+
+    async def update(self, storage_id: str, updates: Dict[str, Any]):
+        """批量写入多个键，只计一次脏写入"""
+        await self._ensure_loaded()
+        async with self.lock(storage_id):
+            await self._resident(storage_id)
+            self._apply_locked(storage_id, updates)
+
+    async def delete(self, storage_id: str, key: str) -> bool:
+        """删除键，键不存在时返回 False"""
+        await self._ensure_loaded()
+        async with self.lock(storage_id):
+            storage = await self._resident(storage_id)
+            if key not in storage:
+                return False
+            self._apply_locked(storage_id, {key: DELETED})
+            return True
+
+    async def update_numeric(
+        self,
+        storage_id: str,
+        deltas: Dict[str, float],
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+    ) -> Dict[str, tuple]:
+        """原子地对一个或多个数值键加减，可选限制在 [min_value, max_value] 内
+
+        不存在的键视为 0。下限大于上限或任一键的当前值不是数字时抛出 ValueError，
+        且不做任何修改。返回 {键: (旧值, 新值)}。
+        """
+        if min_value is not None and max_value is not None and min_value > max_value:
+            raise ValueError(f"下限 {min_value} 大于上限 {max_value}")
+        await self._ensure_loaded()
+        async with self.lock(storage_id):
+            storage = await self._resident(storage_id)
+            results = {}
+            for key, delta in deltas.items():
+                current = _as_number(storage.get(key, 0))
+                if current is None:
+                    raise ValueError(f"键 '{key}' 的值不是数字: {storage[key]}")
+                new = current + delta
+                if min_value is not None and new < min_value:
+                    new = min_value
+                if max_value is not None and new > max_value:
+                    new = max_value
+                results[key] = (current, new)
+            self._apply_locked(storage_id, {key: new for key, (_, new) in results.items()})
+            return results
+
+    async def transaction(self, changes: Changes, replace: Iterable[str] = (), durable: bool = True):
+        """原子地应用多个 storage_id 的变更（值为 DELETED 表示删除）
+
+        replace 中的 storage_id 先清空：不在 changes 中的现有键一并删除。
+        按 storage_id 排序依次加锁，全部载入后再在事件循环中一次性修改，
+        其他协程不会看到只应用了一部分的状态。durable 为 True 时随后立即落盘，
+        整批变更在同一次后端写入中持久化（sharded 后端会重写多个分片文件）。
+        """
+        await self._ensure_loaded()
+        replace = set(replace)
+        storage_ids = sorted(set(changes) | replace)
+        async with AsyncExitStack() as stack:
+            for storage_id in storage_ids:
+                await stack.enter_async_context(self.lock(storage_id))
+            # 载入期间持有全部锁，已载入的 storage 不会被淘汰
+            for storage_id in storage_ids:
+                await self._resident(storage_id)
+            for storage_id in storage_ids:
+                storage_changes = dict(changes.get(storage_id, {}))
+                if storage_id in replace:
+                    for key in self._data[storage_id]:
+                        storage_changes.setdefault(key, DELETED)
+                if storage_changes:
+                    self._apply_locked(storage_id, storage_changes)
+        if durable:
+            await self.flush()
+
+    def _apply_locked(self, storage_id: str, changes: Dict[str, Any]):
+        """把变更应用到常驻数据并记为脏，调用方需持有锁且 storage 已常驻"""
+        storage = self._data[storage_id]
+        size = len(storage)
+        keys = self._index.get(storage_id)
+        for key, value in changes.items():
+            if value is DELETED:
+                if key in storage:
+                    del storage[key]
+                    if keys is not None:
+                        del keys[bisect_left(keys, key)]
+            else:
+                if keys is not None and key not in storage:
+                    insort(keys, key)
+                storage[key] = value
+        self._resident_entries += len(storage) - size
+        self._versions[storage_id] = next(self._version_seq)
+        self._dirty.setdefault(storage_id, {}).update(changes)
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._pending += 1
+        if self._pending >= self.flush_threshold:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        """在后台任务中落盘，不阻塞当前写入"""
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """把未落盘的变更交给后端（在 I/O 线程中执行）
+
+        写入失败时整批变更合并回未落盘的变更（较新的写入优先）后再抛出或安排重试，
+        不会丢失；落盘依次进行，合并回来的旧批次不会覆盖之后落盘的值。
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            changes, self._dirty = self._dirty, {}
+            pending, self._pending = self._pending, 0
+            self._in_flight.append(changes)
+            try:
+                with METRICS.timer("kv_save"):
+                    await self._run_io(self.backend.write, changes)
+            except (OSError, sqlite3.Error) as e:
+                METRICS.incr("kv_save.errors")
+                logger.error(f"KV 数据写入失败，稍后重试: {e}")
+                self._restore(changes, pending)
+                return
+            except BaseException as e:
+                # 序列化错误、缺少快照依赖、任务被取消等：保留变更后继续抛出
+                if isinstance(e, Exception):
+                    METRICS.incr("kv_save.errors")
+                    logger.error(f"KV 数据写入失败，变更已保留: {e!r}")
+                self._restore(changes, pending)
+                raise
+            finally:
+                self._in_flight = [c for c in self._in_flight if c is not changes]
+        # 之前因未落盘而跳过的 storage 现在可以淘汰
+        self._evict()
+
+    def _restore(self, changes: Changes, pending: int):
+        """把写入失败的变更合并回未落盘的变更（较新的写入优先），并安排重试"""
+        for storage_id, storage_changes in changes.items():
+            merged = dict(storage_changes)
+            merged.update(self._dirty.get(storage_id, {}))
+            self._dirty[storage_id] = merged
+        self._pending += pending
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._start_flush)
+
+    async def close(self):
+        """落盘并关闭后端，插件卸载时调用"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        try:
+            await self.flush()
+        finally:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            await self._run_io(self.backend.close)
+            self._io.shutdown(wait=True)
@@ -1,85 +1,142 @@
 import re
 import json
-import random
-import os
+import math
+import asyncio
+import time
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import quote
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 import astrbot.api.message_components as Comp
 
+from .character import ABILITIES, Character, DiceRoll, GameSession, RecordCache
+from .dice_engine import (
+    SHOW_ROLLS_LIMIT,
+    CostBudget,
+    Dice,
+    DiceSyntaxError,
+    REF_VALUE_BITS,
+    ExpressionCostError,
+    check_cost,
+    compile_expression,
+    format_ref,
+    split_batch,
+    split_label,
+    substitute_refs,
+)
+from .dice_rng import DiceRng, RngStreams
+from .dice_stats import StatsError, describe_expression
+from .dice_sim import create_pool, simulate
+from .kv_store import DELETED, KVStore, create_backend, iter_json_items, snapshot_format, write_snapshot
+from .metrics import METRICS, format_seconds
+from .rate_limit import RateLimiter
+from .roll_history import HistoryStore
+
 # KV 存储文件路径
 _KV_FILE = Path(__file__).parent / "data" / "kv.json"
-
-
-def parse_dice_expression(expr: str) -> tuple[int, list[tuple[int, int]], int]:
-    """解析骰子表达式，返回 (加成值, [(个数, 面数)...], 原始表达式)
-
-    例如: "3d10+5" -> (5, [(3, 10)], "3d10+5")
-    例如: "2d6-1d4+3" -> (3, [(2, 6), (1, 4)], "2d6-1d4+3")
-    """
-    expr = expr.strip().lower().replace(" ", "")
-
-    # 处理括号
-    if "(" in expr or ")" in expr:
-        return (0, [], expr)
-
-    # 匹配 NdM 格式 (例如: 3d10, d6, 2D20)
-    dice_pattern = r'(\d*)d(\d+)'
-
-    # 先找出所有骰子部分
-    dice_parts = []
-    last_end = 0
-    base_value = 0
-
-    # 临时存储表达式用于替换
-    temp_expr = expr
-
-    def replace_dice(match):
-        nonlocal last_end, base_value
-        count = int(match.group(1)) if match.group(1) else 1
-        faces = int(match.group(2))
-        dice_parts.append((count, faces))
-        placeholder = f"__DICE_{len(dice_parts)-1}__"
-        return placeholder
-
-    temp_expr = re.sub(dice_pattern, replace_dice, temp_expr)
-
-    # 计算基础值（把所有骰子替换为0后的表达式结果）
-    for i in range(len(dice_parts)):
-        temp_expr = temp_expr.replace(f"__DICE_{i}__", "0")
-
-    try:
-        base_value = eval(temp_expr, {"__builtins__": {}})
-    except:
-        base_value = 0
-
-    return (base_value, dice_parts, expr)
-
-
-def roll_dice(count: int, faces: int) -> list[int]:
-    """投掷指定数量和面数的骰子"""
-    return [random.randint(1, faces) for _ in range(count)]
-
-
-def evaluate_expression(expr: str) -> int:
-    """计算表达式（支持括号和基本运算）"""
-    try:
-        return eval(expr, {"__builtins__": {}})
-    except:
-        return None
+# 投掷历史文件路径
+_HISTORY_FILE = Path(__file__).parent / "data" / "history.jsonl"
+# 旧版本读取不存在的 event.user_id/event.group_id 时使用的 storage_id，所有用户/群共用
+_LEGACY_STORAGE_IDS = ("user_unknown", "group_unknown")
+
+# 区分"键不存在"与值为 None
+_MISSING = object()
+# 私聊中使用群作用域时的提示
+_NO_GROUP_MESSAGE = "错误: 私聊中没有群数据"
+
+# "/r stats" 末尾的目标值，如 "3d6+2 14" 或 "3d6+2>=14"（紧跟骰子的 ">=" 属于成功计数骰池，见 _split_stats_target）
+_STATS_TARGET_RE = re.compile(
+    r"^(?P<expr>.*?[^-+*/%(\s])\s*(?:(?P<sep>>=|≥)\s*|\s+)(?P<target>-?\d+(?:\.\d+)?)$"
+)
+
+# 带符号的属性增量，如 "生命-5经验+20"、"hp-5"
+_DELTA_RE = re.compile(r"([\u4e00-\u9fff]+|[A-Za-z_]\w*)\s*([+-]\d+(?:\.\d+)?)")
+# 单个数值（可带符号）
+_NUMBER_RE = re.compile(r"[+-]?\d+(?:\.\d+)?")
+# /kv list 每页条数
+_KV_PAGE_SIZE = 20
+# kv_list 工具默认与最大的单次返回条数
+_KV_LIST_LIMIT = 50
+_KV_LIST_MAX_LIMIT = 200
+
+# /kv export 每条消息的最大字符数
+_KV_EXPORT_CHUNK = 1500
+# /kv import 单次最多导入的键数
+_KV_IMPORT_MAX_KEYS = 10_000
+# /kv export 以消息形式最多导出的键数，与单次导入上限相同，超出时需导出到文件
+_KV_EXPORT_MAX_KEYS = _KV_IMPORT_MAX_KEYS
+# /kv import 每解析这么多个键让出一次事件循环
+_KV_IMPORT_YIELD_EVERY = 200
+
+# /kv add 的上下限参数，如 "min=0 max=30"
+_BOUND_RE = re.compile(r"\b(min|max)=(-?\d+(?:\.\d+)?)")
+
+# /r history 与 roll_history 工具默认显示的条数
+_HISTORY_SHOW = 10
 
 
 @register("simple_dice", "evpeople", "一个简单的骰子", "1.0.0")
 class MyPlugin(Star):
-    def __init__(self, context: Context):
+    def __init__(self, context: Context, config: Optional[Dict] = None):
         super().__init__(context)
+        self.config = config or {}
+        self._kv = KVStore(
+            create_backend(
+                self.config.get("kv_backend", "json"),
+                _KV_FILE.parent,
+                journal_compact_bytes=int(self.config.get("kv_journal_compact_bytes", 1 << 20)),
+                fmt=snapshot_format(
+                    self.config.get("kv_snapshot_format", "json"),
+                    self.config.get("kv_snapshot_compression", "none"),
+                ),
+            ),
+            flush_delay=float(self.config.get("kv_flush_delay", 2.0)),
+            flush_threshold=int(self.config.get("kv_flush_threshold", 200)),
+            max_resident=int(self.config.get("kv_max_resident", 0)),
+        )
+        # 表达式开销预算，超出时在求值前拒绝
+        self._budget = CostBudget(
+            max_dice=int(self.config.get("expr_max_dice", 10_000_000)),
+            max_ops=int(self.config.get("expr_max_ops", 100)),
+            max_exponent=float(self.config.get("expr_max_exponent", 1024)),
+            max_bits=float(self.config.get("expr_max_bits", 4096)),
+        )
+        # 投骰类指令与工具的限流，分别按用户和群计数
+        self._user_limiter = RateLimiter(
+            float(self.config.get("rate_limit_per_minute", 30)) / 60,
+            float(self.config.get("rate_limit_burst", 10)),
+        )
+        self._group_limiter = RateLimiter(
+            float(self.config.get("rate_limit_group_per_minute", 120)) / 60,
+            float(self.config.get("rate_limit_group_burst", 30)),
+        )
+        # 每个用户和群最近的投掷记录
+        self._history = HistoryStore(_HISTORY_FILE, int(self.config.get("history_size", 50)))
+        # 由 KV 数据解析出的角色卡（用户）与游戏会话（群），数据变化后重新解析
+        self._characters = RecordCache(Character.from_storage, "character_cache")
+        self._sessions = RecordCache(GameSession.from_storage, "session_cache")
+        # 每个用户独立的随机数流；审计模式下记录每次投掷的种子与流位置
+        self._rng = RngStreams(str(self.config.get("rng_seed", "")).strip() or None)
+        self._rng_audit = bool(self.config.get("rng_audit", False))
+        # 模拟用进程池，首次使用时创建
+        self._sim_pool = None
+        # 正在进行模拟的会话，同一会话同时只允许一个模拟
+        self._sim_running: set[str] = set()
+        # 定期写入 Prometheus 文本文件的后台任务
+        self._metrics_task: Optional[asyncio.Task] = None
 
     async def initialize(self):
         """可选择实现异步的插件初始化方法"""
+        await self._kv.load()
+        await self._warn_legacy_storage()
+        await self._history.load()
+        if self._metrics_file() is not None:
+            self._metrics_task = asyncio.ensure_future(self._export_metrics_loop())
 
     @filter.command("r")
+    @METRICS.timed("cmd.r")
     async def roll_dice(self, event: AstrMessageEvent):
         """投掷骰子
         支持格式:
@@ -88,6 +145,14 @@ class MyPlugin(Star):
         - /r d100 → 投掷百分骰 (0-100)
         - /r 3d10+5 → 3d10 + 5
         - /r 2d6-1d4+3 → 支持混合运算
+        - /r 4d6kh3、/r 2d20kl1、/r 10d10>=8、/r d6! → 保留最高/最低、成功计数、爆炸骰
+        - /r stats 3d6+2 14 → 计算概率分布及 P(≥14)
+        - /r sim 100000 (2d6+1d8)*2 → 蒙特卡洛模拟
+        - /r 6#4d6 → 重复投掷 6 次
+        - /r 1d20+str+prof-2、/r 1d20+@group.ac → 引用用户/群 KV 数据中的数值
+        - /r 1d20+str; 2d6; d100 → 一次投掷多个表达式
+        - /r 1d20 攻击 → 表达式后的说明文字不参与计算
+        - /r history [条数] → 最近的投掷记录（群聊中为全群的记录）
         """
         message_str = event.message_str.strip()
 
@@ -97,83 +162,96 @@ class MyPlugin(Star):
             if message_str.startswith(prefix):
                 args = message_str[len(prefix):].strip()
                 break
+        sub_cmd = args.split(maxsplit=1)[0].lower() if args else ""
 
-        # 默认 1d20
-        if not args:
-            dice_expr = "1d20"
-        else:
-            dice_expr = args
+        # 投掷历史（不计入限流）
+        if sub_cmd == "history":
+            count = args[len(sub_cmd):].strip()
+            if count and not count.isdigit():
+                yield event.plain_result("用法: /r history [条数]")
+                return
+            yield event.plain_result(self._history_message(event, int(count) if count else _HISTORY_SHOW))
+            return
+
+        limited = self._throttle(event)
+        if limited:
+            yield event.plain_result(limited)
+            return
+
+        # 概率分布统计
+        if sub_cmd == "stats":
+            stats_args = args[len(sub_cmd):].strip()
+            if not stats_args:
+                yield event.plain_result("用法: /r stats <表达式> [目标值]，如: /r stats 3d6+2 14")
+                return
+            stats_args, target = self._split_stats_target(stats_args)
+            yield event.plain_result(await self._stats_message(stats_args, target))
+            return
+
+        # 蒙特卡洛模拟
+        if sub_cmd == "sim":
+            yield event.plain_result(await self._sim_message(event, args[len(sub_cmd):].strip()))
+            return
+
+        # 批量投掷
+        if any(sep in args for sep in ("#", ";", "；")):
+            try:
+                specs = split_batch(args)
+            except DiceSyntaxError as e:
+                yield event.plain_result(f"表达式解析失败: {e}")
+                return
+            yield event.plain_result(self._format_batch(await self._roll_batch(event, specs)))
+            return
+
+        # 默认 1d20；表达式后的说明文字（如 /r 1d20 攻击）不参与计算
+        dice_expr = split_label(args)[0] or "1d20"
+
+        try:
+            compiled = self._compile(dice_expr)
+        except ExpressionCostError as e:
+            yield event.plain_result(f"表达式开销过大: {e}")
+            return
+        except DiceSyntaxError:
+            compiled = None
+
+        # 解析 KV 引用（如 1d20+str+prof-2、1d20+@group.ac）
+        refs = await self._resolve_refs(event, compiled.refs) if compiled is not None else {}
+        ref_desc, ref_note = self._describe_refs(compiled, refs) if compiled is not None else ("", None)
+        ref_note = f"\n({ref_note})" if ref_note else ""
 
         # 检查是否有括号表达式
         if "(" in dice_expr or ")" in dice_expr:
             # 直接计算整个表达式（支持复杂表达式）
+            if compiled is None:
+                yield event.plain_result("表达式解析失败，请检查格式")
+                return
             try:
-                # 先替换所有 NdM 为随机结果
-                def dice_replacer(match):
-                    count = int(match.group(1)) if match.group(1) else 1
-                    faces = int(match.group(2))
-                    rolls = roll_dice(count, faces)
-                    return str(sum(rolls))
-
-                pattern = r'(\d*)d(\d+)'
-                result_expr = re.sub(pattern, dice_replacer, dice_expr, flags=re.IGNORECASE)
-                final_result = evaluate_expression(result_expr)
-
-                if final_result is not None:
-                    yield event.plain_result(f"掷骰结果: {final_result}")
-                else:
-                    yield event.plain_result(f"表达式解析失败，请检查格式")
-            except Exception as e:
+                final_result, _ = self._evaluate(event, compiled, refs)
+                self._record_roll(event, dice_expr, final_result)
+                yield event.plain_result(f"掷骰结果: {final_result}{ref_desc}{ref_note}")
+            except ArithmeticError as e:
                 logger.error(f"骰子表达式解析错误: {e}")
                 yield event.plain_result(f"表达式解析失败: {str(e)}")
             return
 
         # 解析简单骰子表达式
-        base_value, dice_parts, original_expr = parse_dice_expression(dice_expr)
-
-        if not dice_parts:
+        if compiled is None or not compiled.dice_parts:
             yield event.plain_result(f"无效的骰子格式: {dice_expr}\n请使用如: 2d6, 3d10+5, d20 等格式")
             return
 
-        # 执行投骰
-        all_rolls = []
-        total = base_value
-
-        for count, faces in dice_parts:
-            rolls = roll_dice(count, faces)
-            all_rolls.extend(rolls)
-            roll_sum = sum(rolls)
-            total += roll_sum
-
-        # 构建结果消息
-        if base_value != 0:
-            dice_desc = " + ".join([f"{count}d{faces}" for count, faces in dice_parts])
-            if len(all_rolls) <= 5:
-                rolls_str = ", ".join(map(str, all_rolls))
-                result_msg = f"掷骰 ({dice_desc}) + {base_value}: [{rolls_str}] + {base_value} = {total}"
-            else:
-                result_msg = f"掷骰 ({dice_desc}) + {base_value}: [{len(all_rolls)}个骰子] = {total}"
-        else:
-            if len(dice_parts) == 1:
-                count, faces = dice_parts[0]
-                if count == 1:
-                    if len(all_rolls) == 1:
-                        result_msg = f"掷骰 d{faces}: {all_rolls[0]}"
-                    else:
-                        result_msg = f"掷骰 {count}d{faces}: [{', '.join(map(str, all_rolls))}] = {total}"
-                else:
-                    result_msg = f"掷骰 {count}d{faces}: [{', '.join(map(str, all_rolls))}] = {total}"
-            else:
-                dice_desc = " + ".join([f"{count}d{faces}" for count, faces in dice_parts])
-                if len(all_rolls) <= 5:
-                    rolls_str = ", ".join(map(str, all_rolls))
-                    result_msg = f"掷骰 {dice_desc}: [{rolls_str}] = {total}"
-                else:
-                    result_msg = f"掷骰 {dice_desc}: [{len(all_rolls)}个骰子] = {total}"
+        # 执行投骰（只在结果会显示每个骰子时保留点数）
+        try:
+            total, ctx = self._evaluate(event, compiled, refs)
+        except ArithmeticError as e:
+            logger.error(f"骰子表达式计算错误: {e}")
+            yield event.plain_result(f"表达式解析失败: {str(e)}")
+            return
+        self._record_roll(event, dice_expr, total)
 
-        yield event.plain_result(result_msg)
+        yield event.plain_result(self._roll_message(dice_expr, compiled, ctx, total, ref_desc) + ref_note)
 
     @filter.command("kv")
+    @METRICS.timed("cmd.kv")
     async def kv_command(self, event: AstrMessageEvent):
         """KV 存储命令，支持读取、写入、列出"""
         message_str = event.message_str.strip()
@@ -186,8 +264,12 @@ class MyPlugin(Star):
                 "/kv get <键名> - 读取值\n"
                 "/kv set <键名> <值> - 设置单个值\n"
                 "/kv set <属性值对> - 批量设置，如: 生命30 经验20\n"
-                "/kv list [前缀] - 列出所有数据，可选按前缀过滤\n"
-                "/kv del <键名> - 删除键"
+                "/kv add <键名> <变化量> - 数值增减，如: 生命 -5\n"
+                "/kv add <属性增量> [min=下限] [max=上限] - 批量增减，如: 生命-5 经验+20 min=0\n"
+                "/kv list [前缀] [页码] - 分页列出数据，可选按前缀过滤\n"
+                "/kv del <键名> - 删除键\n"
+                "/kv export [group] [file] - 导出全部数据（分段消息或文件）\n"
+                "/kv import [group] [replace] <JSON | file> - 导入数据，replace 先清空原有数据"
             )
             return
 
@@ -199,34 +281,30 @@ class MyPlugin(Star):
                 return
             key = parts[2].strip()
             storage_id = self._get_storage_id("user", event)
-            data = self._load_kv()
-            storage = data.get(storage_id, {})
-            if key not in storage:
+            value = await self._kv.get(storage_id, key, _MISSING)
+            if value is _MISSING:
                 yield event.plain_result(f"键 '{key}' 不存在")
             else:
-                yield event.plain_result(f"{key} = {storage[key]}")
+                yield event.plain_result(f"{key} = {value}")
 
         elif sub_cmd == "set":
             if len(parts) < 3:
                 yield event.plain_result("用法: /kv set <键名> <值> 或 /kv set <属性值对>")
                 return
             storage_id = self._get_storage_id("user", event)
-            data = self._load_kv()
-            if storage_id not in data:
-                data[storage_id] = {}
 
             # 解析输入
-            rest = parts[2] if len(parts) == 3 else " ".join(parts[2:])
+            rest = parts[2]
             updates = self._parse_upsert_value(rest)
 
             # 如果解析结果是单个 "value" 键，说明是纯字符串或数字
             if updates == {"value": rest}:
                 # 格式: /kv set key value
-                if len(parts) < 4:
+                key, _, value = rest.partition(" ")
+                value = value.strip()
+                if not value:
                     yield event.plain_result("用法: /kv set <键名> <值>")
                     return
-                key = parts[2].strip()
-                value = parts[3].strip()
                 try:
                     if '.' in value:
                         parsed = float(value)
@@ -234,37 +312,43 @@ class MyPlugin(Star):
                         parsed = int(value)
                 except ValueError:
                     parsed = value
-                data[storage_id][key] = parsed
-                self._save_kv(data)
+                await self._kv.set(storage_id, key, parsed)
                 yield event.plain_result(f"已保存: {key} = {parsed}")
             else:
                 # 格式: /kv set 生命30经验20
-                results = []
-                for k, v in updates.items():
-                    data[storage_id][k] = v
-                    results.append(f"{k}={v}")
-                self._save_kv(data)
+                await self._kv.update(storage_id, updates)
+                results = [f"{k}={v}" for k, v in updates.items()]
                 yield event.plain_result(f"已更新: {', '.join(results)}")
 
-        if sub_cmd == "list":
+        elif sub_cmd == "list":
             storage_id = self._get_storage_id("user", event)
-            data = self._load_kv()
-            storage = data.get(storage_id, {})
 
-            # 支持前缀搜索
-            prefix = None
-            if len(parts) >= 3:
-                prefix = parts[2].strip()
-                storage = {k: v for k, v in storage.items() if k.startswith(prefix)}
+            # 支持前缀搜索与分页: /kv list [前缀] [页码]
+            args = parts[2].split() if len(parts) >= 3 else []
+            page_no = 1
+            if args and args[-1].isdecimal():
+                page_no = max(1, int(args.pop()))
+            prefix = args[0] if args else ""
+            page = await self._kv.list_page(
+                storage_id, prefix, _KV_PAGE_SIZE, offset=(page_no - 1) * _KV_PAGE_SIZE
+            )
 
-            if not storage:
+            if not page.total:
                 if prefix:
                     yield event.plain_result(f"未找到前缀为 '{prefix}' 的键值对")
                 else:
                     yield event.plain_result("当前无存储的数据")
-            else:
-                lines = [f"{k} = {v}" for k, v in storage.items()]
-                yield event.plain_result("\n".join(lines))
+                return
+            pages = -(-page.total // _KV_PAGE_SIZE)
+            if not page.items:
+                yield event.plain_result(f"第 {page_no} 页没有数据，共 {pages} 页")
+                return
+            lines = [f"{k} = {v}" for k, v in page.items.items()]
+            if pages > 1:
+                lines.insert(0, f"第 {page_no}/{pages} 页，共 {page.total} 项")
+                if page.next_cursor is not None:
+                    lines.append(f"下一页: /kv list {prefix + ' ' if prefix else ''}{page_no + 1}")
+            yield event.plain_result("\n".join(lines))
 
         elif sub_cmd == "del":
             if len(parts) < 3:
@@ -272,45 +356,617 @@ class MyPlugin(Star):
                 return
             key = parts[2].strip()
             storage_id = self._get_storage_id("user", event)
-            data = self._load_kv()
-            storage = data.get(storage_id, {})
-            if key in storage:
-                del storage[key]
-                self._save_kv(data)
+            if await self._kv.delete(storage_id, key):
                 yield event.plain_result(f"已删除: {key}")
             else:
                 yield event.plain_result(f"键 '{key}' 不存在")
 
+        elif sub_cmd == "add":
+            usage = "用法: /kv add <键名> <变化量> 或 /kv add <属性增量>，如: 生命-5 经验+20 [min=0] [max=30]"
+            if len(parts) < 3:
+                yield event.plain_result(usage)
+                return
+            rest = parts[2]
+            bounds = {
+                name: float(num) if '.' in num else int(num)
+                for name, num in _BOUND_RE.findall(rest)
+            }
+            deltas = self._parse_deltas(_BOUND_RE.sub("", rest))
+            if not deltas:
+                yield event.plain_result(usage)
+                return
+            storage_id = self._get_storage_id("user", event)
+            try:
+                changes = await self._kv.update_numeric(
+                    storage_id, deltas, bounds.get("min"), bounds.get("max")
+                )
+            except ValueError as e:
+                yield event.plain_result(f"错误: {e}")
+                return
+            yield event.plain_result(self._format_numeric_changes(changes))
+
+        elif sub_cmd == "export":
+            options, _ = self._split_options(parts[2] if len(parts) >= 3 else "", ("group", "file"))
+            storage_id = self._kv_scope_id(event, options)
+            if storage_id is None:
+                yield event.plain_result("私聊中没有群数据")
+                return
+            storage = await self._kv.get_storage(storage_id)
+            items = sorted(storage.items(), key=lambda item: item[0])
+            if not items:
+                yield event.plain_result("当前无存储的数据")
+                return
+            scope = "group " if "group" in options else ""
+            if "file" in options:
+                path = self._kv_export_path(storage_id)
+                try:
+                    await asyncio.to_thread(write_snapshot, path, dict(items))
+                except OSError as e:
+                    logger.error(f"导出 KV 数据到 {path} 失败: {e}")
+                    yield event.plain_result(f"导出失败: {e}")
+                    return
+                yield event.plain_result(f"已导出 {len(items)} 项到 {path.name}，可用 /kv import {scope}file 导入")
+                return
+            if len(items) > _KV_EXPORT_MAX_KEYS:
+                yield event.plain_result(
+                    f"共 {len(items)} 项，超过消息导出上限 {_KV_EXPORT_MAX_KEYS} 项，"
+                    f"请使用 /kv export {scope}file 导出到文件（可用 scripts/convert_snapshot.py 查看或转换）"
+                )
+                return
+            yield event.plain_result(f"共 {len(items)} 项，以下每条消息都是一个 JSON 对象，可原样用 /kv import 导入")
+            for chunk in self._export_chunks(items):
+                yield event.plain_result(chunk)
+
+        elif sub_cmd == "import":
+            usage = "用法: /kv import [group] [replace] <JSON 对象> 或 /kv import [group] [replace] file"
+            options, payload = self._split_options(parts[2] if len(parts) >= 3 else "", ("group", "replace", "file"))
+            storage_id = self._kv_scope_id(event, options)
+            if storage_id is None:
+                yield event.plain_result("私聊中没有群数据")
+                return
+            if "group" in options and not self._is_admin(event):
+                yield event.plain_result("只有管理员可以导入群数据")
+                return
+            if "file" in options:
+                path = self._kv_export_path(storage_id)
+                try:
+                    payload = await asyncio.to_thread(path.read_text, encoding="utf-8")
+                except FileNotFoundError:
+                    yield event.plain_result(f"导出文件 {path.name} 不存在，请先使用 /kv export file")
+                    return
+                except (OSError, UnicodeDecodeError) as e:
+                    yield event.plain_result(f"读取导出文件失败: {e}")
+                    return
+            if not payload.strip():
+                yield event.plain_result(usage)
+                return
+            yield event.plain_result(await self._import_kv(storage_id, payload, "replace" in options))
+
         else:
-            yield event.plain_result(f"未知子命令: {sub_cmd}\n可用: get, set, setmulti, list, del")
+            yield event.plain_result(f"未知子命令: {sub_cmd}\n可用: get, set, add, list, del, export, import")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("dice")
+    async def dice_admin(self, event: AstrMessageEvent):
+        """骰子插件运行指标（仅管理员）
+        - /dice metrics → 查看解析、投骰、KV 读写及各指令/工具的耗时分布，以及 KV 常驻命中率
+        - /dice metrics reset → 清空指标
+        - /dice profile on [采样率] [条数] → 开启慢表达式采样，如 /dice profile on 0.1 20
+        - /dice profile off → 关闭采样
+        - /dice profile → 查看最慢的表达式
+        - /dice audit on|off → 开关投骰审计日志（记录每次投掷的种子与流位置）
+        - /dice replay <种子> <位置> <表达式> → 按审计日志离线重放一次投掷
+        """
+        args = event.message_str.split()[1:]
+        sub_cmd = args[0].lower() if args else ""
+        action = args[1].lower() if len(args) > 1 else ""
+
+        if sub_cmd == "metrics":
+            if action == "reset":
+                METRICS.reset()
+                yield event.plain_result("指标已清空")
+            else:
+                yield event.plain_result(f"{METRICS.summary()}\n{self._kv.cache_summary()}")
 
-    def _get_storage_id(self, scope: str, event: AstrMessageEvent) -> str:
-        """生成存储 ID"""
-        if scope == "group":
+        elif sub_cmd == "profile":
+            profiler = METRICS.profiler
+            if action == "on":
+                try:
+                    rate = float(args[2]) if len(args) > 2 else 1.0
+                    top_n = int(args[3]) if len(args) > 3 else 10
+                except ValueError:
+                    yield event.plain_result("用法: /dice profile on [采样率] [条数]")
+                    return
+                profiler.start(rate, top_n)
+                yield event.plain_result(
+                    f"慢表达式采样已开启，采样率 {profiler.sample_rate:g}，保留 {profiler.top_n} 条"
+                )
+            elif action == "off":
+                profiler.stop()
+                yield event.plain_result("慢表达式采样已关闭")
+            else:
+                slowest = profiler.slowest()
+                state = "开启" if profiler.enabled else "关闭"
+                if not slowest:
+                    yield event.plain_result(f"慢表达式采样{state}，暂无数据")
+                    return
+                lines = [f"慢表达式采样{state}，已采样 {profiler.sampled} 次，最慢的表达式:"]
+                lines += [f"{format_seconds(t)}  {expr}" for expr, t in slowest]
+                yield event.plain_result("\n".join(lines))
+
+        elif sub_cmd == "audit":
+            if action in ("on", "off"):
+                self._rng_audit = action == "on"
+            state = "开启" if self._rng_audit else "关闭"
+            yield event.plain_result(f"投骰审计已{state}")
+
+        elif sub_cmd == "replay":
+            usage = "用法: /dice replay <种子> <位置> <表达式>"
+            if len(args) < 4:
+                yield event.plain_result(usage)
+                return
             try:
-                return f"group_{event.group_id}"
-            except Exception:
-                return f"group_unknown"
-        else:
+                seed, counter = int(args[1]), int(args[2])
+            except ValueError:
+                yield event.plain_result(usage)
+                return
+            if seed < 0 or counter < 0:
+                yield event.plain_result(usage)
+                return
             try:
-                return f"user_{event.user_id}"
-            except Exception:
-                return f"user_unknown"
+                compiled = self._compile(" ".join(args[3:]))
+            except DiceSyntaxError as e:
+                yield event.plain_result(f"表达式解析失败: {e}")
+                return
+            rng = DiceRng(seed, counter)
+            ctx = compiled.new_context(rng)
+            try:
+                result = compiled.evaluate(ctx)
+            except ArithmeticError as e:
+                yield event.plain_result(f"计算失败: {e}")
+                return
+            rolls = f" 点数{ctx.rolls}" if ctx.keep_values and ctx.dice_count else ""
+            yield event.plain_result(
+                f"重放 {compiled.text} (engine={rng.engine} seed={seed} counter={counter}): "
+                f"{result}{rolls}，消耗 {rng.counter - counter} 个随机字"
+            )
 
-    def _load_kv(self) -> Dict:
-        """加载 KV 数据"""
-        Path(_KV_FILE).parent.mkdir(exist_ok=True)
-        if not Path(_KV_FILE).exists():
-            return {}
+        else:
+            yield event.plain_result(
+                "用法:\n"
+                "/dice metrics [reset] - 查看或清空运行指标\n"
+                "/dice profile [on [采样率] [条数] | off] - 慢表达式采样\n"
+                "/dice audit [on | off] - 投骰审计日志\n"
+                "/dice replay <种子> <位置> <表达式> - 重放一次投掷"
+            )
+
+    def _compile(self, expression: str, repeat: int = 1):
+        """解析表达式并记录耗时，超出开销预算时抛出 ExpressionCostError"""
+        with METRICS.timer("parse"):
+            compiled = compile_expression(expression)
         try:
-            return json.loads(Path(_KV_FILE).read_text(encoding="utf-8"))
-        except json.JSONDecodeError:
-            return {}
+            check_cost(compiled, self._budget, repeat)
+        except ExpressionCostError:
+            METRICS.incr("expr_rejected")
+            raise
+        return compiled
+
+    def _session_keys(self, event: AstrMessageEvent) -> tuple[str, Optional[str]]:
+        """返回 (用户 storage_id, 群 storage_id)，私聊时群为 None"""
+        return self._get_storage_id("user", event), self._get_storage_id("group", event)
+
+    def _throttle(self, event: AstrMessageEvent) -> Optional[str]:
+        """按用户和群限流，超出时返回提示消息，否则扣除令牌并返回 None"""
+        user_key, group_key = self._session_keys(event)
+
+        wait = self._user_limiter.wait_time(user_key)
+        if group_key is not None:
+            wait = max(wait, self._group_limiter.wait_time(group_key))
+        if wait > 0:
+            METRICS.incr("rate_limited")
+            return f"操作过于频繁，请 {math.ceil(wait)} 秒后再试"
+        self._user_limiter.consume(user_key)
+        if group_key is not None:
+            self._group_limiter.consume(group_key)
+        return None
+
+    def _evaluate(self, event: AstrMessageEvent, compiled, refs: Optional[dict] = None):
+        """使用该用户的随机数流投掷一次，返回 (结果, 投掷上下文)
+
+        refs 为 _resolve_refs 解析出的 KV 引用取值。记录耗时，开启采样时同时记录
+        慢表达式；开启审计时记录种子与流位置，可用 /dice replay 重放。
+        """
+        storage_id = self._get_storage_id("user", event)
+        rng = self._rng.get(storage_id)
+        ctx = compiled.new_context(rng, refs)
+        start = rng.counter
+        with METRICS.timer("roll") as timer:
+            result = compiled.evaluate(ctx)
+        METRICS.profiler.record(compiled.text, timer.elapsed)
+        if self._rng_audit:
+            nonce = f" nonce={rng.nonce}" if rng.nonce else ""
+            logger.info(
+                f"骰子审计: {storage_id} engine={rng.engine} seed={rng.seed}{nonce} counter={start} "
+                f"used={rng.counter - start} expr={compiled.text} result={result}"
+                + (f" refs={self._describe_refs(compiled, refs)[0].strip()}" if compiled.refs else "")
+            )
+        return result, ctx
+
+    def _record_roll(self, event: AstrMessageEvent, expression: str, total, hidden: bool = False):
+        """把一次投掷的最终结果记入用户和群的投掷历史"""
+        user_key, group_key = self._session_keys(event)
+        self._history.record(user_key, group_key, expression, total, hidden)
+
+    def _history_message(self, event: AstrMessageEvent, count: int) -> str:
+        """格式化最近的投掷记录；暗投只对管理员显示结果，统计不含暗投"""
+        if not self._history.enabled:
+            return "投掷历史未开启"
+        user_key, group_key = self._session_keys(event)
+        history = self._history.get(group_key or user_key)
+        records = history.recent(min(count, self._history.capacity)) if history else []
+        if not records:
+            return "暂无投掷记录"
+        reveal = self._is_admin(event)
+        lines = [f"最近 {len(records)} 次投掷:"]
+        for record in records:
+            who = f"{record.user.removeprefix('user_')} " if group_key else ""
+            total = record.total if reveal or not record.hidden else "暗投"
+            mark = "(暗投) " if record.hidden and reveal else ""
+            lines.append(
+                f"{time.strftime('%m-%d %H:%M:%S', time.localtime(record.time))} {who}{mark}{record.expression} = {total}"
+            )
+        if history.stats:
+            lines.append("统计（最近记录，不含暗投）:")
+            for expression, stats in sorted(history.stats.items(), key=lambda item: -item[1].count):
+                lines.append(f"{expression}: {stats.count}次 平均 {stats.average:.2f}")
+        return "\n".join(lines)
 
-    def _save_kv(self, data: Dict):
-        """保存 KV 数据"""
-        Path(_KV_FILE).parent.mkdir(exist_ok=True)
-        Path(_KV_FILE).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    async def _resolve_refs(self, event: AstrMessageEvent, refs) -> Dict[tuple, Any]:
+        """解析表达式引用的 KV 键，返回 {(作用域, 键名): 数值}，无法解析的引用不包含在内
+
+        每个作用域只取一次常驻数据（未常驻时读入一次），所有引用都从这份数据中读取。
+        私聊中的群引用视为不存在。
+        """
+        if not refs:
+            return {}
+        storages = {}
+        for scope, _ in refs:
+            if scope not in storages:
+                storage_id = self._get_storage_id(scope, event)
+                storages[scope] = await self._kv.get_storage(storage_id) if storage_id is not None else {}
+        values = {}
+        for scope, key in refs:
+            value = self._ref_value(storages[scope].get(key))
+            if value is not None:
+                values[(scope, key)] = value
+        return values
+
+    @staticmethod
+    def _ref_value(value) -> Optional[float]:
+        """把 KV 中的值转为可参与计算的数字，不是数字或过大时返回 None"""
+        if isinstance(value, str) and _NUMBER_RE.fullmatch(value.strip()):
+            value = float(value) if "." in value else int(value)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if not math.isfinite(value) or abs(value) >= 2 ** REF_VALUE_BITS:
+            return None
+        return value
+
+    @staticmethod
+    def _roll_message(dice_expr: str, compiled, ctx, total, ref_desc: str = "") -> str:
+        """格式化一次投掷：原样显示表达式，骰子不超过 SHOW_ROLLS_LIMIT 个时列出每个骰子的点数
+
+        只有单个骰子（如 d20）时直接显示点数。
+        """
+        if isinstance(compiled.root, Dice) and compiled.root.count == 1:
+            return f"掷骰 d{compiled.root.faces}: {total}"
+        if ctx.dice_count <= SHOW_ROLLS_LIMIT:
+            rolls_str = f"[{', '.join(map(str, ctx.rolls))}]"
+        else:
+            rolls_str = f"[{ctx.dice_count}个骰子]"
+        return f"掷骰 {dice_expr}: {rolls_str}{ref_desc} = {total}"
+
+    @staticmethod
+    def _describe_refs(compiled, values: Dict[tuple, Any]) -> tuple[str, Optional[str]]:
+        """返回 (" (str=3, prof=2)" 形式的引用取值, 无法解析的引用说明或 None)"""
+        if not compiled.refs:
+            return "", None
+        found = [f"{format_ref(*ref)}={values[ref]}" for ref in compiled.refs if ref in values]
+        missing = [format_ref(*ref) for ref in compiled.refs if ref not in values]
+        desc = f" ({', '.join(found)})" if found else ""
+        note = f"{', '.join(missing)} 不存在或不是数字，按 0 计算" if missing else None
+        return desc, note
+
+    async def _character(self, event: AstrMessageEvent) -> Character:
+        """当前用户的角色卡，KV 数据未变化时直接返回缓存"""
+        storage_id = self._get_storage_id("user", event)
+        storage = await self._kv.get_storage(storage_id)
+        return self._characters.get(storage_id, self._kv.version(storage_id), storage)
+
+    async def _game_session(self, event: AstrMessageEvent) -> Optional[GameSession]:
+        """当前群的游戏会话，私聊时返回 None"""
+        group_key = self._get_storage_id("group", event)
+        if group_key is None:
+            return None
+        storage = await self._kv.get_storage(group_key)
+        return self._sessions.get(group_key, self._kv.version(group_key), storage)
+
+    @staticmethod
+    def _display_name(char: Character, event: AstrMessageEvent) -> str:
+        if char.name:
+            return char.name
+        try:
+            return event.get_sender_name() or char.storage_id.removeprefix("user_")
+        except Exception:
+            return char.storage_id.removeprefix("user_")
+
+    def _roll_d20(self, event: AstrMessageEvent, label: str, modifier: int, advantage: bool, disadvantage: bool,
+                  reason: str = "", hidden: bool = False) -> DiceRoll:
+        """投掷 1d20（优势/劣势时为 2d20 取高/取低）并加上修正值，记入投掷历史"""
+        if advantage and not disadvantage:
+            dice = "2d20kh1"
+        elif disadvantage and not advantage:
+            dice = "2d20kl1"
+        else:
+            dice = "1d20"
+        natural, ctx = self._evaluate(event, self._compile(dice))
+        roll = DiceRoll(label, dice, ctx.rolls, natural, modifier, reason, hidden)
+        self._record_roll(event, roll.expression, roll.total, hidden)
+        return roll
+
+    async def _roll_batch(
+        self, event: AstrMessageEvent, specs: list[tuple[int, str]], hidden: bool = False
+    ) -> list[Dict[str, Any]]:
+        """执行批量投掷，返回每个表达式的结构化结果
+
+        每个表达式只解析一次，所有表达式引用的 KV 键一起解析、只读取一次 KV 数据。
+        每次投掷都记入投掷历史。
+        """
+        results = []
+        compiled_specs = []
+        batch_dice = 0
+        for repeat, text in specs:
+            entry: Dict[str, Any] = {"expression": text, "repeat": repeat}
+            results.append(entry)
+            try:
+                compiled = self._compile(text, repeat)
+            except ExpressionCostError as e:
+                entry["error"] = f"表达式开销过大: {e}"
+                continue
+            except DiceSyntaxError as e:
+                entry["error"] = f"表达式解析失败: {e}"
+                continue
+            batch_dice += compiled.cost.dice * repeat
+            if batch_dice > self._budget.max_dice:
+                entry["error"] = f"表达式开销过大: 本次骰子总数超过上限 {self._budget.max_dice}"
+                continue
+            compiled_specs.append((entry, compiled))
+
+        refs = await self._resolve_refs(
+            event, list(dict.fromkeys(ref for _, compiled in compiled_specs for ref in compiled.refs))
+        )
+        for entry, compiled in compiled_specs:
+            text, repeat = entry["expression"], entry["repeat"]
+            if compiled.refs:
+                found = {format_ref(*ref): refs[ref] for ref in compiled.refs if ref in refs}
+                if found:
+                    entry["refs"] = found
+                note = self._describe_refs(compiled, refs)[1]
+                if note:
+                    entry["note"] = note
+
+            totals = []
+            rolls = []
+            try:
+                for _ in range(repeat):
+                    total, ctx = self._evaluate(event, compiled, refs)
+                    totals.append(total)
+                    if ctx.keep_values and ctx.dice_count:
+                        rolls.append(ctx.rolls)
+            except ArithmeticError as e:
+                entry["error"] = f"计算失败: {e}"
+                continue
+            entry["totals"] = totals
+            for total in totals:
+                self._record_roll(event, text, total, hidden)
+            if rolls:
+                entry["rolls"] = rolls
+        return results
+
+    def _format_batch(self, results: list[Dict[str, Any]]) -> str:
+        lines = []
+        for entry in results:
+            text = entry["expression"]
+            if "error" in entry:
+                lines.append(f"{text}: {entry['error']}")
+                continue
+            refs = entry.get("refs")
+            suffix = f" ({', '.join(f'{k}={v}' for k, v in refs.items())})" if refs else ""
+            rolls = entry.get("rolls")
+            parts = [
+                f"[{', '.join(map(str, rolls[i]))}]{suffix} = {total}" if rolls else str(total)
+                for i, total in enumerate(entry["totals"])
+            ]
+            if entry["repeat"] == 1:
+                lines.append(f"{text}: {parts[0]}")
+            else:
+                lines.append(f"{entry['repeat']}#{text}:")
+                lines += [f"  #{i} {part}" for i, part in enumerate(parts, 1)]
+            if "note" in entry:
+                lines.append(f"  ({entry['note']})")
+        return "\n".join(lines)
+
+    def _metrics_file(self) -> Optional[Path]:
+        """Prometheus 文本文件路径，未配置时返回 None；相对路径相对于插件数据目录"""
+        path = str(self.config.get("metrics_prometheus_file", "") or "").strip()
+        if not path:
+            return None
+        path = Path(path)
+        return path if path.is_absolute() else _KV_FILE.parent / path
+
+    async def _export_metrics_loop(self):
+        path = self._metrics_file()
+        interval = max(1.0, float(self.config.get("metrics_export_interval", 60.0)))
+        while True:
+            await asyncio.sleep(interval)
+            await self._export_metrics(path)
+
+    async def _export_metrics(self, path: Path):
+        try:
+            await asyncio.to_thread(METRICS.write_prometheus, path)
+        except OSError as e:
+            logger.error(f"写入指标文件 {path} 失败: {e}")
+
+    async def _warn_legacy_storage(self):
+        """旧版本的数据保存在所有用户/群共用的 storage_id 下，无法自动归属，启动时提示管理员"""
+        for storage_id in _LEGACY_STORAGE_IDS:
+            storage = await self._kv.get_storage(storage_id)
+            if storage:
+                logger.warning(
+                    f"KV 数据中存在旧版本共用的 {storage_id}（{len(storage)} 项），新版本按发送者与群号分别存储，"
+                    f"这些数据不会再被读取；如需保留，请用 scripts/convert_snapshot.py 查看后通过 /kv import 导入到对应用户或群"
+                )
+
+    def _get_storage_id(self, scope: str, event: AstrMessageEvent) -> Optional[str]:
+        """生成存储 ID：用户为 user_<发送者 ID>，群为 group_<群号>，私聊中的群作用域为 None
+
+        KV 读写、键名引用、角色卡、限流与投掷历史都经由这里取 storage_id，
+        保证同一个群、同一个用户在所有入口下对应同一份数据。
+        """
+        if scope == "group":
+            try:
+                group_id = event.get_group_id()
+            except Exception:
+                group_id = None
+            return f"group_{group_id}" if group_id else None
+        try:
+            sender_id = event.get_sender_id()
+        except Exception:
+            sender_id = None
+        return f"user_{sender_id}" if sender_id else "user_unknown"
+
+    @staticmethod
+    def _split_stats_target(text: str) -> tuple[str, Optional[float]]:
+        """拆出 /r stats 末尾的目标值，返回 (表达式, 目标值或 None)
+
+        ">=" 前是骰子时整体是成功计数骰池（如 10d10>=8），不拆分；这时可写成
+        "10d10 8"、"(10d10)>=8" 或 "10d10≥8" 表示目标值。成功计数没有意义的
+        单个骰子（1d20>=15，与总和相同）和目标值超过面数的（3d6>=14，总不成功）
+        按总和的目标值处理。
+        """
+        match = _STATS_TARGET_RE.match(text)
+        if match is None:
+            return text, None
+        expr, target = match.group("expr"), float(match.group("target"))
+        if match.group("sep") == ">=":
+            try:
+                compile_expression(text)
+            except DiceSyntaxError:
+                return expr, target
+            try:
+                root = compile_expression(expr).root
+            except DiceSyntaxError:
+                return text, None
+            if not isinstance(root, Dice) or (root.count > 1 and target <= root.faces):
+                return text, None
+        return expr, target
+
+    async def _stats_message(self, expression: str, target: Optional[float]) -> str:
+        """计算表达式的精确分布并格式化为消息"""
+        try:
+            compiled = self._compile(expression)
+            # 大分布的卷积放到线程中，避免阻塞事件循环
+            stats = await asyncio.to_thread(describe_expression, compiled, target)
+        except (DiceSyntaxError, StatsError) as e:
+            message = f"无法计算 {expression} 的分布: {e}"
+            match = _STATS_TARGET_RE.match(expression)
+            if match is not None and match.group("sep") == ">=":
+                # 成功计数骰池，提示计算总和目标值的写法
+                expr, target = match.group("expr"), match.group("target")
+                message += f"\n若要计算 {expr} 之和 ≥ {target} 的概率，请写作 /r stats {expr} {target}"
+            return message
+
+        def fmt(x) -> str:
+            return f"{x:.2f}".rstrip("0").rstrip(".")
+
+        lines = [
+            f"{stats.expression} 的概率分布:",
+            f"均值 {fmt(stats.mean)}，方差 {fmt(stats.variance)}，标准差 {fmt(stats.variance ** 0.5)}",
+            f"范围 {fmt(stats.min)} ~ {fmt(stats.max)}",
+            "分位数: " + ", ".join(f"{p}%={fmt(v)}" for p, v in stats.percentiles.items()),
+        ]
+        if stats.prob_at_least is not None:
+            lines.append(f"P(≥{fmt(stats.target)}) = {stats.prob_at_least * 100:.2f}%")
+        return "\n".join(lines)
+
+    async def _sim_message(self, event: AstrMessageEvent, args: str) -> str:
+        """执行 /r sim <次数> <表达式> 并格式化结果"""
+        parts = args.split(maxsplit=1)
+        if len(parts) < 2 or not parts[0].isdigit():
+            return "用法: /r sim <次数> <表达式>，如: /r sim 100000 (2d6+1d8)*2"
+        trials = int(parts[0])
+        expression = parts[1]
+        if trials <= 0:
+            return "模拟次数必须大于 0"
+        try:
+            compiled = self._compile(expression)
+        except ExpressionCostError as e:
+            return f"表达式开销过大: {e}"
+        except DiceSyntaxError as e:
+            return f"表达式解析失败: {e}"
+        if compiled.refs:
+            return "模拟不支持 KV 引用，请代入具体数值"
+
+        notes = []
+        max_trials = int(self.config.get("sim_max_trials", 1_000_000))
+        if trials > max_trials:
+            trials = max_trials
+            notes.append(f"试验次数已限制为 {max_trials}")
+
+        # 同一会话同时只允许一个模拟，避免单个用户/群占满进程池
+        session = self._get_storage_id("group", event) or self._get_storage_id("user", event)
+        if session in self._sim_running:
+            return "当前会话已有模拟正在进行，请稍后再试"
+        self._sim_running.add(session)
+        try:
+            workers = int(self.config.get("sim_workers", 2))
+            if workers > 0 and self._sim_pool is None:
+                self._sim_pool = create_pool(workers)
+            result = await simulate(
+                expression, trials, self._sim_pool, max(workers, 1),
+                float(self.config.get("sim_time_budget", 5.0)),
+            )
+        except Exception as e:
+            logger.error(f"骰子模拟失败: {e}")
+            return f"模拟失败: {e}"
+        finally:
+            self._sim_running.discard(session)
+
+        if result.errors:
+            logger.warning(f"骰子模拟 {expression} 有 {len(result.errors)} 个分片失败: {'; '.join(result.errors)}")
+            notes.append(f"{len(result.errors)} 个分片失败，结果只包含其余分片的试验")
+        if not result.valid:
+            return f"模拟 {expression} 未得到有效结果（超时或表达式无效）" + "".join(f"\n{note}" for note in notes)
+        if result.invalid:
+            notes.append(f"另有 {result.invalid} 次结果无效（如除零、整数溢出），未计入统计")
+        if result.truncated:
+            notes.append(f"超出时间预算，仅完成 {result.trials + result.invalid}/{result.requested} 次")
+
+        def fmt(x) -> str:
+            return f"{x:.2f}".rstrip("0").rstrip(".")
+
+        lines = [
+            f"模拟 {expression} 共 {result.trials} 次（耗时 {result.elapsed:.2f}s）:",
+            f"均值 {fmt(result.mean)}，标准差 {fmt(result.stdev)}",
+            "分位数: " + ", ".join(f"{p}%={fmt(result.percentile(p))}" for p in (5, 25, 50, 75, 95)),
+        ]
+        peak = max(n for _, _, n in result.histogram())
+        for low, high, n in result.histogram():
+            label = fmt(low) if low == high else f"{fmt(low)}~{fmt(high)}"
+            bar = "█" * round(20 * n / peak)
+            lines.append(f"{label}: {bar} {n / result.valid * 100:.2f}%")
+        lines.extend(notes)
+        return "\n".join(lines)
 
     def _parse_upsert_value(self, value: Any) -> Dict[str, Any]:
         """解析一行字符串形式的多个属性，如 "生命30经验20" """
@@ -339,7 +995,86 @@ class MyPlugin(Star):
             return {"value": value}
         return value if isinstance(value, dict) else {"value": value}
 
+    def _parse_deltas(self, text: str) -> Dict[str, Any]:
+        """解析数值增量，支持 "键名 变化量" 或 "生命-5经验+20" 形式"""
+        key, _, delta = text.strip().partition(" ")
+        delta = delta.strip()
+        if key and _NUMBER_RE.fullmatch(delta):
+            return {key: float(delta) if '.' in delta else int(delta)}
+        return {
+            name: float(num) if '.' in num else int(num)
+            for name, num in _DELTA_RE.findall(text)
+        }
+
+    @staticmethod
+    def _split_options(text: str, options: tuple) -> tuple[set, str]:
+        """从 text 开头取出 options 中的选项词，返回 (选项集合, 剩余文本)"""
+        found = set()
+        rest = text.strip()
+        while rest:
+            word, *remaining = rest.split(maxsplit=1)
+            if word.lower() not in options:
+                break
+            found.add(word.lower())
+            rest = remaining[0] if remaining else ""
+        return found, rest
+
+    @staticmethod
+    def _is_admin(event: AstrMessageEvent) -> bool:
+        try:
+            return bool(event.is_admin())
+        except Exception:
+            return False
+
+    def _kv_scope_id(self, event: AstrMessageEvent, options: set) -> Optional[str]:
+        """选项中有 group 时为群的 storage_id（私聊时为 None），否则为用户的"""
+        return self._get_storage_id("group" if "group" in options else "user", event)
+
+    @staticmethod
+    def _kv_export_path(storage_id: str) -> Path:
+        return _KV_FILE.parent / "kv_exports" / f"{quote(storage_id, safe='')}.json"
+
+    @staticmethod
+    def _export_chunks(items: list) -> Iterator[str]:
+        """把键值对分段编码为 JSON 对象，每段不超过 _KV_EXPORT_CHUNK 个字符（单个键值过长时独占一段）"""
+        chunk = []
+        size = 2
+        for key, value in items:
+            part = f"{json.dumps(key, ensure_ascii=False)}:{json.dumps(value, ensure_ascii=False, separators=(',', ':'))}"
+            if chunk and size + len(part) + 1 > _KV_EXPORT_CHUNK:
+                yield "{" + ",".join(chunk) + "}"
+                chunk, size = [], 2
+            chunk.append(part)
+            size += len(part) + 1
+        if chunk:
+            yield "{" + ",".join(chunk) + "}"
+
+    async def _import_kv(self, storage_id: str, text: str, replace: bool) -> str:
+        """逐个解析 JSON 键值并在一次事务中导入，值为 null 表示删除该键；解析失败时不做任何修改"""
+        changes = {}
+        try:
+            for i, (key, value) in enumerate(iter_json_items(text), 1):
+                if i > _KV_IMPORT_MAX_KEYS:
+                    return f"导入失败: 超过单次导入上限 {_KV_IMPORT_MAX_KEYS} 项，未做任何修改"
+                if not key:
+                    raise ValueError("键名不能为空")
+                changes[key] = DELETED if value is None else value
+                if i % _KV_IMPORT_YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+        except ValueError as e:
+            return f"导入失败，未做任何修改: {e}"
+        await self._kv.transaction({storage_id: changes}, replace=(storage_id,) if replace else ())
+        deleted = sum(value is DELETED for value in changes.values())
+        if replace:
+            return f"已清空原有数据并导入 {len(changes) - deleted} 项"
+        return f"已导入 {len(changes) - deleted} 项" + (f"，删除 {deleted} 项" if deleted else "")
+
+    def _format_numeric_changes(self, changes: Dict[str, tuple]) -> str:
+        results = [f"{k} {old} → {new}" for k, (old, new) in changes.items()]
+        return f"已更新: {', '.join(results)}"
+
     @filter.llm_tool(name="kv_read")
+    @METRICS.timed("tool.kv_read")
     async def kv_read(
         self,
         event: AstrMessageEvent,
@@ -353,13 +1088,15 @@ class MyPlugin(Star):
             scope(string): 作用域，"user" 或 "group"
         '''
         storage_id = self._get_storage_id(scope, event)
-        data = self._load_kv()
-        storage = data.get(storage_id, {})
-        if key not in storage:
+        if storage_id is None:
+            return _NO_GROUP_MESSAGE
+        value = await self._kv.get(storage_id, key, _MISSING)
+        if value is _MISSING:
             return f"键 '{key}' 不存在"
-        return str(storage[key])
+        return str(value)
 
     @filter.llm_tool(name="kv_upsert")
+    @METRICS.timed("tool.kv_upsert")
     async def kv_upsert(
         self,
         event: AstrMessageEvent,
@@ -377,19 +1114,16 @@ class MyPlugin(Star):
             scope(string): 作用域，"user" 或 "group"
         '''
         storage_id = self._get_storage_id(scope, event)
-        data = self._load_kv()
-        if storage_id not in data:
-            data[storage_id] = {}
+        if storage_id is None:
+            return _NO_GROUP_MESSAGE
 
         results = []
 
         # 多属性模式
         if multi:
             updates = self._parse_upsert_value(multi)
-            for k, v in updates.items():
-                data[storage_id][k] = v
-                results.append(f"{k}={v}")
-            self._save_kv(data)
+            await self._kv.update(storage_id, updates)
+            results = [f"{k}={v}" for k, v in updates.items()]
             return f"已更新: {', '.join(results)}"
 
         # 单键值模式
@@ -397,101 +1131,182 @@ class MyPlugin(Star):
             parsed_value = self._parse_upsert_value(value)
             if isinstance(parsed_value, dict) and "value" in parsed_value and key == "value":
                 # 说明是普通字符串值
-                data[storage_id]["value"] = parsed_value["value"]
+                await self._kv.set(storage_id, "value", parsed_value["value"])
             elif isinstance(parsed_value, dict) and key not in parsed_value:
                 # value 是 dict，但 key 不是，存储整个 dict 到 key
-                data[storage_id][key] = parsed_value
+                await self._kv.set(storage_id, key, parsed_value)
                 results.append(f"{key}={parsed_value}")
             else:
-                data[storage_id][key] = parsed_value
+                await self._kv.set(storage_id, key, parsed_value)
                 results.append(f"{key}={parsed_value}")
-            self._save_kv(data)
             return f"已保存: {', '.join(results)}"
 
         return "错误: 请提供 key 和 value，或使用 multi 参数"
 
+    @filter.llm_tool(name="kv_upsert_batch")
+    @METRICS.timed("tool.kv_upsert_batch")
+    async def kv_upsert_batch(self, event: AstrMessageEvent, changes: Any) -> str:
+        '''在一次事务中写入或删除多个键，可同时修改当前用户和当前群的数据。所有修改一起生效并只落盘一次；任一项无效时不做任何修改。适合战斗结算、场景切换等需要同时修改多个属性的场合。
+
+        Args:
+            changes(object): 按作用域分组的修改，如 {"user": {"生命": 25, "经验": 120}, "group": {"场景": "酒馆", "先攻顺序": null}}；值为 null 表示删除该键
+        '''
+        if isinstance(changes, str):
+            try:
+                changes = json.loads(changes)
+            except json.JSONDecodeError as e:
+                return f"错误: changes 不是有效的 JSON: {e}"
+        if not isinstance(changes, dict) or not changes:
+            return '错误: changes 应为 {"user": {...}, "group": {...}} 形式的对象'
+        user_key, group_key = self._session_keys(event)
+        batch = {}
+        for scope, updates in changes.items():
+            if scope not in ("user", "group"):
+                return f"错误: 未知的作用域 '{scope}'，应为 user 或 group，未做任何修改"
+            if scope == "group" and group_key is None:
+                return f"{_NO_GROUP_MESSAGE}，未做任何修改"
+            if not isinstance(updates, dict) or any(not isinstance(k, str) or not k for k in updates):
+                return f"错误: {scope} 的修改应为以键名为键的对象，未做任何修改"
+            batch[user_key if scope == "user" else group_key] = {
+                key: DELETED if value is None else value for key, value in updates.items()
+            }
+        await self._kv.transaction(batch)
+        summary = []
+        for scope, storage_id in (("用户", user_key), ("群", group_key)):
+            storage_changes = batch.get(storage_id)
+            if storage_changes is None:
+                continue
+            deleted = sum(value is DELETED for value in storage_changes.values())
+            part = f"{scope} {len(storage_changes) - deleted} 项"
+            if deleted:
+                part += f"（删除 {deleted} 项）"
+            summary.append(part)
+        return f"已提交: {'，'.join(summary)}"
+
+    @filter.llm_tool(name="kv_update")
+    @METRICS.timed("tool.kv_update")
+    async def kv_update(
+        self,
+        event: AstrMessageEvent,
+        key: Optional[str] = None,
+        delta: Optional[float] = None,
+        multi: Optional[str] = None,
+        scope: str = "user",
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None
+    ) -> str:
+        '''原子地增减数值，如扣除生命、增加经验。不存在的键视为 0。
+
+        Args:
+            key(string): 键名（单个键模式）
+            delta(number): 变化量，负数表示减少
+            multi(string): 一行字符串增减多个属性，如 "生命-5经验+20"
+            scope(string): 作用域，"user" 或 "group"
+            min_value(number, optional): 下限，结果低于下限时取下限
+            max_value(number, optional): 上限，结果高于上限时取上限
+        '''
+        storage_id = self._get_storage_id(scope, event)
+        if storage_id is None:
+            return _NO_GROUP_MESSAGE
+
+        if multi:
+            deltas = self._parse_deltas(multi)
+        elif key is not None and delta is not None:
+            if isinstance(delta, str):
+                if not _NUMBER_RE.fullmatch(delta.strip()):
+                    return f"错误: 变化量不是数字: {delta}"
+                delta = float(delta) if '.' in delta else int(delta)
+            deltas = {key: delta}
+        else:
+            return "错误: 请提供 key 和 delta，或使用 multi 参数"
+        if not deltas:
+            return f"错误: 无法解析增量: {multi}"
+
+        try:
+            changes = await self._kv.update_numeric(storage_id, deltas, min_value, max_value)
+        except ValueError as e:
+            return f"错误: {e}"
+        return self._format_numeric_changes(changes)
+
     @filter.llm_tool(name="kv_list")
+    @METRICS.timed("tool.kv_list")
     async def kv_list(
         self,
         event: AstrMessageEvent,
         scope: str = "user",
-        prefix: Optional[str] = None
+        prefix: Optional[str] = None,
+        limit: int = _KV_LIST_LIMIT,
+        cursor: Optional[str] = None
     ) -> str:
-        '''列出指定作用域下的所有键值对，可选按前缀过滤。
+        '''按键名顺序分页列出指定作用域下的键值对，可选按前缀过滤。
+
+        返回 JSON: {"items": {键: 值}, "total": 匹配总数, "next_cursor": 下一页游标或 null}。
 
         Args:
             scope(string): 作用域，"user" 或 "group"
             prefix(string, optional): 键名前缀，仅返回以此前缀开头的键值对
+            limit(number, optional): 单次返回的最大条数，默认 50，最多 200
+            cursor(string, optional): 上一次返回的 next_cursor，用于获取下一页
         '''
         storage_id = self._get_storage_id(scope, event)
-        data = self._load_kv()
-        storage = data.get(storage_id, {})
+        if storage_id is None:
+            return _NO_GROUP_MESSAGE
+        try:
+            limit = max(1, min(int(limit), _KV_LIST_MAX_LIMIT))
+        except (TypeError, ValueError):
+            limit = _KV_LIST_LIMIT
 
-        if prefix:
-            filtered = {k: v for k, v in storage.items() if k.startswith(prefix)}
-            if not filtered:
+        page = await self._kv.list_page(storage_id, prefix or "", limit, cursor or None)
+        if not page.total:
+            if prefix:
                 return f"未找到前缀为 '{prefix}' 的键值对"
-            return json.dumps(filtered, ensure_ascii=False, indent=2)
-
-        if not storage:
-            return f"当前无存储的数据"
-        return json.dumps(storage, ensure_ascii=False, indent=2)
+            return "当前无存储的数据"
+        return json.dumps(
+            {"items": page.items, "total": page.total, "next_cursor": page.next_cursor},
+            ensure_ascii=False, separators=(",", ":"),
+        )
 
     @filter.llm_tool(name="roll_dice")
+    @METRICS.timed("tool.roll_dice")
     async def llm_roll_dice(self, event: AstrMessageEvent, expression: str = "1d20", hidden: bool = False) -> str:
         '''投掷骰子，支持各种骰子表达式。LLM 在需要随机数或进行 RPG 掷骰时可以调用此工具。
 
         Args:
-            expression(string): 骰子表达式，如 "1d20"、"2d6"、"3d10+5"、"d100" 等。默认为 "1d20"。支持在末尾添加 "+key" 格式来加上 KV 存储的值作为修正值，如 "1d20+str"。
+            expression(string): 骰子表达式，如 "1d20"、"2d6"、"3d10+5"、"d100" 等。默认为 "1d20"。可以直接使用 KV 存储中的键名作为数值，如 "1d20+str+prof-2"；"@group.键名" 读取群数据，如 "1d20+@group.ac"。
             hidden(boolean): 是否暗投。True 表示暗投，只显示"进行了一次暗投"；False 表示明投，显示具体结果。默认为 False。
         '''
-        dice_expr = expression.strip() if expression else "1d20"
-
-        # 检测是否有 +key 后缀
-        modifier_key = None
-        if "+" in dice_expr:
-            parts = dice_expr.rsplit("+", 1)
-            if len(parts) == 2 and parts[1].isalpha():
-                potential_key = parts[1]
-                # 检查这个后缀是否是有效的字母（不是纯数字）
-                if not potential_key.isdigit():
-                    dice_expr = parts[0]
-                    modifier_key = potential_key
-
-        # 获取 KV 修正值
-        modifier_value = 0
-        modifier_source = ""
-        if modifier_key:
-            storage_id = self._get_storage_id("user", event)
-            data = self._load_kv()
-            storage = data.get(storage_id, {})
-            if modifier_key in storage:
-                try:
-                    modifier_value = float(storage[modifier_key])
-                    modifier_source = f"+{modifier_key}({modifier_value})"
-                except (ValueError, TypeError):
-                    modifier_source = ""
-                    modifier_key = None
+        limited = self._throttle(event)
+        if limited:
+            return limited
+
+        dice_expr = split_label(expression or "")[0] or "1d20"
+
+        try:
+            compiled = self._compile(dice_expr)
+        except ExpressionCostError as e:
+            error_msg = f"表达式开销过大: {e}"
+            event.set_result(MessageEventResult(chain=[Comp.Plain(error_msg)]))
+            return error_msg
+        except DiceSyntaxError:
+            compiled = None
+
+        # 解析 KV 引用（如 1d20+str+prof-2、1d20+@group.ac）
+        refs = await self._resolve_refs(event, compiled.refs) if compiled is not None else {}
+        ref_desc, ref_note = self._describe_refs(compiled, refs) if compiled is not None else ("", None)
 
         # 检查是否有括号表达式
         if "(" in dice_expr or ")" in dice_expr:
             try:
-                def dice_replacer(match):
-                    count = int(match.group(1)) if match.group(1) else 1
-                    faces = int(match.group(2))
-                    rolls = roll_dice(count, faces)
-                    return str(sum(rolls))
-
-                pattern = r'(\d*)d(\d+)'
-                result_expr = re.sub(pattern, dice_replacer, dice_expr, flags=re.IGNORECASE)
-                final_result = evaluate_expression(result_expr)
+                if compiled is None:
+                    final_result = None
+                else:
+                    final_result, _ = self._evaluate(event, compiled, refs)
 
                 if final_result is not None:
-                    final_total = final_result + modifier_value
-                    if modifier_key and modifier_value != 0:
-                        result_msg = f"掷骰结果: {final_result}{modifier_source} = {final_total}"
-                    else:
-                        result_msg = f"掷骰结果: {final_result}"
+                    self._record_roll(event, dice_expr, final_result, hidden)
+                    result_msg = f"掷骰结果: {final_result}{ref_desc}"
+                    if ref_note:
+                        result_msg += f"\n({ref_note})"
                     if hidden:
                         event.set_result(MessageEventResult(chain=[Comp.Plain("进行了一次暗投")]))
                         return result_msg
@@ -501,55 +1316,270 @@ class MyPlugin(Star):
                     error_msg = "表达式解析失败，请检查格式。支持格式: 1d20, 2d6, 3d10+5, (2d6+1d8)*2 等"
                     event.set_result(MessageEventResult(chain=[Comp.Plain(error_msg)]))
                     return error_msg
-            except Exception as e:
+            except ArithmeticError as e:
                 logger.error(f"骰子表达式解析错误: {e}")
                 error_msg = f"表达式解析失败: {str(e)}，请检查格式。支持格式: 1d20, 2d6, 3d10+5, (2d6+1d8)*2 等"
                 event.set_result(MessageEventResult(chain=[Comp.Plain(error_msg)]))
                 return error_msg
 
         # 解析简单骰子表达式
-        base_value, dice_parts, _ = parse_dice_expression(dice_expr)
-
-        if not dice_parts:
+        if compiled is None or not compiled.dice_parts:
             error_msg = f"无效的骰子格式: {dice_expr}，请使用如: 2d6, 3d10+5, d20 等格式"
             event.set_result(MessageEventResult(chain=[Comp.Plain(error_msg)]))
             return error_msg
 
-        # 执行投骰
-        all_rolls = []
-        total = base_value
-
-        for count, faces in dice_parts:
-            rolls = roll_dice(count, faces)
-            all_rolls.extend(rolls)
-            total += sum(rolls)
-
-        # 加上 KV 修正值
-        if modifier_key and modifier_value != 0:
-            final_total = total + modifier_value
-            if len(all_rolls) <= 5:
-                rolls_str = ", ".join(map(str, all_rolls))
-                if base_value != 0:
-                    result_msg = f"掷骰 {dice_expr}: [{rolls_str}] + {base_value}{modifier_source} = {total} + {modifier_value} = {final_total}"
-                else:
-                    result_msg = f"掷骰 {dice_expr}: [{rolls_str}]{modifier_source} = {total} + {modifier_value} = {final_total}"
-            else:
-                if base_value != 0:
-                    result_msg = f"掷骰 {dice_expr}: [{len(all_rolls)}个骰子] + {base_value}{modifier_source} = {total} + {modifier_value} = {final_total}"
-                else:
-                    result_msg = f"掷骰 {dice_expr}: [{len(all_rolls)}个骰子]{modifier_source} = {total} + {modifier_value} = {final_total}"
+        # 执行投骰（只在结果会显示每个骰子时保留点数）
+        try:
+            total, ctx = self._evaluate(event, compiled, refs)
+        except ArithmeticError as e:
+            logger.error(f"骰子表达式计算错误: {e}")
+            error_msg = f"表达式解析失败: {str(e)}，请检查格式。支持格式: 1d20, 2d6, 3d10+5, (2d6+1d8)*2 等"
+            event.set_result(MessageEventResult(chain=[Comp.Plain(error_msg)]))
+            return error_msg
+        self._record_roll(event, dice_expr, total, hidden)
+
+        result_msg = self._roll_message(dice_expr, compiled, ctx, total, ref_desc)
+        if ref_note:
+            result_msg += f"\n({ref_note})"
+
+        if hidden:
+            event.set_result(MessageEventResult(chain=[Comp.Plain("进行了一次暗投")]))
+            return result_msg
+        event.set_result(MessageEventResult(chain=[Comp.Plain(result_msg)]))
+        return result_msg
+
+    @filter.llm_tool(name="roll_dice_batch")
+    @METRICS.timed("tool.roll_dice_batch")
+    async def llm_roll_dice_batch(self, event: AstrMessageEvent, expressions: list, hidden: bool = False) -> str:
+        '''一次投掷多个骰子表达式，例如创建角色的六项属性或多人先攻，比多次调用 roll_dice 更快。返回 JSON，每个表达式包含 totals（每次投掷的结果）、rolls（骰子点数，骰子较少时提供）、refs（引用的 KV 键的取值）或 error。
+
+        Args:
+            expressions(array[string]): 骰子表达式列表，如 ["1d20+str", "2d6", "d100"]；"6#4d6" 表示重复投掷 6 次。也可以是以分号分隔的字符串，如 "6#4d6; 1d20"
+            hidden(boolean): 是否暗投。True 表示只显示"进行了一次暗投"。默认为 False。
+        '''
+        limited = self._throttle(event)
+        if limited:
+            return limited
+
+        if isinstance(expressions, str):
+            try:
+                expressions = json.loads(expressions)
+            except json.JSONDecodeError:
+                pass
+        text = expressions if isinstance(expressions, str) else ";".join(str(e) for e in expressions or [])
+        try:
+            specs = split_batch(text)
+        except DiceSyntaxError as e:
+            error_msg = f"表达式解析失败: {e}"
+            event.set_result(MessageEventResult(chain=[Comp.Plain(error_msg)]))
+            return error_msg
+
+        results = await self._roll_batch(event, specs, hidden)
+        message = "进行了一次暗投" if hidden else self._format_batch(results)
+        event.set_result(MessageEventResult(chain=[Comp.Plain(message)]))
+        return json.dumps({"results": results}, ensure_ascii=False, separators=(",", ":"))
+
+    @filter.llm_tool(name="roll_history")
+    @METRICS.timed("tool.roll_history")
+    async def llm_roll_history(self, event: AstrMessageEvent, scope: str = "user", limit: int = _HISTORY_SHOW) -> str:
+        '''查看最近的投掷记录（包括暗投的结果），以及每个表达式的次数与平均值（不含暗投）。适合主持人回顾之前的暗投或统计玩家的投掷。返回 JSON。
+
+        Args:
+            scope(string): "user" 为当前用户的记录，"group" 为当前群所有成员的记录。默认为 "user"。
+            limit(number): 返回的条数，默认为 10，最多为历史保留的条数。
+        '''
+        if not self._history.enabled:
+            return "投掷历史未开启"
+        user_key, group_key = self._session_keys(event)
+        storage_id = group_key if scope == "group" and group_key else user_key
+        history = self._history.get(storage_id)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = _HISTORY_SHOW
+        records = history.recent(min(limit, self._history.capacity)) if history else []
+        return json.dumps({
+            "rolls": [
+                {
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r.time)),
+                    "user": r.user.removeprefix("user_"),
+                    "expression": r.expression,
+                    "total": r.total,
+                    "hidden": r.hidden,
+                }
+                for r in records
+            ],
+            "stats": {
+                expression: {"count": stats.count, "average": round(stats.average, 4)}
+                for expression, stats in (history.stats.items() if history else ())
+            },
+        }, ensure_ascii=False, separators=(",", ":"))
+
+    @filter.llm_tool(name="dice_stats")
+    @METRICS.timed("tool.dice_stats")
+    async def llm_dice_stats(self, event: AstrMessageEvent, expression: str, target: Optional[float] = None) -> str:
+        '''计算骰子表达式结果的精确概率分布，返回均值、方差、分位数，以及结果不小于目标值的概率。适合回答"3d6+2 ≥ 14 的概率是多少"这类问题。
+
+        Args:
+            expression(string): 骰子表达式，只支持骰子与常数的加减及常数倍数，如 "3d6+2"、"2d6-1d4"、"100d100"
+            target(number): 可选，目标值，返回 P(结果 ≥ 目标值)
+        '''
+        limited = self._throttle(event)
+        if limited:
+            return limited
+        return await self._stats_message(expression.strip() if expression else "1d20", target)
+
+    @filter.llm_tool(name="ability_check")
+    @METRICS.timed("tool.ability_check")
+    async def llm_ability_check(
+        self,
+        event: AstrMessageEvent,
+        ability: str,
+        dc: Optional[int] = None,
+        proficient: bool = False,
+        advantage: bool = False,
+        disadvantage: bool = False,
+        hidden: bool = False,
+        reason: str = "",
+    ) -> str:
+        '''为当前用户的角色进行属性或技能检定（1d20 + 修正值）。属性修正值由 KV 中的属性值按 (属性值-10)//2 计算，技能使用 KV 中 "skill_技能名" 的加值。
+
+        Args:
+            ability(string): 属性名，如 "力量"、"str"、"dexterity"；或技能名，如 "隐匿"
+            dc(number): 可选，难度等级，结果不小于此值为成功；不提供时使用群数据中的 "dc"
+            proficient(boolean): 是否加上熟练加值（KV 中的 "prof"，默认按等级计算）。默认为 False。
+            advantage(boolean): 优势，投两次取高。默认为 False。
+            disadvantage(boolean): 劣势，投两次取低。默认为 False。
+            hidden(boolean): 是否暗投。True 表示只显示"进行了一次暗投"。默认为 False。
+            reason(string): 可选，检定原因
+        '''
+        limited = self._throttle(event)
+        if limited:
+            return limited
+
+        try:
+            dc = int(dc) if dc is not None else None
+        except (TypeError, ValueError):
+            return "dc 必须是整数"
+        char = await self._character(event)
+        check = char.check_bonus(ability or "")
+        if check is None:
+            return f"未知的属性或技能 '{ability}'，可用属性: {'、'.join(zh for _, zh, _ in ABILITIES)}，技能需以 skill_技能名 存入 KV"
+        label, bonus = check
+        if proficient:
+            bonus += char.prof
+        if dc is None:
+            session = await self._game_session(event)
+            dc = session.dc if session is not None else None
+        roll = self._roll_d20(event, label, bonus, advantage, disadvantage, reason, hidden)
+
+        result_msg = f"{self._display_name(char, event)} 进行「{label}」检定"
+        if reason:
+            result_msg += f"（{reason}）"
+        result_msg += f": {roll}"
+        if dc is not None:
+            result_msg += f" vs DC {dc} → {'成功' if roll.total >= dc else '失败'}"
+
+        if hidden:
+            event.set_result(MessageEventResult(chain=[Comp.Plain("进行了一次暗投")]))
+            return result_msg
+        event.set_result(MessageEventResult(chain=[Comp.Plain(result_msg)]))
+        return result_msg
+
+    @filter.llm_tool(name="attack_roll")
+    @METRICS.timed("tool.attack_roll")
+    async def llm_attack_roll(
+        self,
+        event: AstrMessageEvent,
+        weapon_name: str = "",
+        ability: str = "str",
+        damage_dice: str = "1d8",
+        attack_bonus: int = 0,
+        damage_bonus: int = 0,
+        target_ac: Optional[int] = None,
+        proficient: bool = True,
+        advantage: bool = False,
+        disadvantage: bool = False,
+        hidden: bool = False,
+    ) -> str:
+        '''为当前用户的角色进行攻击投掷并计算伤害。命中加值 = 属性修正值 + 熟练加值 + attack_bonus，伤害 = 伤害骰 + 属性修正值 + damage_bonus；投出 20 为暴击（伤害骰投两次），投出 1 必定未命中。
+
+        Args:
+            weapon_name(string): 可选，武器名称
+            ability(string): 攻击使用的属性，如 "力量"（近战）、"敏捷"（远程或灵巧武器）。默认为 "str"。
+            damage_dice(string): 伤害骰子表达式，如 "1d8"、"2d6"，可以引用 KV 键名。默认为 "1d8"。
+            attack_bonus(number): 额外的命中加值（如魔法武器）。默认为 0。
+            damage_bonus(number): 额外的伤害加值。默认为 0。
+            target_ac(number): 可选，目标护甲等级；提供时判断是否命中，未命中不投伤害
+            proficient(boolean): 是否熟练该武器（加上熟练加值）。默认为 True。
+            advantage(boolean): 优势，投两次取高。默认为 False。
+            disadvantage(boolean): 劣势，投两次取低。默认为 False。
+            hidden(boolean): 是否暗投。True 表示只显示"进行了一次暗投"。默认为 False。
+        '''
+        limited = self._throttle(event)
+        if limited:
+            return limited
+
+        index = Character.ability_index(ability or "")
+        if index is None:
+            return f"未知的属性 '{ability}'，可用属性: {'、'.join(zh for _, zh, _ in ABILITIES)}"
+        try:
+            attack_bonus, damage_bonus = int(attack_bonus), int(damage_bonus)
+            target_ac = int(target_ac) if target_ac is not None else None
+        except (TypeError, ValueError):
+            return "attack_bonus、damage_bonus 与 target_ac 必须是整数"
+        try:
+            damage = self._compile(damage_dice.strip() if damage_dice else "1d8", repeat=2)
+        except ExpressionCostError as e:
+            return f"伤害表达式开销过大: {e}"
+        except DiceSyntaxError as e:
+            return f"伤害表达式解析失败: {e}"
+
+        char = await self._character(event)
+        mod = char.mods[index]
+        to_hit = mod + (char.prof if proficient else 0) + attack_bonus
+        label = ABILITIES[index][1]
+        attack = self._roll_d20(event, label, to_hit, advantage, disadvantage, weapon_name, hidden)
+        critical = attack.natural == 20
+        if attack.natural == 1:
+            hit = False
+        elif critical or target_ac is None:
+            hit = True
         else:
-            if len(all_rolls) <= 5:
-                rolls_str = ", ".join(map(str, all_rolls))
-                if base_value != 0:
-                    result_msg = f"掷骰 {dice_expr}: [{rolls_str}] + {base_value} = {total}"
-                else:
-                    result_msg = f"掷骰 {dice_expr}: [{rolls_str}] = {total}"
-            else:
-                if base_value != 0:
-                    result_msg = f"掷骰 {dice_expr}: [{len(all_rolls)}个骰子] + {base_value} = {total}"
-                else:
-                    result_msg = f"掷骰 {dice_expr}: [{len(all_rolls)}个骰子] = {total}"
+            hit = attack.total >= target_ac
+
+        line = f"{self._display_name(char, event)} "
+        if weapon_name:
+            line += f"使用「{weapon_name}」"
+        line += f"攻击: {attack}"
+        if target_ac is not None:
+            line += f" vs AC {target_ac}"
+        if critical:
+            line += " → 暴击"
+        elif attack.natural == 1:
+            line += " → 大失败"
+        elif target_ac is not None:
+            line += " → 命中" if hit else " → 未命中"
+        lines = [line]
+        if hit:
+            refs = await self._resolve_refs(event, damage.refs)
+            try:
+                dealt = 0
+                rolls = []
+                for _ in range(2 if critical else 1):
+                    total, ctx = self._evaluate(event, damage, refs)
+                    dealt += total
+                    rolls += ctx.rolls
+            except ArithmeticError as e:
+                return f"伤害计算失败: {e}"
+            # 引用替换为取值显示，使显示的各项之和等于总伤害
+            dice = substitute_refs(damage.text, refs) if damage.refs else damage.text
+            dice = f"{dice}×2" if critical else dice
+            damage_roll = DiceRoll(label, dice, rolls, dealt, mod + damage_bonus, weapon_name, hidden)
+            self._record_roll(event, damage_roll.expression, damage_roll.total, hidden)
+            ref_desc, ref_note = self._describe_refs(damage, refs)
+            lines.append(f"伤害: {damage_roll}{ref_desc}" + (f" ({ref_note})" if ref_note else ""))
+        result_msg = "\n".join(lines)
 
         if hidden:
             event.set_result(MessageEventResult(chain=[Comp.Plain("进行了一次暗投")]))
@@ -557,5 +1587,22 @@ class MyPlugin(Star):
         event.set_result(MessageEventResult(chain=[Comp.Plain(result_msg)]))
         return result_msg
 
+    @filter.llm_tool(name="get_character")
+    @METRICS.timed("tool.get_character")
+    async def llm_get_character(self, event: AstrMessageEvent) -> str:
+        '''读取当前用户的角色卡：名字、等级、生命值、护甲、六项属性值与修正值、技能、物品和状态。角色卡由用户的 KV 数据解析而来，修改请使用 kv_upsert / kv_update。返回 JSON。
+        '''
+        char = await self._character(event)
+        return json.dumps(char.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
     async def terminate(self):
         """可选择实现异步的插件销毁方法"""
+        await self._kv.close()
+        await self._history.close()
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            self._metrics_task = None
+            await self._export_metrics(self._metrics_file())
+        if self._sim_pool is not None:
+            self._sim_pool.shutdown(wait=False, cancel_futures=True)
+            self._sim_pool = None
@@ -0,0 +1,268 @@
+"""轻量级运行指标
+
+耗时记录在固定分桶的直方图中（1µs 起每档翻倍），内存占用与调用次数无关；
+另有计数器和可在运行时开关的慢表达式采样。指标可渲染为文本摘要或
+Prometheus 文本格式。所有记录都在事件循环线程中进行，不加锁。
+
+本模块不依赖 astrbot，可以被其他辅助模块导入。
+"""
+import functools
+import inspect
+import os
+import random
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+# 直方图分桶上界（秒）：1µs 起每档翻倍，最后一档约 16.8s，更慢的记入溢出桶
+_BUCKET_BOUNDS = tuple(1e-6 * 2 ** i for i in range(25))
+# 慢表达式采样默认保留的条数
+_SLOW_TOP_N = 10
+# 慢表达式采样最多保留的条数
+_SLOW_MAX_N = 100
+# Prometheus 指标名前缀
+_PROM_PREFIX = "simple_dice"
+
+
+class Histogram:
+    """固定分桶的耗时直方图"""
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(_BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """按分桶估计分位数，返回所在分桶的上界（不超过最大值）"""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(_BUCKET_BOUNDS[i], self.max) if i < len(_BUCKET_BOUNDS) else self.max
+        return self.max
+
+
+class Timer:
+    """计时上下文管理器，退出时把耗时记入直方图"""
+
+    __slots__ = ("histogram", "start", "elapsed")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.elapsed = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed)
+
+
+class SlowExpressionProfiler:
+    """慢表达式采样，开启后按采样率记录求值耗时，保留最慢的若干个表达式"""
+
+    __slots__ = ("enabled", "sample_rate", "top_n", "sampled", "_slowest")
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.top_n = _SLOW_TOP_N
+        # 已采样的次数
+        self.sampled = 0
+        # {表达式: 最长耗时}，最多 top_n 项
+        self._slowest: dict[str, float] = {}
+
+    def start(self, sample_rate: float = 1.0, top_n: int = _SLOW_TOP_N):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.top_n = min(max(top_n, 1), _SLOW_MAX_N)
+        self.sampled = 0
+        self._slowest = {}
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def record(self, expression: str, elapsed: float):
+        if not self.enabled or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return
+        self.sampled += 1
+        slowest = self._slowest
+        if expression in slowest:
+            if elapsed > slowest[expression]:
+                slowest[expression] = elapsed
+        elif len(slowest) < self.top_n:
+            slowest[expression] = elapsed
+        else:
+            fastest = min(slowest, key=slowest.get)
+            if elapsed > slowest[fastest]:
+                del slowest[fastest]
+                slowest[expression] = elapsed
+
+    def slowest(self) -> list[tuple[str, float]]:
+        """返回 [(表达式, 耗时秒)]，按耗时从高到低"""
+        return sorted(self._slowest.items(), key=lambda item: item[1], reverse=True)
+
+
+class Metrics:
+    """指标注册表：按名称区分的直方图与计数器"""
+
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self.profiler = SlowExpressionProfiler()
+        self.since = time.time()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self.histogram(name))
+
+    def incr(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        # 装饰器持有直方图对象，原地清零而不是替换
+        for histogram in self.histograms.values():
+            histogram.clear()
+        self.counters.clear()
+        self.since = time.time()
+
+    def timed(self, name: str):
+        """记录函数耗时的装饰器，保留原函数的签名与文档（供 llm_tool 解析参数）
+
+        异步生成器只统计生成器自身执行的时间，不包括调用方处理每个结果的时间。
+        抛出异常时额外计数 "<name>.errors"。
+        """
+        def decorator(func):
+            histogram = self.histogram(name)
+            errors = f"{name}.errors"
+
+            if inspect.isasyncgenfunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    agen = func(*args, **kwargs)
+                    elapsed = 0.0
+                    try:
+                        while True:
+                            start = time.perf_counter()
+                            try:
+                                item = await agen.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            finally:
+                                elapsed += time.perf_counter() - start
+                            yield item
+                    except Exception:
+                        self.incr(errors)
+                        raise
+                    finally:
+                        await agen.aclose()
+                        histogram.observe(elapsed)
+
+            elif inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception:
+                        self.incr(errors)
+                        raise
+                    finally:
+                        histogram.observe(time.perf_counter() - start)
+
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return func(*args, **kwargs)
+                    except Exception:
+                        self.incr(errors)
+                        raise
+                    finally:
+                        histogram.observe(time.perf_counter() - start)
+
+            return wrapper
+        return decorator
+
+    def summary(self) -> str:
+        """文本摘要：每个直方图的次数、均值、p50/p99、最大值，以及计数器"""
+        lines = [f"统计自 {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.since))}"]
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            if not h.count:
+                continue
+            lines.append(
+                f"{name}: {h.count}次 均值{format_seconds(h.sum / h.count)} "
+                f"p50 {format_seconds(h.quantile(0.5))} p99 {format_seconds(h.quantile(0.99))} "
+                f"最大{format_seconds(h.max)}"
+            )
+        for name in sorted(self.counters):
+            lines.append(f"{name}: {self.counters[name]}")
+        if len(lines) == 1:
+            lines.append("暂无数据")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        metric = f"{_PROM_PREFIX}_duration_seconds"
+        lines = [f"# HELP {metric} 各环节耗时", f"# TYPE {metric} histogram"]
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            label = _prom_label(name)
+            cumulative = 0
+            for bound, n in zip(_BUCKET_BOUNDS, h.counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{name="{label}",le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{name="{label}",le="+Inf"}} {h.count}')
+            lines.append(f'{metric}_sum{{name="{label}"}} {h.sum:.9g}')
+            lines.append(f'{metric}_count{{name="{label}"}} {h.count}')
+        counter = f"{_PROM_PREFIX}_events_total"
+        lines += [f"# HELP {counter} 事件计数", f"# TYPE {counter} counter"]
+        for name in sorted(self.counters):
+            lines.append(f'{counter}{{name="{_prom_label(name)}"}} {self.counters[name]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path):
+        """原子地写入 Prometheus 文本文件（供 node_exporter textfile 收集）"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(self.prometheus(), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def _prom_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+
+# 插件全局的指标注册表
+METRICS = Metrics()
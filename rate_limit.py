@@ -0,0 +1,60 @@
+"""按 storage_id 划分的令牌桶限流
+
+每个 id 一个令牌桶，按固定速率补充令牌，容量即允许的突发次数。
+桶的数量有上限，最久未使用的桶会被淘汰（被淘汰的桶下次使用时视为已满）。
+所有操作都在事件循环线程中进行，不加锁。
+"""
+import time
+from collections import OrderedDict
+
+# 最多保留的令牌桶个数
+_MAX_BUCKETS = 10_000
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """令牌桶限流器，rate 为每秒补充的令牌数，rate <= 0 时不限流"""
+
+    def __init__(self, rate: float, capacity: float, max_buckets: int = _MAX_BUCKETS):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self, key: str) -> _Bucket:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.capacity, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def wait_time(self, key: str, cost: float = 1.0) -> float:
+        """还需等待多少秒才有 cost 个令牌，0 表示现在即可"""
+        if not self.enabled:
+            return 0.0
+        bucket = self._refill(key)
+        if bucket.tokens >= cost:
+            return 0.0
+        return (cost - bucket.tokens) / self.rate
+
+    def consume(self, key: str, cost: float = 1.0):
+        """扣除令牌，应在 wait_time 返回 0 后调用"""
+        if self.enabled:
+            self._refill(key).tokens -= cost
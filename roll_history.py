@@ -0,0 +1,250 @@
+"""投掷历史
+
+每个用户和群保留最近若干次投掷（环形缓冲区），按表达式增量维护次数与总和，
+查询统计时不需要重新扫描记录。群内的一次投掷同时记入该用户和该群的历史，
+两边共享同一个记录对象。
+
+投掷记录以 JSON Lines 追加写入 history.jsonl，合并后按定时器落盘；
+启动时按顺序重放该文件。启动时或运行中文件行数远多于仍保留的记录时压缩重写。
+内存中的操作都在事件循环线程中进行，文件读写在专用 I/O 线程中执行。
+"""
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from astrbot.api import logger
+
+# 每个用户/群默认保留的投掷条数
+HISTORY_SIZE = 50
+# 追加写入的合并延迟（秒）
+_FLUSH_DELAY = 2.0
+# 文件行数超过保留记录数（至少为每个用户/群的保留条数）的此倍数时压缩重写
+_COMPACT_RATIO = 4
+
+
+class RollRecord:
+    """一次投掷"""
+
+    __slots__ = ("time", "user", "group", "expression", "total", "hidden")
+
+    def __init__(self, time: float, user: str, group: Optional[str], expression: str, total: Any, hidden: bool):
+        self.time = time
+        self.user = user
+        self.group = group
+        self.expression = expression
+        self.total = total
+        self.hidden = hidden
+
+    def to_row(self) -> list:
+        return [round(self.time, 3), self.user, self.group, self.expression, self.total, int(self.hidden)]
+
+
+class ExpressionStats:
+    """某个表达式在保留窗口内的次数与总和"""
+
+    __slots__ = ("count", "total")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class RollHistory:
+    """单个用户或群的环形缓冲区
+
+    records 未满时逐条追加，满后从 start 处覆盖最旧的记录。
+    stats 只统计明投，覆盖旧记录时同步扣除，始终与窗口内的记录一致。
+    """
+
+    __slots__ = ("capacity", "records", "start", "stats")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.records: list[RollRecord] = []
+        self.start = 0
+        self.stats: Dict[str, ExpressionStats] = {}
+
+    def add(self, record: RollRecord):
+        if len(self.records) < self.capacity:
+            self.records.append(record)
+        else:
+            self._unstat(self.records[self.start])
+            self.records[self.start] = record
+            self.start = (self.start + 1) % self.capacity
+        if not record.hidden:
+            stats = self.stats.get(record.expression)
+            if stats is None:
+                stats = self.stats[record.expression] = ExpressionStats()
+            stats.count += 1
+            stats.total += record.total
+
+    def _unstat(self, record: RollRecord):
+        if record.hidden:
+            return
+        stats = self.stats[record.expression]
+        stats.count -= 1
+        stats.total -= record.total
+        if not stats.count:
+            del self.stats[record.expression]
+
+    def recent(self, n: int) -> list[RollRecord]:
+        """最近 n 条记录，最新的在前"""
+        ordered = self.records[self.start:] + self.records[:self.start]
+        return ordered[::-1][:max(n, 0)]
+
+
+class HistoryStore:
+    """storage_id -> RollHistory，记录追加写入文件"""
+
+    def __init__(self, path: Path, capacity: int = HISTORY_SIZE, flush_delay: float = _FLUSH_DELAY):
+        self.path = path
+        self.capacity = capacity
+        self.flush_delay = flush_delay
+        self._histories: Dict[str, RollHistory] = {}
+        # 尚未写入文件的行
+        self._pending: list[str] = []
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-io")
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        # 文件中的行数，超过 _compact_at 时在落盘时压缩重写
+        self._lines = 0
+        self._compact_at = _COMPACT_RATIO * capacity
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    async def _run_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, func, *args)
+
+    async def load(self):
+        """重放历史文件，必要时压缩"""
+        if not self.enabled:
+            return
+        rows = await self._run_io(self._read)
+        for row in rows:
+            self._add(RollRecord(*row))
+        retained = self._unique_records()
+        self._lines = len(rows)
+        self._compact_at = _COMPACT_RATIO * max(len(retained), self.capacity)
+        if self._lines > self._compact_at:
+            await self._compact(retained)
+
+    async def _compact(self, retained: list) -> bool:
+        """用仍被保留的记录重写文件，成功时返回 True"""
+        lines = [json.dumps(r.to_row(), ensure_ascii=False) for r in retained]
+        try:
+            await self._run_io(self._rewrite, lines)
+        except OSError as e:
+            logger.error(f"投掷历史压缩失败: {e}")
+            return False
+        self._lines = len(lines)
+        self._compact_at = _COMPACT_RATIO * max(len(lines), self.capacity)
+        return True
+
+    def _read(self) -> list[list]:
+        if not self.path.exists():
+            return []
+        rows = []
+        with open(self.path, encoding="utf-8", errors="replace") as f:
+            for lineno, line in enumerate(f, 1):
+                try:
+                    t, user, group, expression, total, hidden = json.loads(line)
+                    rows.append([float(t), user, group, sys.intern(expression), total, bool(hidden)])
+                except (json.JSONDecodeError, TypeError, ValueError):
+                    logger.warning(f"跳过投掷历史 {self.path} 第 {lineno} 行的无效记录")
+        return rows
+
+    def _rewrite(self, lines: list[str]):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _append(self, lines: list[str]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in lines)
+
+    def _unique_records(self) -> list[RollRecord]:
+        """仍被保留的记录（用户与群共享的记录只算一次），按时间排序"""
+        seen = {}
+        for history in self._histories.values():
+            for record in history.records:
+                seen[id(record)] = record
+        return sorted(seen.values(), key=lambda r: r.time)
+
+    def _history(self, storage_id: str) -> RollHistory:
+        history = self._histories.get(storage_id)
+        if history is None:
+            history = self._histories[storage_id] = RollHistory(self.capacity)
+        return history
+
+    def _add(self, record: RollRecord):
+        self._history(record.user).add(record)
+        if record.group:
+            self._history(record.group).add(record)
+
+    def record(self, user: str, group: Optional[str], expression: str, total: Any, hidden: bool = False):
+        """记录一次投掷，total 为最终结果（含修正值），不是有限实数的结果不记录"""
+        if not self.enabled:
+            return
+        if isinstance(total, bool) or not isinstance(total, (int, float)) or (
+            isinstance(total, float) and not math.isfinite(total)
+        ):
+            logger.warning(f"投掷结果 {total!r} 不是有限实数，不记入历史: {expression}")
+            return
+        record = RollRecord(time.time(), user, group, sys.intern(expression), total, hidden)
+        # 先编码再修改内存中的历史，编码失败时两边都不记录
+        line = json.dumps(record.to_row(), ensure_ascii=False)
+        self._add(record)
+        self._pending.append(line)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._start_flush)
+
+    def get(self, storage_id: str) -> Optional[RollHistory]:
+        return self._histories.get(storage_id)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """把未写入的记录追加到文件（在 I/O 线程中执行）"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        if self._lines + len(lines) > self._compact_at:
+            # 待写入的记录已在内存中，压缩重写时一并写入
+            if await self._compact(self._unique_records()):
+                return
+        try:
+            await self._run_io(self._append, lines)
+            self._lines += len(lines)
+        except OSError as e:
+            logger.error(f"投掷历史写入失败，稍后重试: {e}")
+            self._pending = lines + self._pending
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self._start_flush)
+
+    async def close(self):
+        """写入剩余记录，插件卸载时调用"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        self._io.shutdown(wait=True)
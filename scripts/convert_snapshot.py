@@ -0,0 +1,77 @@
+"""KV 快照格式转换
+
+在文本 JSON 与二进制快照（msgpack/cbor/紧凑 JSON，可选压缩）之间转换，
+输入格式按文件头自动识别。转换正在使用的数据文件前请先停止插件，
+否则插件下次落盘时会按配置的格式覆盖。
+
+用法:
+    python scripts/convert_snapshot.py data/kv.json                   # 以文本 JSON 输出到标准输出
+    python scripts/convert_snapshot.py data/kv.json --info            # 查看格式、大小与条目数
+    python scripts/convert_snapshot.py data/kv.json -o kv.bin --format msgpack --compression zstd
+    python scripts/convert_snapshot.py data/kv_shards --in-place --format cbor
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# 插件目录（scripts 的上一级），kv_snapshot 不依赖 astrbot，可直接导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kv_snapshot  # noqa: E402
+
+
+def write_atomic(path: Path, raw: bytes):
+    """先写临时文件并 fsync，再改名覆盖"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def info(path: Path) -> str:
+    raw = path.read_bytes()
+    fmt = kv_snapshot.detect(raw)
+    data = kv_snapshot.decode(raw)
+    entries = sum(len(v) if isinstance(v, dict) else 1 for v in data.values())
+    return f"{path}: {fmt}，{len(raw)} 字节，{len(data)} 个顶层键，{entries} 项"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simple_dice KV 快照格式转换")
+    parser.add_argument("input", type=Path, help="快照文件，或 --in-place 时的分片目录")
+    parser.add_argument("-o", "--output", type=Path, help="输出文件，省略时以文本 JSON 输出到标准输出")
+    parser.add_argument("--format", default="json", choices=tuple(kv_snapshot.CODECS), help="输出编码")
+    parser.add_argument("--compression", default="none", choices=tuple(kv_snapshot.COMPRESSIONS),
+                        help="输出压缩方式")
+    parser.add_argument("--in-place", action="store_true", help="原地转换（目录时转换其中所有 .json 文件）")
+    parser.add_argument("--info", action="store_true", help="只显示格式、大小与条目数")
+    args = parser.parse_args()
+
+    paths = sorted(args.input.glob("*.json")) if args.input.is_dir() else [args.input]
+    try:
+        if args.info:
+            for path in paths:
+                print(info(path))
+            return
+        fmt = kv_snapshot.SnapshotFormat(args.format, args.compression)
+        if args.in_place:
+            for path in paths:
+                write_atomic(path, fmt.encode(kv_snapshot.decode(path.read_bytes())))
+            print(f"已将 {len(paths)} 个文件转换为 {fmt}", file=sys.stderr)
+        elif args.input.is_dir():
+            parser.error("目录只能配合 --in-place 或 --info 使用")
+        elif args.output is not None:
+            write_atomic(args.output, fmt.encode(kv_snapshot.decode(args.input.read_bytes())))
+            print(info(args.output), file=sys.stderr)
+        else:
+            data = kv_snapshot.decode(args.input.read_bytes())
+            sys.stdout.write(kv_snapshot.TEXT_JSON.encode(data).decode("utf-8") + "\n")
+    except (OSError, kv_snapshot.SnapshotError) as e:
+        sys.exit(f"转换失败: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""测试公共设施
+
+注入 bench/fake_astrbot 中的 astrbot 替身，并按目录名把插件作为包导入，
+使测试可以在没有 AstrBot 实例的环境中运行。
+"""
+import asyncio
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+# 插件目录（tests 的上一级）
+_PLUGIN_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(_PLUGIN_DIR / "bench"))
+sys.path.insert(0, str(_PLUGIN_DIR.parent))
+
+import fake_astrbot  # noqa: E402
+
+fake_astrbot.install()
+
+Event = fake_astrbot.FakeEvent
+
+
+def plugin_module(name: str):
+    """导入插件包中的模块，如 plugin_module("dice_engine")"""
+    return importlib.import_module(f"{_PLUGIN_DIR.name}.{name}")
+
+
+@pytest.fixture
+def run():
+    """在同一个事件循环中执行协程，返回其结果"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture
+def make_plugin(tmp_path, monkeypatch, run):
+    """创建数据目录位于 tmp_path 的插件实例，测试结束时依次销毁"""
+    main = plugin_module("main")
+    monkeypatch.setattr(main, "_KV_FILE", tmp_path / "kv.json")
+    monkeypatch.setattr(main, "_HISTORY_FILE", tmp_path / "history.jsonl")
+    plugins = []
+
+    def factory(**config):
+        config.setdefault("rate_limit_per_minute", 100_000)
+        config.setdefault("rate_limit_burst", 100_000)
+        config.setdefault("rate_limit_group_per_minute", 100_000)
+        config.setdefault("rate_limit_group_burst", 100_000)
+        plugin = main.MyPlugin(fake_astrbot.Context(), config)
+        run(plugin.initialize())
+        plugins.append(plugin)
+        return plugin
+
+    yield factory
+    for plugin in plugins:
+        run(plugin.terminate())
+
+
+@pytest.fixture
+def plugin(make_plugin):
+    return make_plugin()
+
+
+async def collect(handler, event) -> list:
+    """执行指令处理器，返回它产生的所有消息"""
+    return [message async for message in handler(event)]
@@ -0,0 +1,51 @@
+"""character 与检定工具"""
+import re
+
+import pytest
+
+from conftest import Event, collect, plugin_module
+
+character = plugin_module("character")
+
+
+def test_character_sheet_from_storage():
+    char = character.Character.from_storage("user_a", {
+        "力量": 16, "dex": "14", "str": 3, "dex_mod": 5, "level": 5, "skill_隐匿": 7, "hp": "abc",
+    })
+    # 中文名优先于缩写
+    assert char.scores[0] == 16 and char.mods[0] == 3
+    assert char.scores[1] == 14 and char.mods[1] == 5
+    assert char.prof == 3
+    assert char.check_bonus("隐匿") == ("隐匿", 7)
+    assert char.check_bonus("力量") == ("力量", 3)
+    assert char.invalid == ["hp"]
+
+
+@pytest.mark.parametrize("dc, expected", [("12", "DC 12"), (12.0, "DC 12"), (30, "DC 30")])
+def test_ability_check_coerces_dc(plugin, run, dc, expected):
+    assert expected in run(plugin.llm_ability_check(Event(""), "力量", dc=dc))
+
+
+@pytest.mark.parametrize("dc", ["hard", "", [1]])
+def test_ability_check_rejects_invalid_dc(plugin, run, dc):
+    assert run(plugin.llm_ability_check(Event(""), "力量", dc=dc)) == "dc 必须是整数"
+
+
+def test_attack_damage_shows_resolved_refs(plugin, run):
+    run(collect(plugin.kv_command, Event("/kv set str 14")))
+    pattern = re.compile(r"伤害: 1d8\+14(?:×2)?\[([\d, ]+)\] \+ 2 = (\d+)")
+    for _ in range(50):
+        message = run(plugin.llm_attack_roll(Event(""), damage_dice="1d8+str"))
+        match = pattern.search(message)
+        if match:
+            break
+    assert match, message
+    rolls = [int(v) for v in match.group(1).split(", ")]
+    assert int(match.group(2)) == sum(rolls) + 14 * len(rolls) + 2
+
+
+def test_substitute_refs():
+    dice_engine = plugin_module("dice_engine")
+    values = {("user", "str"): 3, ("group", "ac"): -1}
+    assert dice_engine.substitute_refs("1d8+str", values) == "1d8+3"
+    assert dice_engine.substitute_refs("(1d4+@group.ac)*2+missing", values) == "(1d4+(-1))*2+0"
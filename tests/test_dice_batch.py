@@ -0,0 +1,93 @@
+"""批量投掷：split_batch、/r 的 N#表达式 与 roll_dice_batch 工具"""
+import json
+import re
+
+import pytest
+
+from conftest import Event, collect, plugin_module
+
+dice_engine = plugin_module("dice_engine")
+
+
+@pytest.mark.parametrize("text, specs", [
+    ("6#4d6", [(6, "4d6")]),
+    ("6 # 4d6", [(6, "4d6")]),
+    ("1d20; 2d6+1", [(1, "1d20"), (1, "2d6+1")]),
+    ("3#1d20；d100;", [(3, "1d20"), (1, "d100")]),
+    (" ; 2#d6 ;; ", [(2, "d6")]),
+])
+def test_split_batch(text, specs):
+    assert dice_engine.split_batch(text) == specs
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "表达式为空"),
+    (" ; ; ", "表达式为空"),
+    ("0#1d6", "重复次数必须大于 0"),
+    ("3#", "# 后缺少表达式"),
+    ("51#1d6", "最多投掷 50 次"),
+    ("30#1d6; 20#1d6; 1d6", "最多投掷 50 次"),
+])
+def test_split_batch_rejects(text, message):
+    with pytest.raises(dice_engine.DiceSyntaxError, match=message):
+        dice_engine.split_batch(text)
+
+
+def test_split_batch_allows_exactly_the_limit():
+    assert dice_engine.split_batch(f"{dice_engine.MAX_BATCH_ROLLS}#1d6") == [(dice_engine.MAX_BATCH_ROLLS, "1d6")]
+
+
+def history_count(plugin, run) -> int:
+    return len(json.loads(run(plugin.llm_roll_history(Event(""), limit=100)))["rolls"])
+
+
+def test_repeat_command_lists_each_roll(plugin, run):
+    message = run(collect(plugin.roll_dice, Event("/r 6#4d6")))[0]
+    lines = message.split("\n")
+    assert lines[0] == "6#4d6:"
+    assert len(lines) == 7
+    for i, line in enumerate(lines[1:], 1):
+        match = re.fullmatch(rf"  #{i} \[(\d+), (\d+), (\d+), (\d+)\] = (\d+)", line)
+        assert match
+        *values, total = map(int, match.groups())
+        assert sum(values) == total
+    assert history_count(plugin, run) == 6
+
+
+def test_batch_command_reports_errors_per_expression(plugin, run):
+    message = run(collect(plugin.roll_dice, Event("/r 1d20+3; 1d; 2d6")))[0]
+    lines = message.split("\n")
+    assert re.fullmatch(r"1d20\+3: \[\d+\] = \d+", lines[0])
+    assert lines[1].startswith("1d: 表达式解析失败")
+    assert re.fullmatch(r"2d6: \[\d+, \d+\] = \d+", lines[2])
+    assert history_count(plugin, run) == 2
+
+
+def test_batch_command_rejects_too_many_rolls(plugin, run):
+    message = run(collect(plugin.roll_dice, Event("/r 60#1d6")))[0]
+    assert message == "表达式解析失败: 一次最多投掷 50 次"
+    assert history_count(plugin, run) == 0
+
+
+def test_batch_tool_returns_json(plugin, run):
+    run(collect(plugin.kv_command, Event("/kv set str 3")))
+    result = json.loads(run(plugin.llm_roll_dice_batch(Event(""), ["6#4d6", "1d20+str"])))["results"]
+    stats, attack = result
+    assert (stats["expression"], stats["repeat"]) == ("4d6", 6)
+    assert len(stats["totals"]) == 6 and len(stats["rolls"]) == 6
+    assert all(sum(rolls) == total for rolls, total in zip(stats["rolls"], stats["totals"]))
+    assert attack["refs"] == {"str": 3}
+    assert attack["totals"][0] == attack["rolls"][0][0] + 3
+
+
+def test_batch_tool_accepts_a_string(plugin, run):
+    for expressions in ('["2#d6", "d8"]', "2#d6; d8"):
+        result = json.loads(run(plugin.llm_roll_dice_batch(Event(""), expressions)))["results"]
+        assert [(entry["expression"], len(entry["totals"])) for entry in result] == [("d6", 2), ("d8", 1)]
+
+
+def test_hidden_batch_tool_records_but_does_not_show(plugin, run):
+    event = Event("")
+    run(plugin.llm_roll_dice_batch(event, ["3#d6"], hidden=True))
+    assert event.result.chain[0].text == "进行了一次暗投"
+    assert history_count(plugin, run) == 3
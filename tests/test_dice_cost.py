@@ -0,0 +1,58 @@
+"""开销预算与限流：求值前拒绝过大的表达式"""
+import pytest
+
+from conftest import Event, collect, plugin_module
+
+dice_engine = plugin_module("dice_engine")
+rate_limit = plugin_module("rate_limit")
+
+
+def check(expression: str, repeat: int = 1, **budget):
+    dice_engine.check_cost(dice_engine.compile_expression(expression), dice_engine.CostBudget(**budget), repeat)
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("999999999d999999", "骰子总数"),
+    ("9**9**9", "指数"),
+    ("2**1000*2**1000*2**1000*2**1000*2**1000", "结果可能达到"),
+    ("1" + "+1d2" * 101, "运算过多"),
+])
+def test_over_budget_expressions_are_rejected(expression, message):
+    with pytest.raises(dice_engine.ExpressionCostError, match=message):
+        check(expression)
+
+
+@pytest.mark.parametrize("expression", ["1d20+5", "4d6kh3", "100d6!", "2**1000", "1d6**1d6", "1000000d6"])
+def test_reasonable_expressions_pass(expression):
+    check(expression)
+
+
+def test_repeat_counts_towards_dice_budget():
+    check("1000d6", repeat=10, max_dice=10_000)
+    with pytest.raises(dice_engine.ExpressionCostError):
+        check("1000d6", repeat=11, max_dice=10_000)
+
+
+def test_exploding_pools_are_charged_for_extra_dice():
+    assert dice_engine.compile_expression("10d6!").cost.dice > dice_engine.compile_expression("10d6").cost.dice
+
+
+def test_command_rejects_before_rolling(plugin, run):
+    messages = run(collect(plugin.roll_dice, Event("/r 999999999d999999")))
+    assert messages == ["表达式开销过大: 骰子总数 999999999 超过上限 10000000"]
+    assert run(plugin.llm_roll_dice(Event(""), "9**9**9")).startswith("表达式开销过大")
+
+
+def test_rate_limiter_refuses_after_burst(make_plugin, run):
+    plugin = make_plugin(rate_limit_per_minute=1, rate_limit_burst=2)
+    replies = [run(collect(plugin.roll_dice, Event("/r 1d6")))[0] for _ in range(3)]
+    assert not replies[0].startswith("操作过于频繁")
+    assert not replies[1].startswith("操作过于频繁")
+    assert replies[2].startswith("操作过于频繁")
+
+
+def test_disabled_rate_limiter_never_waits():
+    limiter = rate_limit.RateLimiter(0, 1)
+    for _ in range(10):
+        assert limiter.wait_time("user_a") == 0
+        limiter.consume("user_a")
@@ -0,0 +1,105 @@
+"""dice_engine：解析、常数折叠与求值"""
+import pytest
+
+from conftest import plugin_module
+
+dice_engine = plugin_module("dice_engine")
+
+
+@pytest.mark.parametrize("expression", ["(-8)**(1/3)", "(-2)**0.5", "(1d2-3)**0.5"])
+def test_non_real_power_raises_arithmetic_error(expression):
+    compiled = dice_engine.compile_expression(expression)
+    with pytest.raises(ArithmeticError):
+        compiled.evaluate()
+    assert dice_engine.evaluate_expression(expression) is None
+
+
+def test_non_real_power_is_not_folded():
+    compiled = dice_engine.compile_expression("(-8)**(1/3)")
+    assert isinstance(compiled.root, dice_engine.BinOp)
+    assert compiled.base == 0
+
+
+def test_real_powers_still_work():
+    assert dice_engine.evaluate_expression("(-8)**3") == -512
+    assert dice_engine.evaluate_expression("4**0.5") == 2.0
+    assert dice_engine.evaluate_expression("2**-1") == 0.5
+
+
+@pytest.mark.parametrize("expression, value", [
+    ("2+3*4", 14),
+    ("(2+3)*4", 20),
+    ("2**3**2", 512),
+    ("-2**2", -4),
+    ("2*-3", -6),
+    ("7//2", 3),
+    ("7%3", 1),
+    ("10/4", 2.5),
+    ("10-4-3", 3),
+])
+def test_precedence_and_constant_folding(expression, value):
+    compiled = dice_engine.compile_expression(expression)
+    assert isinstance(compiled.root, dice_engine.Num)
+    assert compiled.root.value == value
+    assert compiled.evaluate() == value
+
+
+def test_constant_parts_are_folded_around_dice():
+    compiled = dice_engine.compile_expression("1d6 + 2*3")
+    assert isinstance(compiled.root.left, dice_engine.Dice)
+    assert isinstance(compiled.root.right, dice_engine.Num)
+    assert compiled.root.right.value == 6
+    assert compiled.base == 6
+    assert dice_engine.parse_dice_expression("2d6-1d4+3") == (3, [(2, 6), (1, 4)], "2d6-1d4+3")
+
+
+def test_huge_power_is_left_unfolded():
+    compiled = dice_engine.compile_expression("9**9**9")
+    assert isinstance(compiled.root, dice_engine.BinOp)
+    assert compiled.base == 0
+
+
+def test_division_by_zero_is_reported_at_evaluation():
+    compiled = dice_engine.compile_expression("1//0")
+    assert isinstance(compiled.root, dice_engine.BinOp)
+    with pytest.raises(ZeroDivisionError):
+        compiled.evaluate()
+    assert dice_engine.evaluate_expression("1//0") is None
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("", "表达式为空"),
+    ("1+", "表达式不完整"),
+    ("(1", "括号不匹配"),
+    ("1)", "多余的内容"),
+    ("1d0", "骰子面数必须大于 0"),
+    ("1+1!", "无法识别的字符"),
+    ("(" * 33 + "1" + ")" * 33, "括号嵌套过深"),
+    ("1+" * 200 + "1", "表达式过长"),
+])
+def test_syntax_errors(expression, message):
+    with pytest.raises(dice_engine.DiceSyntaxError, match=message):
+        dice_engine.compile_expression(expression)
+
+
+def test_whitespace_is_normalized_for_the_cache():
+    assert dice_engine.compile_expression("1d6 + 2") is dice_engine.compile_expression("1d6+2")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1d20 攻击", ("1d20", "攻击")),
+    ("1d20 attack roll", ("1d20", "attack roll")),
+    ("1d20+str 偷袭", ("1d20+str", "偷袭")),
+    ("1d20 + str - 2 偷袭", ("1d20 + str - 2", "偷袭")),
+    ("(2d6 + 1d8) * 2 伤害", ("(2d6 + 1d8) * 2", "伤害")),
+    ("10d10 >= 8", ("10d10 >= 8", "")),
+    ("2 d6", ("2 d6", "")),
+    ("1d6 ** 1d6", ("1d6 ** 1d6", "")),
+    ("", ("", "")),
+])
+def test_split_label(text, expected):
+    assert dice_engine.split_label(text) == expected
+
+
+def test_batch_parts_drop_labels():
+    assert dice_engine.split_batch("2#1d6 伤害; 1d20+3 攻击") == [(2, "1d6"), (1, "1d20+3")]
@@ -0,0 +1,88 @@
+"""带修饰的骰池：保留/去掉、爆炸与成功计数"""
+import pytest
+
+from conftest import plugin_module
+
+dice_engine = plugin_module("dice_engine")
+dice_rng = plugin_module("dice_rng")
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    """大骰池分别走 numpy 向量化路径与逐个抽取的路径"""
+    if request.param == "python":
+        monkeypatch.setattr(dice_engine, "_NP_RNG", None)
+    elif dice_engine._NP_RNG is None:
+        pytest.skip("未安装 numpy")
+    return request.param
+
+
+def pool(expression: str):
+    root = dice_engine.compile_expression(expression).root
+    assert isinstance(root, dice_engine.DicePool)
+    return root
+
+
+@pytest.mark.parametrize("expression, keep, keep_n", [
+    ("4d6kh3", "h", 3),
+    ("4d6k", "h", 1),
+    ("4d6kl1", "l", 1),
+    ("4d6dl1", "h", 3),
+    ("4d6dh1", "l", 3),
+    ("4d6dl9", "h", 0),
+    ("4D6KH3", "h", 3),
+    ("4d6kh4", None, 4),
+])
+def test_keep_and_drop_are_normalized(expression, keep, keep_n):
+    parsed = pool(expression)
+    assert (parsed.keep, parsed.keep_n) == (keep, keep_n)
+
+
+@pytest.mark.parametrize("expression", ["4d6kh3", "4d6kl2", "4d6dl1", "5d10>=7", "5d10<3", "3d6!", "6d6!kh2>=10"])
+def test_small_pool_result_matches_its_rolls(expression):
+    parsed = pool(expression)
+    for seed in range(50):
+        result, values = parsed.roll(True, dice_rng.DiceRng(seed))
+        assert len(values) == parsed.count
+        kept = sorted(values, reverse=parsed.keep == "h")[:parsed.keep_n] if parsed.keep else values
+        if parsed.compare_func is not None:
+            assert result == sum(1 for value in kept if parsed.compare_func(value, parsed.target))
+        else:
+            assert result == sum(kept)
+        if parsed.explode:
+            # 爆炸骰的点数为若干个最大面加上一个非最大面的结果
+            assert all(0 < value % parsed.faces for value in values)
+
+
+def test_same_seed_repeats_the_same_pool():
+    parsed = pool("8d6!kh3")
+    assert [parsed.roll(True, dice_rng.DiceRng(7)) for _ in range(3)] == [parsed.roll(True, dice_rng.DiceRng(7))] * 3
+
+
+@pytest.mark.parametrize("expression, value", [
+    ("200d6kh1", 6),
+    ("200d6kl1", 1),
+    ("200d6dl199", 6),
+    ("200d6>=1", 200),
+    ("200d6<1", 0),
+    ("100d1!", 100 * (dice_engine._EXPLODE_MAX_DEPTH + 1)),
+    ("100d1!kh3", 3 * (dice_engine._EXPLODE_MAX_DEPTH + 1)),
+    ("100d1!>=21", 100),
+])
+def test_large_pool_semantics(engine, expression, value):
+    parsed = pool(expression)
+    assert parsed.roll(False)[0] == value
+    assert parsed.roll(False, dice_rng.DiceRng(1))[0] == value
+
+
+def test_large_pool_stays_in_range(engine):
+    parsed = pool("1000d20kh10")
+    for seed in range(5):
+        result, values = parsed.roll(False, dice_rng.DiceRng(seed))
+        assert values is None
+        assert 10 <= result <= 200
+
+
+def test_pool_size_is_limited():
+    with pytest.raises(dice_engine.DiceSyntaxError, match="骰池最多"):
+        dice_engine.compile_expression(f"{dice_engine._MAX_POOL_DICE + 1}d6kh1")
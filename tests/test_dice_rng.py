@@ -0,0 +1,63 @@
+"""dice_rng：分块求和与带种子的随机数流"""
+import tracemalloc
+
+import pytest
+
+from conftest import plugin_module
+
+dice_rng = plugin_module("dice_rng")
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(dice_rng, "np", None)
+    elif dice_rng.np is None:
+        pytest.skip("需要 numpy")
+    return request.param
+
+
+def test_total_matches_roll_sequence(engine):
+    count = 3 * dice_rng._CHUNK + 7
+    chunked = dice_rng.DiceRng(42)
+    single = dice_rng.DiceRng(42)
+    assert chunked.total(count, 6) == sum(single.roll(count, 6))
+    assert chunked.counter == single.counter
+
+
+def test_total_without_numpy_uses_constant_memory(monkeypatch):
+    monkeypatch.setattr(dice_rng, "np", None)
+    monkeypatch.setattr(dice_rng, "_CHUNK", 1024)
+    rng = dice_rng.DiceRng(1)
+    tracemalloc.start()
+    try:
+        rng.total(200_000, 6)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 一次性构造点数列表需要 1.6MB 以上
+    assert peak < 512 << 10
+
+
+def test_recreated_streams_do_not_repeat(engine):
+    streams = dice_rng.RngStreams("fixed-seed", max_streams=1)
+    first = streams.get("user_a").roll(20, 100)
+    streams.get("user_b")  # 淘汰 user_a 的流
+    assert streams.get("user_a").roll(20, 100) != first
+    # 重启（新的 RngStreams）后同样不重复
+    assert dice_rng.RngStreams("fixed-seed").get("user_a").roll(20, 100) != first
+
+
+def test_seeded_stream_is_replayable(engine):
+    streams = dice_rng.RngStreams("fixed-seed")
+    stream = streams.get("user_a")
+    assert stream.nonce
+    assert stream.seed == streams.derive_seed("user_a", stream.nonce)
+    stream.roll(5, 20)
+    counter = stream.counter
+    values = stream.roll(3, 20)
+    assert dice_rng.DiceRng(stream.seed, counter).roll(3, 20) == values
+
+
+def test_unseeded_streams_have_no_nonce():
+    assert dice_rng.RngStreams().get("user_a").nonce == ""
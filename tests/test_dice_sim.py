@@ -0,0 +1,85 @@
+"""dice_sim：无效试验（除零、溢出等）的排除与失败分片的处理"""
+import time
+
+import pytest
+
+from conftest import Event, collect, plugin_module
+
+dice_sim = plugin_module("dice_sim")
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(dice_sim, "np", None)
+    elif dice_sim.np is None:
+        pytest.skip("需要 numpy")
+    return request.param
+
+
+@pytest.mark.parametrize("expression", ["1d6//(1d2-1)", "1d6%(1d2-1)", "1d6/(1d2-1)"])
+def test_division_by_zero_is_excluded(engine, expression):
+    counts, done, invalid = dice_sim.run_trials(expression, 4000, 7, time.time() + 60)
+    assert done + invalid == 4000
+    assert sum(counts.values()) == done
+    # 除数为 1 时 1d6//1、1d6/1 都在 1~6 之间，1d6%1 恒为 0
+    assert 1000 < invalid < 3000
+    if "%" not in expression:
+        assert min(counts) >= 1
+
+
+def test_non_real_powers_are_excluded(engine):
+    counts, done, invalid = dice_sim.run_trials("(1d2-2)**0.5", 2000, 7, time.time() + 60)
+    assert set(counts) == {0}
+    assert done + invalid == 2000 and invalid > 0
+
+
+def test_failed_shards_are_reported(run, monkeypatch):
+    original = dice_sim.run_trials
+    calls = []
+
+    def flaky(expression, trials, seed, deadline):
+        calls.append(trials)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return original(expression, trials, seed, deadline)
+
+    monkeypatch.setattr(dice_sim, "run_trials", flaky)
+    result = run(dice_sim.simulate("1d6", 40_000, None, 4, 10))
+    assert len(result.errors) == 1 and "boom" in result.errors[0]
+    assert result.trials == 30_000
+    assert result.truncated
+
+
+def test_all_shards_failing_raises(run, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(dice_sim, "run_trials", broken)
+    with pytest.raises(RuntimeError, match="boom"):
+        run(dice_sim.simulate("1d6", 40_000, None, 2, 10))
+
+
+def test_int64_overflow_is_excluded(engine):
+    expression = "1d1000000*1d1000000*1d1000000*1d1000000"
+    counts, done, invalid = dice_sim.run_trials(expression, 2000, 7, time.time() + 60)
+    assert done + invalid == 2000
+    # numpy 下回绕的结果不计入统计（纯 Python 的整数不会溢出）
+    assert all(value > 0 for value in counts)
+    if engine == "numpy":
+        assert invalid > 1900
+
+
+@pytest.mark.parametrize("expression", ["1d6*2**100", "1d6+2**2000", "(1d6-7)*2**70"])
+def test_constants_beyond_int64(engine, expression):
+    counts, done, invalid = dice_sim.run_trials(expression, 500, 7, time.time() + 60)
+    assert done + invalid == 500
+    sign = -1 if expression.startswith("(") else 1
+    assert all(value * sign > 0 for value in counts)
+
+
+def test_sim_command_does_not_report_wrapped_products(make_plugin, run):
+    plugin = make_plugin(sim_workers=0)
+    message = run(collect(plugin.roll_dice, Event("/r sim 2000 1d1000000*1d1000000*1d1000000*1d1000000")))[0]
+    assert "均值 -" not in message
+    assert "=-" not in message
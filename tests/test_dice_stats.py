@@ -0,0 +1,45 @@
+"""dice_stats 与 /r stats 的目标值解析"""
+import pytest
+
+from conftest import Event, collect, plugin_module
+
+main = plugin_module("main")
+dice_engine = plugin_module("dice_engine")
+dice_stats = plugin_module("dice_stats")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("3d6+2 14", ("3d6+2", 14.0)),
+    ("3d6+2>=14", ("3d6+2", 14.0)),
+    ("3d6+2 ≥ 14", ("3d6+2", 14.0)),
+    ("(10d10)>=8", ("(10d10)", 8.0)),
+    ("10d10 8", ("10d10", 8.0)),
+    ("3d6", ("3d6", None)),
+    # 成功计数骰池的 >= 不是目标值
+    ("10d10>=8", ("10d10>=8", None)),
+    ("10d10 >= 8", ("10d10 >= 8", None)),
+    ("4d6kh3>=12", ("4d6kh3>=12", None)),
+    # 成功计数没有意义时按总和的目标值处理
+    ("3d6>=14", ("3d6", 14.0)),
+    ("1d20>=15", ("1d20", 15.0)),
+])
+def test_split_stats_target(text, expected):
+    assert main.MyPlugin._split_stats_target(text) == expected
+
+
+def test_success_pool_is_not_answered_as_a_sum(plugin, run):
+    message = run(collect(plugin.roll_dice, Event("/r stats 10d10>=8")))[0]
+    assert "P(≥8) = 100" not in message
+    assert "/r stats 10d10 8" in message
+
+
+def test_sum_target_for_plain_dice(plugin, run):
+    message = run(collect(plugin.roll_dice, Event("/r stats 3d6>=14")))[0]
+    assert "P(≥14) = 16.20%" in message
+
+
+def test_exact_distribution():
+    stats = dice_stats.describe_expression(dice_engine.compile_expression("2d6"), 7)
+    assert stats.mean == 7
+    assert stats.min == 2 and stats.max == 12
+    assert stats.prob_at_least == pytest.approx(21 / 36)
@@ -0,0 +1,71 @@
+"""dice_engine.summarize_dice：大批量投掷的汇总在各抽取路径下一致"""
+import pytest
+
+from conftest import plugin_module
+
+dice_engine = plugin_module("dice_engine")
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    """分别走 numpy 抽取与纯 Python 分块抽取的路径"""
+    if request.param == "python":
+        monkeypatch.setattr(dice_engine, "_NP_RNG", None)
+    elif dice_engine._NP_RNG is None:
+        pytest.skip("未安装 numpy")
+    # 缩小分块，使几千个骰子也会跨越多个块
+    monkeypatch.setattr(dice_engine, "_STREAM_CHUNK", 1000)
+    return request.param
+
+
+def check(summary, count, faces):
+    assert summary.count == count
+    assert summary.faces == faces
+    assert 1 <= summary.min <= summary.max <= faces
+    assert count * summary.min <= summary.total <= count * summary.max
+
+
+@pytest.mark.parametrize("faces", [6, 100, 5000, 10 ** 30])
+def test_summary_bounds(engine, faces):
+    summary = dice_engine.summarize_dice(4321, faces)
+    check(summary, 4321, faces)
+    assert summary.histogram is None
+    assert summary.values is None
+
+
+@pytest.mark.parametrize("faces", [6, 5000])
+def test_histogram_matches_total(engine, faces):
+    summary = dice_engine.summarize_dice(4321, faces, histogram=True)
+    check(summary, 4321, faces)
+    hist = summary.histogram
+    assert sum(hist.values()) == 4321
+    assert sum(face * n for face, n in hist.items()) == summary.total
+    assert min(hist) == summary.min and max(hist) == summary.max
+
+
+def test_keep_values(engine):
+    summary = dice_engine.summarize_dice(200, 20, keep_values=True, histogram=True)
+    check(summary, 200, 20)
+    assert len(summary.values) == 200
+    assert sum(summary.values) == summary.total
+    assert summary.histogram == {face: summary.values.count(face) for face in set(summary.values)}
+
+
+def test_small_count_keeps_no_values_unless_asked(engine):
+    summary = dice_engine.summarize_dice(3, 6)
+    check(summary, 3, 6)
+    assert summary.values is None
+
+
+def test_zero_dice(engine):
+    summary = dice_engine.summarize_dice(0, 6)
+    assert (summary.total, summary.min, summary.max) == (0, None, None)
+
+
+def test_huge_faces_do_not_overflow(engine):
+    faces = (1 << 62) - 1
+    summary = dice_engine.summarize_dice(5000, faces)
+    check(summary, 5000, faces)
+    # 5000 个骰子的总和远超 int64，应以 Python 整数精确累加
+    assert isinstance(summary.total, int)
+    assert summary.total > 1 << 63
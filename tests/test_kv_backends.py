@@ -0,0 +1,65 @@
+"""KV 后端：写入、重新打开后读回、迁移与损坏文件处理"""
+import json
+
+import pytest
+
+from conftest import plugin_module
+
+kv_store = plugin_module("kv_store")
+
+DELETED = kv_store.DELETED
+KINDS = ("json", "sqlite")
+
+# 覆盖中文键、大整数、浮点、嵌套列表与对象、需要转义的 storage_id
+DATA = {
+    "user_1": {"力量": 16, "hp": 12, "exp": 2 ** 70, "ratio": 0.5, "背包": ["绳子", {"金币": 30}], "note": "a\nb"},
+    "group_g/1": {"dc": 15, "scene": "酒馆"},
+}
+
+
+def reopen(kind: str, tmp_path, **kwargs):
+    backend = kv_store.create_backend(kind, tmp_path, **kwargs)
+    backend.open()
+    return backend
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_round_trip(kind, tmp_path):
+    backend = reopen(kind, tmp_path)
+    backend.write(DATA)
+    backend.write({"user_1": {"hp": 7, "note": DELETED}, "group_g/1": {"dc": DELETED, "scene": DELETED}})
+    backend.close()
+
+    backend = reopen(kind, tmp_path)
+    expected = {key: value for key, value in DATA["user_1"].items() if key != "note"}
+    expected["hp"] = 7
+    assert backend.load("user_1") == expected
+    assert backend.load("group_g/1") == {}
+    assert backend.load("user_missing") == {}
+    assert backend.get("user_1", "exp") == 2 ** 70
+    assert backend.get("user_1", "missing", "默认") == "默认"
+    assert backend.scan_prefix("user_1", "h") == {"hp": 7}
+    backend.close()
+
+
+def migrate(kind: str, tmp_path):
+    """写入旧的 kv.json 后打开 kind 后端，检查数据已迁移、原文件改名保留"""
+    (tmp_path / "kv.json").write_text(json.dumps(DATA, ensure_ascii=False), encoding="utf-8")
+    backend = reopen(kind, tmp_path)
+    assert {storage_id: backend.load(storage_id) for storage_id in DATA} == DATA
+    backend.close()
+    assert not (tmp_path / "kv.json").exists()
+    assert (tmp_path / "kv.json.migrated").exists()
+
+
+def test_sqlite_migrates_existing_kv_json(tmp_path):
+    migrate("sqlite", tmp_path)
+
+
+def test_corrupt_snapshot_is_kept_aside(tmp_path):
+    (tmp_path / "kv.json").write_text("{不是 JSON", encoding="utf-8")
+    backend = reopen("json", tmp_path)
+    assert backend.load("user_1") == {}
+    assert list(tmp_path.glob("kv.json.corrupt-*"))
+    backend.write({"user_1": {"hp": 1}})
+    assert reopen("json", tmp_path).load("user_1") == {"hp": 1}
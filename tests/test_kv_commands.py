@@ -0,0 +1,65 @@
+"""/kv 指令：导出上限、导入的原子性与数值增减"""
+import json
+
+from conftest import Event, collect, plugin_module
+
+main = plugin_module("main")
+
+
+def test_export_over_limit_points_to_file(plugin, run, monkeypatch):
+    monkeypatch.setattr(main, "_KV_EXPORT_MAX_KEYS", 2)
+    run(collect(plugin.kv_command, Event('/kv import {"a": 1, "b": 2}')))
+    messages = run(collect(plugin.kv_command, Event("/kv export")))
+    assert json.loads(messages[1]) == {"a": 1, "b": 2}
+
+    run(collect(plugin.kv_command, Event('/kv import {"c": 3}')))
+    messages = run(collect(plugin.kv_command, Event("/kv export")))
+    assert len(messages) == 1
+    assert "/kv export file" in messages[0]
+    messages = run(collect(plugin.kv_command, Event("/kv export file")))
+    assert messages[0].startswith("已导出 3 项")
+
+
+def test_malformed_import_changes_nothing(plugin, run):
+    run(collect(plugin.kv_command, Event('/kv import {"a": 1}')))
+    reply = run(collect(plugin.kv_command, Event('/kv import replace {"b": 2} {"c": tru}')))[0]
+    assert reply.startswith("导入失败")
+    messages = run(collect(plugin.kv_command, Event("/kv export")))
+    assert json.loads(messages[1]) == {"a": 1}
+
+
+def test_import_round_trips_a_multi_message_export(plugin, run, monkeypatch):
+    monkeypatch.setattr(main, "_KV_EXPORT_CHUNK", 40)
+    data = {f"key{i:02d}": {"值": i, "列表": [i, str(i)]} for i in range(10)}
+    run(collect(plugin.kv_command, Event(f"/kv import {json.dumps(data, ensure_ascii=False)}")))
+    chunks = run(collect(plugin.kv_command, Event("/kv export")))[1:]
+    assert len(chunks) > 1
+    run(collect(plugin.kv_command, Event("/kv import replace " + "\n".join(chunks))))
+    exported = {}
+    for chunk in run(collect(plugin.kv_command, Event("/kv export")))[1:]:
+        exported.update(json.loads(chunk))
+    assert exported == data
+
+
+def test_add_applies_deltas_and_bounds(plugin, run):
+    run(collect(plugin.kv_command, Event("/kv set 生命 10")))
+    assert run(collect(plugin.kv_command, Event("/kv add 生命 -3"))) == ["已更新: 生命 10 → 7"]
+    run(collect(plugin.kv_command, Event("/kv add 生命-20 经验+5 min=0")))
+    assert run(plugin.kv_read(Event(""), "生命")) == "0"
+    assert run(plugin.kv_read(Event(""), "经验")) == "5"
+    run(plugin.kv_update(Event(""), key="经验", delta=100, max_value=30))
+    assert run(plugin.kv_read(Event(""), "经验")) == "30"
+
+
+def test_add_rejects_min_above_max(plugin, run):
+    run(collect(plugin.kv_command, Event("/kv set hp 8")))
+    reply = run(collect(plugin.kv_command, Event("/kv add hp -5 min=10 max=3")))[0]
+    assert reply == "错误: 下限 10 大于上限 3"
+    assert run(plugin.kv_update(Event(""), key="hp", delta=1, min_value=5, max_value=1)).startswith("错误: 下限")
+    assert run(plugin.kv_read(Event(""), "hp")) == "8"
+
+
+def test_add_rejects_non_numeric_values(plugin, run):
+    run(collect(plugin.kv_command, Event("/kv set 名字 阿尔")))
+    reply = run(collect(plugin.kv_command, Event("/kv add 名字 1")))[0]
+    assert reply.startswith("错误: 键 '名字' 的值不是数字")
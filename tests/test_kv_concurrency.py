@@ -0,0 +1,102 @@
+"""KVStore 并发：后端调用不在事件循环线程中，每个 storage_id 独立加锁"""
+import asyncio
+import threading
+import time
+
+from conftest import Event, collect, plugin_module
+from test_kv_store import MemoryBackend, make_store
+
+kv_store = plugin_module("kv_store")
+
+
+class SlowBackend(MemoryBackend):
+    """load 较慢的内存后端，记录每次载入的 storage_id 与所在线程"""
+
+    def __init__(self, delay=0.02):
+        super().__init__()
+        self.delay = delay
+        self.loads = []
+        self.threads = set()
+
+    def load(self, storage_id):
+        self.loads.append(storage_id)
+        self.threads.add(threading.current_thread())
+        time.sleep(self.delay)
+        return super().load(storage_id)
+
+
+def test_backend_runs_off_the_event_loop_thread(run):
+    backend = SlowBackend()
+    store = make_store(backend)
+
+    async def scenario():
+        await store.set("user_a", "hp", 1)
+        await store.close()
+
+    run(scenario())
+    assert threading.current_thread() not in backend.threads
+
+
+def test_concurrent_loads_read_the_storage_once(run):
+    backend = SlowBackend()
+    backend.data = {"user_a": {"hp": 1}}
+    store = make_store(backend)
+
+    async def scenario():
+        storages = await asyncio.gather(*(store.get_storage("user_a") for _ in range(10)))
+        assert all(storage == {"hp": 1} for storage in storages)
+        await store.close()
+
+    run(scenario())
+    assert backend.loads == ["user_a"]
+
+
+def test_concurrent_updates_are_not_lost(run):
+    backend = SlowBackend()
+    backend.data = {"user_a": {"hp": 0}}
+    store = make_store(backend)
+
+    async def scenario():
+        await asyncio.gather(
+            *(store.update_numeric("user_a", {"hp": 1}) for _ in range(50)),
+            *(store.set("user_a", f"k{i}", i) for i in range(20)),
+        )
+        storage = await store.get_storage("user_a")
+        assert storage["hp"] == 50
+        assert all(storage[f"k{i}"] == i for i in range(20))
+        await store.close()
+
+    run(scenario())
+    assert backend.data["user_a"]["hp"] == 50
+
+
+def test_lock_is_per_storage_id(run):
+    store = make_store(SlowBackend(delay=0))
+
+    async def scenario():
+        assert store.lock("user_a") is store.lock("user_a")
+        assert store.lock("user_a") is not store.lock("user_b")
+        async with store.lock("user_a"):
+            # 另一个 storage_id 不需要等待
+            await asyncio.wait_for(store.set("user_b", "hp", 1), 1)
+            blocked = asyncio.ensure_future(store.set("user_a", "hp", 1))
+            await asyncio.sleep(0.05)
+            assert not blocked.done()
+        await asyncio.wait_for(blocked, 1)
+        assert await store.get("user_a", "hp") == 1
+        await store.close()
+
+    run(scenario())
+
+
+def test_concurrent_upserts_and_adds_through_the_plugin(plugin, run):
+    async def scenario():
+        await asyncio.gather(
+            *(plugin.kv_upsert(Event(""), multi=f"{chr(0x4E00 + i)}{i}") for i in range(20)),
+            *(collect(plugin.kv_command, Event("/kv add 金币 1")) for _ in range(20)),
+        )
+        return await plugin._kv.get_storage(plugin._get_storage_id("user", Event("")))
+
+    items = run(scenario())
+    assert items["金币"] == 20
+    assert all(items[chr(0x4E00 + i)] == i for i in range(20))
@@ -0,0 +1,36 @@
+"""journal 后端：追加写入、压缩与崩溃后重放"""
+from conftest import plugin_module
+from test_kv_backends import DATA, reopen
+
+kv_store = plugin_module("kv_store")
+
+
+def test_round_trip(tmp_path):
+    backend = reopen("journal", tmp_path)
+    backend.write(DATA)
+    backend.write({"user_1": {"hp": 7, "note": kv_store.DELETED}, "group_g/1": {"dc": kv_store.DELETED}})
+    backend.close()
+
+    backend = reopen("journal", tmp_path)
+    expected = {key: value for key, value in DATA["user_1"].items() if key != "note"}
+    expected["hp"] = 7
+    assert backend.load("user_1") == expected
+    assert backend.load("group_g/1") == {"scene": "酒馆"}
+    assert backend.get("user_1", "exp") == 2 ** 70
+    backend.close()
+
+
+def test_journal_replays_after_compaction_and_torn_line(tmp_path):
+    backend = reopen("journal", tmp_path, journal_compact_bytes=200)
+    for i in range(20):
+        backend.write({"user_1": {"hp": i, f"k{i}": i}})
+    backend.close()
+    # 模拟崩溃时写了一半的末行
+    with open(tmp_path / "kv.journal", "a", encoding="utf-8") as f:
+        f.write('{"s": "user_1", "k": "hp", "v"')
+    backend = reopen("journal", tmp_path)
+    assert backend.get("user_1", "hp") == 19
+    assert len(backend.load("user_1")) == 21
+    backend.write({"user_1": {"hp": 20}})
+    backend.close()
+    assert reopen("journal", tmp_path).get("user_1", "hp") == 20
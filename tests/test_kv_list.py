@@ -0,0 +1,127 @@
+"""KV 分页：list_page、/kv list 与 kv_list 工具"""
+import json
+
+import pytest
+
+from conftest import Event, collect
+from test_kv_store import MemoryBackend, make_store
+
+# 50 个键，按键名排序后为 a00..a24、b00..b24
+KEYS = [f"{prefix}{i:02d}" for prefix in "ab" for i in range(25)]
+
+
+@pytest.fixture
+def store(run):
+    backend = MemoryBackend()
+    backend.data = {"user_a": {key: i for i, key in enumerate(reversed(KEYS))}}
+    store = make_store(backend)
+    yield store
+    run(store.close())
+
+
+def test_cursor_walks_every_key_in_order(store, run):
+    async def scenario():
+        seen = []
+        cursor = None
+        while True:
+            page = await store.list_page("user_a", limit=7, cursor=cursor)
+            assert page.total == 50
+            seen += page.items
+            cursor = page.next_cursor
+            if cursor is None:
+                return seen
+
+    assert run(scenario()) == KEYS
+
+
+def test_prefix_and_offset(store, run):
+    page = run(store.list_page("user_a", prefix="b", limit=10, offset=20))
+    assert list(page.items) == [f"b{i:02d}" for i in range(20, 25)]
+    assert page.total == 25
+    assert page.next_cursor is None
+
+    page = run(store.list_page("user_a", prefix="a1", limit=5))
+    assert list(page.items) == [f"a1{i}" for i in range(5)]
+    assert (page.total, page.next_cursor) == (10, "a14")
+
+    page = run(store.list_page("user_a", prefix="c"))
+    assert (page.items, page.total, page.next_cursor) == ({}, 0, None)
+
+
+def test_index_follows_writes_and_deletes(store, run):
+    async def scenario():
+        await store.list_page("user_a")
+        await store.set("user_a", "a005", 1)
+        await store.delete("user_a", "a01")
+        page = await store.list_page("user_a", prefix="a0", limit=3)
+        assert list(page.items) == ["a00", "a005", "a02"]
+        assert page.total == 10
+
+    run(scenario())
+
+
+def test_cursor_survives_deleting_the_last_key_seen(store, run):
+    async def scenario():
+        page = await store.list_page("user_a", limit=3)
+        assert page.next_cursor == "a02"
+        await store.delete("user_a", "a02")
+        page = await store.list_page("user_a", limit=3, cursor=page.next_cursor)
+        assert list(page.items) == ["a03", "a04", "a05"]
+
+    run(scenario())
+
+
+def kv(plugin, run, text: str) -> str:
+    return run(collect(plugin.kv_command, Event(f"/kv {text}")))[0]
+
+
+@pytest.fixture
+def filled(plugin, run):
+    run(plugin._kv.update(plugin._get_storage_id("user", Event("")), {key: i for i, key in enumerate(KEYS)}))
+    return plugin
+
+
+def test_kv_list_pages(filled, run):
+    lines = kv(filled, run, "list").split("\n")
+    assert lines[0] == "第 1/3 页，共 50 项"
+    assert lines[1:21] == [f"a{i:02d} = {i}" for i in range(20)]
+    assert lines[-1] == "下一页: /kv list 2"
+
+    lines = kv(filled, run, "list 3").split("\n")
+    assert lines[0] == "第 3/3 页，共 50 项"
+    assert lines[1:] == [f"b{i:02d} = {i + 25}" for i in range(15, 25)]
+
+    lines = kv(filled, run, "list b 1").split("\n")
+    assert lines[0] == "第 1/2 页，共 25 项"
+    assert lines[-1] == "下一页: /kv list b 2"
+
+    assert kv(filled, run, "list 9") == "第 9 页没有数据，共 3 页"
+    assert kv(filled, run, "list c") == "未找到前缀为 'c' 的键值对"
+
+
+def test_kv_list_single_page_has_no_header(plugin, run):
+    kv(plugin, run, "set hp 10")
+    assert kv(plugin, run, "list") == "hp = 10"
+
+
+def test_kv_list_tool_cursor(filled, run):
+    seen = []
+    cursor = None
+    while True:
+        result = json.loads(run(filled.kv_list(Event(""), limit=20, cursor=cursor)))
+        assert result["total"] == 50
+        seen += result["items"]
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == KEYS
+
+    result = json.loads(run(filled.kv_list(Event(""), prefix="b2", limit="2")))
+    assert result == {"items": {"b20": 45, "b21": 46}, "total": 5, "next_cursor": "b21"}
+
+
+def test_kv_list_tool_limits(filled, run):
+    assert len(json.loads(run(filled.kv_list(Event(""))))["items"]) == 50
+    assert len(json.loads(run(filled.kv_list(Event(""), limit=0)))["items"]) == 1
+    assert len(json.loads(run(filled.kv_list(Event(""), limit="x")))["items"]) == 50
+    assert run(filled.kv_list(Event(""), prefix="c")) == "未找到前缀为 'c' 的键值对"
@@ -0,0 +1,160 @@
+"""KV 常驻预算（按最久未使用淘汰）与 sharded 后端"""
+import asyncio
+
+import pytest
+
+from conftest import Event, collect, plugin_module
+from test_kv_backends import DATA, migrate, reopen
+from test_kv_store import MemoryBackend
+
+kv_store = plugin_module("kv_store")
+
+
+class CountingBackend(MemoryBackend):
+    """记录每次载入的 storage_id"""
+
+    def __init__(self):
+        super().__init__()
+        self.loads = []
+
+    def load(self, storage_id):
+        self.loads.append(storage_id)
+        return super().load(storage_id)
+
+
+@pytest.fixture
+def backend():
+    backend = CountingBackend()
+    # 每个 storage 计 1 + 3 项
+    backend.data = {f"user_{i}": {"hp": i, "ac": 10 + i, "lv": 1} for i in range(5)}
+    return backend
+
+
+def make_store(backend, max_resident=10):
+    return kv_store.KVStore(backend, flush_delay=3600, max_resident=max_resident)
+
+
+def test_least_recently_used_storage_is_evicted(backend, run):
+    store = make_store(backend)
+
+    async def scenario():
+        await store.get_storage("user_0")
+        await store.get_storage("user_1")
+        # 访问 user_0 后，最久未使用的是 user_1
+        assert await store.get("user_0", "hp") == 0
+        await store.get_storage("user_2")
+        assert list(store._data) == ["user_0", "user_2"]
+        assert store._resident_entries == 8
+        assert store.version("user_1") is None
+        await store.close()
+
+    run(scenario())
+
+
+def test_evicted_storage_is_reloaded(backend, run):
+    store = make_store(backend)
+
+    async def scenario():
+        await store.set("user_0", "hp", 99)
+        await store.flush()
+        await store.get_storage("user_1")
+        await store.get_storage("user_2")
+        assert "user_0" not in store._data
+        # 未常驻时单键读取直接交给后端，不会重新常驻
+        assert await store.get("user_0", "hp") == 99
+        assert "user_0" not in store._data
+        assert await store.get_storage("user_0") == {"hp": 99, "ac": 10, "lv": 1}
+        assert list(store._data) == ["user_2", "user_0"]
+        await store.close()
+
+    run(scenario())
+    # 后端的单键读取（KVBackend.get）与重新常驻各读取一次 user_0
+    assert backend.loads == ["user_0", "user_1", "user_2", "user_0", "user_0"]
+
+
+def test_dirty_storage_is_evicted_only_after_flush(backend, run):
+    store = make_store(backend)
+
+    async def scenario():
+        await store.set("user_0", "hp", 50)
+        await store.set("user_1", "hp", 51)
+        await store.get_storage("user_2")
+        # user_0、user_1 未落盘，不能淘汰，超出预算时在后台落盘
+        assert list(store._data) == ["user_0", "user_1", "user_2"]
+        assert store._flush_task is not None
+        await store._flush_task
+        assert list(store._data) == ["user_1", "user_2"]
+        assert backend.data["user_0"]["hp"] == 50
+        await store.close()
+
+    run(scenario())
+
+
+def test_locked_storage_is_not_evicted(backend, run):
+    store = make_store(backend)
+
+    async def scenario():
+        await store.get_storage("user_0")
+        async with store.lock("user_0"):
+            await store.get_storage("user_1")
+            await store.get_storage("user_2")
+            assert "user_0" in store._data
+        await store.close()
+
+    run(scenario())
+
+
+def test_unlimited_by_default(backend, run):
+    store = make_store(backend, max_resident=0)
+
+    async def scenario():
+        for i in range(5):
+            await store.get_storage(f"user_{i}")
+        assert len(store._data) == 5
+        assert store._resident_entries == 20
+        await store.close()
+
+    run(scenario())
+
+
+def test_concurrent_access_under_a_small_budget(backend, run):
+    store = make_store(backend, max_resident=4)
+
+    async def scenario():
+        await asyncio.gather(*(
+            store.update_numeric(f"user_{i % 5}", {"hp": 1}) for i in range(50)
+        ))
+        await store.close()
+
+    run(scenario())
+    assert [backend.data[f"user_{i}"]["hp"] for i in range(5)] == [10, 11, 12, 13, 14]
+
+
+def test_cache_summary_in_metrics_command(make_plugin, run):
+    plugin = make_plugin(kv_max_resident=3)
+    for user in ("u1", "u2", "u3"):
+        run(collect(plugin.kv_command, Event("/kv set hp 1", user_id=user)))
+    run(plugin._kv.flush())
+    message = run(collect(plugin.dice_admin, Event("/dice metrics")))[0]
+    assert "KV 常驻: 1 个存储空间 / 2 项（上限 3）" in message
+
+
+def test_sharded_round_trip(tmp_path):
+    backend = reopen("sharded", tmp_path)
+    backend.write(DATA)
+    backend.write({"group_g/1": {"dc": kv_store.DELETED, "scene": kv_store.DELETED}})
+    backend.close()
+    # 每个 storage_id 一个分片，变空的分片被删除
+    assert [p.name for p in (tmp_path / "kv_shards").iterdir()] == ["user_1.json"]
+
+    backend = reopen("sharded", tmp_path)
+    assert backend.load("user_1") == DATA["user_1"]
+    assert backend.load("group_g/1") == {}
+    assert backend.get("user_1", "exp") == 2 ** 70
+    assert backend.scan_prefix("user_1", "h") == {"hp": 12}
+    backend.close()
+
+
+def test_sharded_migrates_existing_kv_json(tmp_path):
+    migrate("sharded", tmp_path)
+    assert len(list((tmp_path / "kv_shards").iterdir())) == len(DATA)
@@ -0,0 +1,103 @@
+"""kv_snapshot：各编码与压缩的快照读写、格式识别与损坏处理"""
+import zlib
+
+import pytest
+
+from conftest import plugin_module
+from test_kv_backends import DATA, reopen
+
+kv_store = plugin_module("kv_store")
+kv_snapshot = plugin_module("kv_snapshot")
+
+
+def formats() -> list:
+    """已安装依赖的 (编码, 压缩) 组合"""
+    names = []
+    for codec in kv_snapshot.CODECS:
+        for compression in kv_snapshot.COMPRESSIONS:
+            try:
+                kv_snapshot.SnapshotFormat(codec, compression)
+            except kv_snapshot.SnapshotDependencyError:
+                continue
+            names.append((codec, compression))
+    return names
+
+
+@pytest.mark.parametrize("kind", ("json", "journal", "sharded"))
+@pytest.mark.parametrize("codec, compression", formats())
+def test_round_trip_in_every_snapshot_format(kind, codec, compression, tmp_path):
+    fmt = kv_snapshot.SnapshotFormat(codec, compression)
+    # journal 每次写入后都压缩为快照
+    backend = reopen(kind, tmp_path, journal_compact_bytes=1, fmt=fmt)
+    backend.write(DATA)
+    backend.close()
+    backend = reopen(kind, tmp_path)
+    assert {storage_id: backend.load(storage_id) for storage_id in DATA} == DATA
+    backend.close()
+
+
+def test_text_json_has_no_header():
+    raw = kv_snapshot.TEXT_JSON.encode(DATA)
+    assert raw.lstrip().startswith(b"{")
+    assert kv_snapshot.detect(raw) is kv_snapshot.TEXT_JSON
+    assert kv_snapshot.decode(raw) == DATA
+
+
+def test_binary_header_is_detected():
+    raw = kv_snapshot.SnapshotFormat("json", "zlib").encode(DATA)
+    assert raw[:4] == kv_snapshot.MAGIC
+    fmt = kv_snapshot.detect(raw)
+    assert (fmt.codec, fmt.compression, str(fmt)) == ("json", "zlib", "json+zlib")
+    assert kv_snapshot.decode(raw) == DATA
+
+
+def test_switching_format_reads_the_old_file(tmp_path):
+    backend = reopen("json", tmp_path)
+    backend.write(DATA)
+    backend.close()
+    # 改为二进制格式后仍能读取旧的文本快照，下次写入时转换
+    backend = reopen("json", tmp_path, fmt=kv_snapshot.SnapshotFormat("json", "zlib"))
+    assert backend.load("user_1") == DATA["user_1"]
+    backend.write({"user_1": {"hp": 1}})
+    backend.close()
+    assert (tmp_path / "kv.json").read_bytes()[:4] == kv_snapshot.MAGIC
+    assert reopen("json", tmp_path).load("user_1")["hp"] == 1
+
+
+@pytest.mark.parametrize("raw, message", [
+    (kv_snapshot.MAGIC + b"\x01", "文件头不完整"),
+    (kv_snapshot.MAGIC + b"\x09\x00\x00\x00{}", "不支持的快照版本 9"),
+    (kv_snapshot.MAGIC + b"\x01\x07\x00\x00{}", "未知的快照编码 7"),
+    (kv_snapshot.MAGIC + b"\x01\x00\x01\x00not zlib", "快照解析失败"),
+    (kv_snapshot.MAGIC + b"\x01\x00\x01\x00" + zlib.compress(b"[1]"), "顶层应为对象"),
+    (b"[1, 2]", "顶层应为对象"),
+])
+def test_invalid_snapshots(raw, message):
+    with pytest.raises(kv_snapshot.SnapshotError, match=message):
+        kv_snapshot.decode(raw)
+
+
+def test_unknown_format_name():
+    with pytest.raises(kv_snapshot.SnapshotError, match="未知的快照编码"):
+        kv_snapshot.SnapshotFormat("yaml")
+    with pytest.raises(kv_snapshot.SnapshotError, match="未知的快照压缩方式"):
+        kv_snapshot.SnapshotFormat("json", "lz4")
+
+
+def test_missing_dependency_keeps_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(kv_snapshot, "msgpack", None)
+    path = tmp_path / "kv.json"
+    path.write_bytes(kv_snapshot.MAGIC + b"\x01\x01\x00\x00payload")
+    with pytest.raises(kv_snapshot.SnapshotDependencyError, match="msgpack"):
+        kv_store.read_snapshot(path)
+    # 不是数据损坏，原文件不应被改名
+    assert path.exists()
+    assert not list(tmp_path.glob("kv.json.corrupt-*"))
+
+
+def test_corrupt_binary_snapshot_is_kept_aside(tmp_path):
+    path = tmp_path / "kv.json"
+    path.write_bytes(kv_snapshot.MAGIC + b"\x01\x00\x01\x00not zlib")
+    assert kv_store.read_snapshot(path) == {}
+    assert not path.exists()
+    assert list(tmp_path.glob("kv.json.corrupt-*"))
@@ -0,0 +1,151 @@
+"""kv_store：落盘失败时保留变更、落盘顺序、事务与导入解析"""
+import asyncio
+import threading
+
+import pytest
+
+from conftest import plugin_module
+
+kv_store = plugin_module("kv_store")
+
+
+class MemoryBackend(kv_store.KVBackend):
+    """内存后端，fail 中的异常依次在 write 时抛出（None 表示正常写入）"""
+
+    def __init__(self, fail=()):
+        self.data = {}
+        self.fail = list(fail)
+        self.writes = []
+        # load 时抛出 OSError 的 storage_id
+        self.broken = set()
+        # 设置后 write 先等待 release 再执行
+        self.release = None
+
+    def load(self, storage_id):
+        if storage_id in self.broken:
+            raise OSError(f"无法读取 {storage_id}")
+        return dict(self.data.get(storage_id, {}))
+
+    def write(self, changes):
+        if self.release is not None:
+            self.release.wait(5)
+            self.release = None
+        error = self.fail.pop(0) if self.fail else None
+        if error is not None:
+            raise error
+        self.writes.append(changes)
+        kv_store._apply_changes(self.data, changes)
+
+
+def make_store(backend):
+    return kv_store.KVStore(backend, flush_delay=3600)
+
+
+def test_flush_keeps_changes_when_write_raises(run):
+    backend = MemoryBackend(fail=[TypeError("无法编码")])
+    store = make_store(backend)
+
+    async def scenario():
+        await store.set("user_a", "hp", 10)
+        with pytest.raises(TypeError):
+            await store.flush()
+        assert store._dirty == {"user_a": {"hp": 10}}
+        assert not store._in_flight
+        await store.set("user_a", "ac", 15)
+        await store.close()
+
+    run(scenario())
+    assert backend.data == {"user_a": {"hp": 10, "ac": 15}}
+
+
+def test_failed_batch_does_not_overwrite_later_write(run):
+    backend = MemoryBackend(fail=[OSError("磁盘已满")])
+    store = make_store(backend)
+
+    async def scenario():
+        await store.set("user_a", "hp", 1)
+        backend.release = threading.Event()
+        first = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0.01)
+        await store.set("user_a", "hp", 2)
+        second = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0.01)
+        backend.release.set()
+        await asyncio.gather(first, second)
+        assert backend.data == {"user_a": {"hp": 2}}
+        await store.close()
+
+    run(scenario())
+    assert backend.data == {"user_a": {"hp": 2}}
+    assert all(changes["user_a"]["hp"] == 2 for changes in backend.writes)
+
+
+def test_transaction_is_written_once(run):
+    backend = MemoryBackend()
+    backend.data = {"user_a": {"hp": 1, "ac": 10}, "group_g": {"dc": 12}}
+    store = make_store(backend)
+
+    async def scenario():
+        await store.transaction(
+            {"user_a": {"hp": 5}, "group_g": {"dc": kv_store.DELETED, "scene": "酒馆"}},
+            replace=["user_a"],
+        )
+        assert await store.get_storage("user_a") == {"hp": 5}
+        assert await store.get_storage("group_g") == {"scene": "酒馆"}
+        await store.close()
+
+    run(scenario())
+    assert len(backend.writes) == 1
+    assert backend.data == {"user_a": {"hp": 5}, "group_g": {"scene": "酒馆"}}
+
+
+def test_transaction_applies_nothing_when_a_storage_fails_to_load(run):
+    backend = MemoryBackend()
+    backend.data = {"user_a": {"hp": 1}}
+    backend.broken.add("user_b")
+    store = make_store(backend)
+
+    async def scenario():
+        with pytest.raises(OSError):
+            await store.transaction({"user_a": {"hp": 5}, "user_b": {"hp": 5}})
+        assert await store.get_storage("user_a") == {"hp": 1}
+        assert not store._dirty
+        await store.close()
+
+    run(scenario())
+    assert backend.writes == []
+
+
+def test_non_durable_transaction_waits_for_flush(run):
+    backend = MemoryBackend()
+    store = make_store(backend)
+
+    async def scenario():
+        await store.transaction({"user_a": {"hp": 5}}, durable=False)
+        assert backend.writes == []
+        await store.flush()
+        assert backend.data == {"user_a": {"hp": 5}}
+        await store.close()
+
+    run(scenario())
+
+
+def test_iter_json_items_reads_concatenated_objects():
+    text = ' {"a": 1, "b": [1, {"c": null}]}\n{} {"a": 2, "中文": "值"} '
+    assert list(kv_store.iter_json_items(text)) == [("a", 1), ("b", [1, {"c": None}]), ("a", 2), ("中文", "值")]
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "没有数据"),
+    ("  \n", "没有数据"),
+    ("[1]", "应为 JSON 对象"),
+    ('{"a": 1} x', "应为 JSON 对象"),
+    ("{a: 1}", "应为键名"),
+    ('{"a": 1,}', "应为键名"),
+    ('{"a" 1}', "应为冒号"),
+    ('{"a": 1', "应为逗号或右花括号"),
+    ('{"a": tru}', "Expecting value"),
+])
+def test_iter_json_items_rejects_malformed_input(text, message):
+    with pytest.raises(ValueError, match=message):
+        list(kv_store.iter_json_items(text))
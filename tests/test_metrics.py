@@ -0,0 +1,165 @@
+"""metrics：直方图、计时装饰器、慢表达式采样与 Prometheus 输出"""
+import inspect
+import re
+
+import pytest
+
+from conftest import Event, collect, plugin_module
+
+metrics = plugin_module("metrics")
+
+
+def test_histogram_buckets_and_quantiles():
+    h = metrics.Histogram()
+    for value in (0.5e-6, 3e-6, 3e-6, 1e-3, 100.0):
+        h.observe(value)
+    assert h.count == 5
+    assert h.sum == pytest.approx(100.0010065)
+    assert h.max == 100.0
+    # 1µs、4µs 两档各自的计数，以及超过最后一档的溢出桶
+    assert h.counts[0] == 1
+    assert h.counts[2] == 2
+    assert h.counts[-1] == 1
+    assert sum(h.counts) == 5
+    assert h.quantile(0.5) == pytest.approx(4e-6)
+    assert h.quantile(1.0) == 100.0
+    h.clear()
+    assert (h.count, h.sum, h.max, sum(h.counts)) == (0, 0.0, 0.0, 0)
+
+
+def test_quantile_does_not_exceed_max():
+    h = metrics.Histogram()
+    h.observe(5e-6)
+    assert h.quantile(0.99) == 5e-6
+
+
+def test_timed_records_sync_async_and_generators(run):
+    registry = metrics.Metrics()
+
+    @registry.timed("sync")
+    def add(a, b=1):
+        """加法"""
+        return a + b
+
+    @registry.timed("coro")
+    async def fetch(x):
+        return x * 2
+
+    @registry.timed("agen")
+    async def items(n):
+        for i in range(n):
+            yield i
+
+    async def consume():
+        return [i async for i in items(3)]
+
+    assert add(1) == 2
+    assert run(fetch(4)) == 8
+    assert run(consume()) == [0, 1, 2]
+    assert {name: h.count for name, h in registry.histograms.items()} == {"sync": 1, "coro": 1, "agen": 1}
+    # llm_tool 依赖签名与文档解析参数
+    assert str(inspect.signature(add)) == "(a, b=1)"
+    assert add.__doc__ == "加法"
+
+
+def test_timed_counts_errors(run):
+    registry = metrics.Metrics()
+
+    @registry.timed("coro")
+    async def fail():
+        raise KeyError("x")
+
+    @registry.timed("agen")
+    async def fail_later():
+        yield 1
+        raise ValueError("x")
+
+    async def consume():
+        return [i async for i in fail_later()]
+
+    with pytest.raises(KeyError):
+        run(fail())
+    with pytest.raises(ValueError):
+        run(consume())
+    assert registry.counters == {"coro.errors": 1, "agen.errors": 1}
+    assert registry.histograms["coro"].count == registry.histograms["agen"].count == 1
+
+
+def test_reset_keeps_decorated_histograms():
+    registry = metrics.Metrics()
+
+    @registry.timed("sync")
+    def noop():
+        pass
+
+    noop()
+    registry.incr("hits", 3)
+    registry.reset()
+    assert registry.counters == {}
+    assert registry.histograms["sync"].count == 0
+    noop()
+    assert registry.histograms["sync"].count == 1
+
+
+def test_prometheus_output():
+    registry = metrics.Metrics()
+    registry.histogram("roll").observe(3e-6)
+    registry.histogram("roll").observe(2.0)
+    registry.histogram('we"ird').observe(1e-6)
+    registry.incr("rate_limited", 2)
+    text = registry.prometheus()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert "# TYPE simple_dice_duration_seconds histogram" in lines
+    assert "# TYPE simple_dice_events_total counter" in lines
+
+    buckets = [
+        int(line.rsplit(" ", 1)[1])
+        for line in lines if line.startswith('simple_dice_duration_seconds_bucket{name="roll",')
+    ]
+    assert len(buckets) == len(metrics._BUCKET_BOUNDS) + 1
+    # 累积计数单调不减，+Inf 桶等于总次数
+    assert buckets == sorted(buckets)
+    assert buckets[0] == 0 and buckets[-1] == 2
+    assert 'simple_dice_duration_seconds_bucket{name="roll",le="4e-06"} 1' in lines
+    assert 'simple_dice_duration_seconds_bucket{name="roll",le="+Inf"} 2' in lines
+    assert 'simple_dice_duration_seconds_count{name="roll"} 2' in lines
+    sum_line = next(line for line in lines if line.startswith('simple_dice_duration_seconds_sum{name="roll"}'))
+    assert float(sum_line.rsplit(" ", 1)[1]) == pytest.approx(2.000003)
+    assert 'simple_dice_duration_seconds_count{name="we\\"ird"} 1' in lines
+    assert 'simple_dice_events_total{name="rate_limited"} 2' in lines
+    for line in lines:
+        assert line.startswith("#") or re.fullmatch(r'simple_dice_\w+\{name="[^\n]*"(,le="[^"]+")?\} [\d.e+-]+', line)
+
+
+def test_write_prometheus_replaces_the_file(tmp_path):
+    registry = metrics.Metrics()
+    registry.incr("hits")
+    path = tmp_path / "sub" / "dice.prom"
+    registry.write_prometheus(path)
+    assert 'simple_dice_events_total{name="hits"} 1' in path.read_text(encoding="utf-8")
+    assert [p.name for p in path.parent.iterdir()] == ["dice.prom"]
+
+
+def test_profiler_keeps_the_slowest():
+    profiler = metrics.SlowExpressionProfiler()
+    profiler.record("1d6", 1.0)
+    assert profiler.slowest() == []
+    profiler.start(top_n=2)
+    for expression, elapsed in (("a", 0.1), ("b", 0.3), ("a", 0.2), ("c", 0.05), ("d", 0.4)):
+        profiler.record(expression, elapsed)
+    assert profiler.slowest() == [("d", 0.4), ("b", 0.3)]
+    assert profiler.sampled == 5
+    profiler.stop()
+    profiler.record("e", 9.0)
+    assert profiler.sampled == 5
+
+
+def test_metrics_command(plugin, run):
+    metrics.METRICS.reset()
+    run(collect(plugin.roll_dice, Event("/r 1d20")))
+    message = run(collect(plugin.dice_admin, Event("/dice metrics")))[0]
+    assert re.search(r"^cmd\.r: 1次 ", message, re.M)
+    assert re.search(r"^roll: 1次 ", message, re.M)
+    assert run(collect(plugin.dice_admin, Event("/dice metrics reset"))) == ["指标已清空"]
+    assert "cmd.r" not in run(collect(plugin.dice_admin, Event("/dice metrics")))[0]
@@ -0,0 +1,62 @@
+"""roll_history：环形缓冲区、结果校验与运行中压缩"""
+import json
+
+from conftest import plugin_module
+
+roll_history = plugin_module("roll_history")
+
+
+def make_store(tmp_path, capacity: int = 3):
+    return roll_history.HistoryStore(tmp_path / "history.jsonl", capacity, flush_delay=3600)
+
+
+def test_ring_buffer_keeps_stats_in_window(tmp_path, run):
+    store = make_store(tmp_path)
+
+    async def scenario():
+        for total in (1, 2, 3, 4):
+            store.record("user_a", None, "1d6", total)
+        store.record("user_a", None, "1d6", 100, hidden=True)
+        await store.close()
+
+    run(scenario())
+    history = store.get("user_a")
+    assert [r.total for r in history.recent(10)] == [100, 4, 3]
+    stats = history.stats["1d6"]
+    assert (stats.count, stats.total) == (2, 7)
+
+
+def test_non_real_totals_are_not_recorded(tmp_path, run):
+    store = make_store(tmp_path)
+
+    async def scenario():
+        store.record("user_a", "group_g", "(-8)**(1/3)", complex(1, 1.7))
+        store.record("user_a", "group_g", "1e308*10", float("inf"))
+        store.record("user_a", "group_g", "1d6", 4)
+        await store.close()
+
+    run(scenario())
+    assert [r.total for r in store.get("group_g").recent(10)] == [4]
+    lines = (tmp_path / "history.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)[4] for line in lines] == [4]
+
+
+def test_file_is_compacted_during_uptime(tmp_path, run):
+    store = make_store(tmp_path)
+    path = tmp_path / "history.jsonl"
+
+    async def scenario():
+        for i in range(200):
+            store.record("user_a", None, "1d6", i)
+            if i % 5 == 4:
+                await store.flush()
+        await store.close()
+
+    run(scenario())
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) <= roll_history._COMPACT_RATIO * store.capacity
+    # 重新载入后保留的仍是最近的记录
+    reloaded = make_store(tmp_path)
+    run(reloaded.load())
+    assert [r.total for r in reloaded.get("user_a").recent(10)] == [199, 198, 197]
+    run(reloaded.close())
@@ -0,0 +1,41 @@
+"""/r 与 roll_dice 的结果消息"""
+import re
+
+from conftest import Event, collect
+
+
+def roll(plugin, run, text: str) -> str:
+    return run(collect(plugin.roll_dice, Event(f"/r {text}")))[0]
+
+
+def test_message_shows_the_expression_as_typed(plugin, run):
+    message = roll(plugin, run, "1d6 * 1d6 ** 1d6")
+    assert message.startswith("掷骰 1d6 * 1d6 ** 1d6: [")
+    a, b, c = map(int, re.search(r"\[(\d+), (\d+), (\d+)\]", message).groups())
+    assert message.endswith(f"= {a * b ** c}")
+
+
+def test_message_for_scaled_die(plugin, run):
+    message = roll(plugin, run, "d20*2")
+    value = int(re.search(r"\[(\d+)\]", message).group(1))
+    assert message == f"掷骰 d20*2: [{value}] = {value * 2}"
+    assert re.fullmatch(r"掷骰 d20: \d+", roll(plugin, run, "d20"))
+
+
+def test_tool_message_shows_the_expression(plugin, run):
+    message = run(plugin.llm_roll_dice(Event(""), "2d6-1d4+3"))
+    assert message.startswith("掷骰 2d6-1d4+3: [")
+
+
+def test_non_real_result_is_rejected_and_not_recorded(plugin, run):
+    for expression in ("(-8)**(1/3)", "(1d2-3)**0.5"):
+        assert "不是实数" in roll(plugin, run, expression)
+    assert "不是实数" in run(plugin.llm_roll_dice(Event(""), "(-8)**(1/3)"))
+    assert roll(plugin, run, "history") == "暂无投掷记录"
+
+
+def test_trailing_reason_is_ignored(plugin, run):
+    assert re.fullmatch(r"掷骰 d20: \d+", roll(plugin, run, "1d20 攻击"))
+    assert re.fullmatch(r"掷骰 d20: \d+", roll(plugin, run, "1d20 reason"))
+    assert re.fullmatch(r"掷骰 1d20\+3: \[\d+\] = \d+", roll(plugin, run, "1d20+3 attack roll"))
+    assert run(plugin.llm_roll_dice(Event(""), "1d20 攻击")).startswith("掷骰 d20: ")
@@ -0,0 +1,76 @@
+"""同一份用户/群数据在所有读写入口下对应同一个 storage_id"""
+import json
+
+import pytest
+
+from conftest import Event, collect
+
+
+def group_event(user: str = "u1", message: str = "") -> Event:
+    return Event(message, user, "g1")
+
+
+GROUP_WRITERS = {
+    "kv_upsert": lambda p, run: run(p.kv_upsert(group_event(), multi='{"dc": 15}', scope="group")),
+    "kv_upsert_batch": lambda p, run: run(p.kv_upsert_batch(group_event(), {"group": {"dc": 15}})),
+    "kv_update": lambda p, run: run(p.kv_update(group_event(), key="dc", delta=15, scope="group")),
+    "/kv import group": lambda p, run: run(collect(p.kv_command, group_event(message='/kv import group {"dc": 15}'))),
+}
+
+USER_WRITERS = {
+    "kv_upsert": lambda p, run: run(p.kv_upsert(group_event(), multi='{"str": 15}')),
+    "kv_upsert_batch": lambda p, run: run(p.kv_upsert_batch(group_event(), {"user": {"str": 15}})),
+    "kv_update": lambda p, run: run(p.kv_update(group_event(), key="str", delta=15)),
+    "/kv set": lambda p, run: run(collect(p.kv_command, group_event(message="/kv set str 15"))),
+    "/kv add": lambda p, run: run(collect(p.kv_command, group_event(message="/kv add str 15"))),
+    "/kv import": lambda p, run: run(collect(p.kv_command, group_event(message='/kv import {"str": 15}'))),
+}
+
+
+@pytest.mark.parametrize("writer", GROUP_WRITERS)
+def test_group_data_is_shared_by_every_entry_point(plugin, run, writer):
+    GROUP_WRITERS[writer](plugin, run)
+    # 同群的另一个用户通过每个读取入口都能看到这份数据
+    reader = group_event("u2")
+    assert run(plugin.kv_read(reader, "dc", scope="group")) == "15"
+    assert json.loads(run(plugin.kv_list(reader, scope="group")))["items"] == {"dc": 15}
+    messages = run(collect(plugin.kv_command, group_event("u2", "/kv export group")))
+    assert json.loads(messages[1]) == {"dc": 15}
+    assert run(plugin.llm_roll_dice(reader, "1d1+@group.dc")).endswith("= 16")
+    assert "DC 15" in run(plugin.llm_ability_check(reader, "力量"))
+    # 其他群看不到
+    assert run(plugin.kv_read(Event("", "u2", "g2"), "dc", scope="group")) == "键 'dc' 不存在"
+    assert run(plugin._kv.get_storage("group_unknown")) == {}
+
+
+@pytest.mark.parametrize("writer", USER_WRITERS)
+def test_user_data_is_shared_by_every_entry_point(plugin, run, writer):
+    USER_WRITERS[writer](plugin, run)
+    # 同一用户在私聊中读取
+    reader = Event("", "u1")
+    assert run(plugin.kv_read(reader, "str")) == "15"
+    assert run(collect(plugin.kv_command, Event("/kv get str", "u1"))) == ["str = 15"]
+    assert json.loads(run(plugin.kv_list(reader)))["items"] == {"str": 15}
+    assert json.loads(run(collect(plugin.kv_command, Event("/kv export", "u1")))[1]) == {"str": 15}
+    assert run(plugin.llm_roll_dice(reader, "1d1+str")).endswith("= 16")
+    assert json.loads(run(plugin.llm_get_character(reader)))["abilities"]["力量"]["score"] == 15
+    # 其他用户看不到
+    assert run(plugin.kv_read(Event("", "u2", "g1"), "str")) == "键 'str' 不存在"
+
+
+def test_group_scope_in_private_chat_is_rejected(plugin, run):
+    private = Event("", "u1")
+    assert run(plugin.kv_upsert(private, key="dc", value=15, scope="group")).startswith("错误: 私聊中没有群数据")
+    assert run(plugin.kv_upsert_batch(private, {"group": {"dc": 15}})).startswith("错误: 私聊中没有群数据")
+    assert run(plugin.kv_read(private, "dc", scope="group")).startswith("错误: 私聊中没有群数据")
+    assert run(collect(plugin.kv_command, Event("/kv export group", "u1"))) == ["私聊中没有群数据"]
+    # 私聊中的群引用按不存在处理
+    assert "@group.dc 不存在" in run(plugin.llm_roll_dice(private, "1d1+@group.dc"))
+    assert run(plugin._kv.get_storage("group_")) == {}
+
+
+def test_legacy_shared_storage_is_reported_and_not_read(make_plugin, run, tmp_path, caplog):
+    (tmp_path / "kv.json").write_text(json.dumps({"user_unknown": {"str": 18}}), encoding="utf-8")
+    plugin = make_plugin()
+    assert any("user_unknown" in record.getMessage() for record in caplog.records)
+    assert run(plugin.kv_read(group_event(), "str")) == "键 'str' 不存在"